@@ -1,31 +1,41 @@
-import ast
 import json
 from typing import List, Optional, Dict, Union
 
 from fastapi import APIRouter, Depends, Request, UploadFile, File, HTTPException, Query, Body, Header
 from uuid import UUID
 
-from sqlalchemy.sql.expression import or_
 from sqlalchemy.orm import Session
 from starlette.background import BackgroundTasks
 # from fastapi_cache.decorator import cache
-from app.crud.catalog import get_all_fields
+from app.crud.catalog import get_all_fields, catalog_registry
 # from app.main import logger
 from app.utils.dependencies import get_db
-from app.db.db_models import Ad, User, Catalog, AdditionalFields
+from app.db.db_models import Ad, User
 from app.crud.user import get_current_user as get_user, get_current_user_or_none
 from app.crud.ad import publish_adv, delete_old_images, edit_adv, change_status_adv, \
-    get_paginated_advs, get_adv_data, get_adv_out, inc_adv_unique_views
+    get_paginated_advs, get_adv_data, get_adv_detail_data, get_adv_out, get_adv_owner_id, get_similar_advs
+from app.crud.feed import overlay_favorites
+from app.crud.views import adv_views_buffer
 from app.schemas.ad import AdOutModel, ItemsOutModel, AdCatalogOutModel, \
-    PaginatedItems, ChangeAdStatusModel, AddOrEditAdvModel, AdvAndCatalogModel
+    PaginatedItems, ChangeAdStatusModel, AddOrEditAdvModel, AdvAndCatalogModel, PhotosJobModel
 from app.utils.ad import validate_ad, validate_photos
+from app.utils.concurrency import run_db
+from app.utils.image_jobs import image_jobs
+from app.utils.pagination import get_feed_count_mode
 from app.logger import setup_logger
-# from app.utils.redis import custom_key_builder
+from app.utils.redis import ResponseCache
+from app.core.config import settings
 
 logger = setup_logger(__name__)
 
 router = APIRouter(prefix="/items", tags=["Advertisements"])
 
+# Ленты без пользователя и карточки объявлений - в памяти процесса и в Redis (utils/redis.ResponseCache).
+# Карточка кэшируется без пользователя, избранное подставляется после получения из кэша
+feed_cache = ResponseCache(namespace="feed", expire=settings.FEED_CACHE_TTL)
+card_cache = ResponseCache(namespace="ad_card", expire=settings.AD_CARD_CACHE_TTL)
+minicard_cache = ResponseCache(namespace="minicard", expire=settings.MINICARD_CACHE_TTL)
+
 
 # Получение всех объявлений с учетом фильтров, сортировки и поиска
 @router.post('', summary="Get all Advertisements by filters", status_code=200, response_model=PaginatedItems)
@@ -45,7 +55,10 @@ async def get_all_ads_by_filters(
     Возвращает:
     - PaginatedItems:
         - total: Кол-во объявлений.
+        - total_type: Тип total (exact/cached - точное, estimate - оценка, has_more - нижняя граница).
+        - has_more: Есть ли следующая страница.
         - items: Список объявлений.
+        - next_cursor: Курсор следующей страницы (null - если страниц больше нет).
     """
 
     try:
@@ -55,13 +68,14 @@ async def get_all_ads_by_filters(
     category = json_body.get('category', None)
     price_from = json_body.get('price_from', None)
     price_to = json_body.get('price_to', None)
-    sort = json_body.get('sort', 'date_desc')
+    sort = json_body.get('sort', 'date_desc')  # date_asc, date_desc, price_asc, price_desc, distance, relevance (при search)
     page = json_body.get('page', 1)
     limit = json_body.get('limit', 50)
     filters = json_body.get('filters', None)
     location = json_body.get('location', None)
     radius = json_body.get('radius', None)
     search = json_body.get('search', None)
+    cursor = json_body.get('cursor', None)  # Курсор следующей страницы (если передан, то page не используется)
 
     # Проверка, является ли юзер авторизованным и устанавливаем тип запроса в зависимости от результата проверки
     if current_user is not None:
@@ -72,9 +86,18 @@ async def get_all_ads_by_filters(
         query_type = 'all_no_user_category' if category else 'all_no_user_no_category'
 
     status = 3 # Ставим статус=3(publish)
+    count_mode = get_feed_count_mode(cursor, category, filters, price_from, price_to, location, search)
+
     # Вызываем функцию получения объявлений
-    ad_list = get_paginated_advs(query_type, category, sort, page, limit, status, db, user_id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
-    return ad_list
+    async def get_ad_list():
+        return await run_db(get_paginated_advs, query_type, category, sort, page, limit, status, db, user_id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id, cursor=cursor, count_mode=count_mode)
+
+    if current_user is None:
+        params = {"method": "POST", "category": category, "price_from": price_from, "price_to": price_to,
+                  "sort": sort, "page": page, "limit": limit, "filters": filters, "location": location,
+                  "radius": radius, "search": search, "cursor": cursor}
+        return await feed_cache.get_or_set(params, get_ad_list, tags=("feed",))
+    return await get_ad_list()
 
 
 # Маршрут для получения всех моделей Ad
@@ -86,6 +109,7 @@ async def get_all_ads(
         sort: str = "date_desc",
         page: int = 1,
         limit: int = Query(default=50, lte=100),
+        cursor: Optional[str] = None,
         filters: Dict[str, Union[str, List[str]]] = Body(None),  # Обновлено
         db: Session = Depends(get_db),
         current_user: Optional[User] = Depends(get_current_user_or_none)
@@ -100,6 +124,7 @@ async def get_all_ads(
     - sort: Сортировка.
     - page: Страница пагинации.
     - limit: Кол-во объявлений на одной странице.
+    - cursor: Курсор следующей страницы из предыдущего ответа (вместо page).
     - filters: Фильтры доп.полей.
     - db (Session): Сессия SQLAlchemy для взаимодействия с базой данных.
     - current_user (User): Объект пользователя (если авторизован)
@@ -107,7 +132,10 @@ async def get_all_ads(
     Возвращает:
     - PaginatedItems:
         - total: Кол-во объявлений.
+        - total_type: Тип total (exact/cached - точное, estimate - оценка, has_more - нижняя граница).
+        - has_more: Есть ли следующая страница.
         - items: Список объявлений.
+        - next_cursor: Курсор следующей страницы (null - если страниц больше нет).
     """
     status = 3
     location = {}
@@ -119,14 +147,21 @@ async def get_all_ads(
         query_type = 'all_no_user_category' if category else 'all_no_user_no_category'
     search = None
     radius = None
-    ad_list = get_paginated_advs(query_type, category, sort, page, limit, status, db, user_id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
+    count_mode = get_feed_count_mode(cursor, category, filters, price_from, price_to)
 
-    return ad_list
+    async def get_ad_list():
+        return await run_db(get_paginated_advs, query_type, category, sort, page, limit, status, db, user_id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id, cursor=cursor, count_mode=count_mode)
+
+    if current_user is None:
+        params = {"method": "GET", "category": category, "price_from": price_from, "price_to": price_to,
+                  "sort": sort, "page": page, "limit": limit, "filters": filters, "cursor": cursor}
+        return await feed_cache.get_or_set(params, get_ad_list, tags=("feed",))
+    return await get_ad_list()
 
 
 # Маршрут для получения модели объявления и Каталога по id объявления для редактирования
 @router.get('/catalog/{key}', summary="Get Ad and Catalog by Advertisement identifier", status_code=200, response_model=AdvAndCatalogModel)
-async def get_catalog_from_ad(key: UUID, db=Depends(get_db)):
+def get_catalog_from_ad(key: UUID, db=Depends(get_db)):
     """
     Получение объявления и связанного объекта каталога.
 
@@ -150,23 +185,17 @@ async def get_catalog_from_ad(key: UUID, db=Depends(get_db)):
 
         fields = {}
 
-        catalogs = db.query(Catalog).filter(Catalog.id == ad.catalog_id).outerjoin(AdditionalFields).filter(
-            or_(AdditionalFields.parent_id != None, AdditionalFields.parent_id == None)).all()
-        additional_fields = catalogs[0].additional_fields
+        # Скомпилированные доп.поля элемента каталога - из реестра каталога
+        validator = catalog_registry.get(db).validators[str(ad.catalog_id)]
         if ad.fields:
             for field in ad.fields:
-                matching_field = next((item for item in additional_fields if item.alias == field.key), None)
+                matching_field = validator.fields.get(field.key)
                 if matching_field:
-                    try:
-                        field_value_list = ast.literal_eval(field.value)
-                        if (type(field_value_list) != list) and (type(field_value_list) != bool):
-                            field_value_list = str(field_value_list)
-
-                        fields[matching_field.alias] = field_value_list
-                    except (SyntaxError, ValueError):
-                        value = field.value.lower()
-                        fields[matching_field.alias] = True if value == "true" else False if value == "false" else str(
-                            field.value)
+                    field_value_list = validator.decode(field.key, field.value)
+                    if (type(field_value_list) != list) and (type(field_value_list) != bool):
+                        field_value_list = str(field_value_list)
+
+                    fields[matching_field['alias']] = field_value_list
         if ad.photos:
             photos = [photo.id for photo in ad.photos]
         else:
@@ -188,8 +217,7 @@ async def get_catalog_from_ad(key: UUID, db=Depends(get_db)):
 
     try:
         # ad = db.query(Ad).get(key)
-        catalog = ad.catalog
-        catalog_info = get_all_fields(catalog.id, db)
+        catalog_info = get_all_fields(ad.catalog_id, db)
     except:
         logger.error(f"api/endpoints/ad. get_catalog_from_ad. Данные каталога не найдены: {key}")
         raise HTTPException(status_code=404, detail='Данные каталога не найдены')
@@ -237,7 +265,7 @@ async def get_user_ads_published(
     search = None
     radius = None
     user_id = current_user.id if current_user is not None else None
-    ad_list = get_paginated_advs(query_type, category, sort, page, limit, status, db, current_user.id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
+    ad_list = await run_db(get_paginated_advs, query_type, category, sort, page, limit, status, db, current_user.id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
 
     return ad_list
 
@@ -277,7 +305,7 @@ async def get_user_ads_waiting(
     search = None
     radius = None
     user_id = current_user.id if current_user is not None else None
-    ad_list = get_paginated_advs(query_type, category, sort, page, limit, status, db, current_user.id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
+    ad_list = await run_db(get_paginated_advs, query_type, category, sort, page, limit, status, db, current_user.id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
 
     return ad_list
 
@@ -317,7 +345,7 @@ async def get_user_ads_archived(
     search = None
     radius = None
     user_id = current_user.id if current_user is not None else None
-    ad_list = get_paginated_advs(query_type, category, sort, page, limit, status, db, current_user.id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
+    ad_list = await run_db(get_paginated_advs, query_type, category, sort, page, limit, status, db, current_user.id, filters, price_from, price_to, location, search, radius, auth_user_id=user_id)
 
     return ad_list
 
@@ -336,18 +364,29 @@ async def get_advertisement_by_id(key: UUID, device_id: str = Header(default=Non
     - AdOutModel: Объект объявления.
     """
 
-    ad = get_adv_data(key, db)
-
     if current_user:
         user_id = current_user.id
     else:
         user_id = None
 
-    if ad:
+    # Карточка без пользователя; устаревает при изменении объявления и объявлений владельца (user:{id})
+    async def get_card():
+        ad = await run_db(get_adv_detail_data, key, db)
+        return await run_db(get_adv_out, ad, None, db) if ad else None
+
+    async def get_card_tags():
+        owner_id = await run_db(get_adv_owner_id, key, db)
+        return [f"ad:{key}"] + ([f"user:{owner_id}"] if owner_id is not None else [])
+
+    ad_out = await card_cache.get_or_set({"key": key}, get_card, tags=get_card_tags)
+
+    if ad_out:
         if device_id:
-            await inc_adv_unique_views(user_id, device_id, ad, db)
+            # Просмотр записывается в БД пакетно, в фоне (см. crud/views)
+            adv_views_buffer.add(key, device_id, user_id)
 
-        ad_out = get_adv_out(ad, user_id, db)
+        if user_id:
+            ad_out = await run_db(overlay_favorites, ad_out, user_id, db)
         return ad_out
     else:
         logger.error(f"api/endpoints/ad. get_advertisement_by_id. Объявление не найдено: {key}")
@@ -391,8 +430,9 @@ async def add_advertisement(background_tasks: BackgroundTasks,
         logger.error(f"api/endpoints/ad. add_advertisement. Ошибка при получении данных из формы: {str(e)}")
         raise HTTPException(status_code=400, detail="Ошибка при получении данных из формы")
 
-    validate_photos(photos)
-    validate_ad(key, form_data, db)
+    # Проверка фото и полей, запись объявления - в пуле потоков (синхронная сессия БД, разбор фото)
+    await run_db(validate_photos, photos)
+    await run_db(validate_ad, key, form_data, db)
 
     try:
         user_id = current_user.id
@@ -400,7 +440,7 @@ async def add_advertisement(background_tasks: BackgroundTasks,
         try:
             logger.info("Запрос на создание объявления принят")
             # item_id = publish_adv(background_tasks, user_id, key, form_data, photos, db)
-            item_id = publish_adv(background_tasks, user_id, key, form_data, photos, db)
+            item_id = await run_db(publish_adv, background_tasks, user_id, key, form_data, photos, db)
             return {"id": item_id}
         except Exception as e:
             # Обработка исключения при вызове функции publish_adv
@@ -480,11 +520,11 @@ async def edit_advertisement(background_tasks: BackgroundTasks,
 
     # Удаляем лишние фото, которые убрал из объявления юзер
     # в списке old_photos идентификаторы фото, которые остались
-    delete_old_images(old_photos, key, db)
+    await run_db(delete_old_images, old_photos, key, db)
     if count_new > 0:
-        validate_photos(new_photos)
+        await run_db(validate_photos, new_photos)
 
-    catalog_id = db.query(Ad.catalog_id).filter(Ad.id == key).first()[0]
+    catalog_id = (await run_db(lambda: db.query(Ad.catalog_id).filter(Ad.id == key).first()))[0]
 
     try:
         user_id = current_user.id
@@ -498,18 +538,45 @@ async def edit_advertisement(background_tasks: BackgroundTasks,
 
     out_type = form_data.get("out_type", None)
 
-    adv_out = edit_adv(background_tasks, catalog_id, key, user_id, form_data, new_photos, out_type, db, old_photos)
+    adv_out = await run_db(edit_adv, background_tasks, catalog_id, key, user_id, form_data, new_photos, out_type, db,
+                           old_photos)
 
     logger.info("Изменение объявления прошло успешно")
 
     return adv_out
 
 
+# Эндпоинт статуса обработки фотографий объявления (после публикации или редактирования)
+@router.get("/photos_status/{key}", summary="Get photos processing status of Advertisement", status_code=200, response_model=PhotosJobModel)
+async def get_photos_status(key: UUID,
+                            db: Session = Depends(get_db),
+                            current_user: User = Depends(get_user)):
+    """
+    Статус обработки фотографий объявления, доступно только для владельца объявления.
+
+    Параметры:
+    - key (UUID): Идентификатор объявления.
+    - db (Session): Сессия SQLAlchemy для взаимодействия с базой данных.
+    - current_user (User): Объект пользователя(только Авторизованные).
+
+    Возвращает:
+    - status: queued / processing / done / failed.
+    - total, processed, failed: Кол-во фото всего, обработанных и не обработанных.
+    """
+
+    owner_id = await run_db(lambda: db.query(Ad.user_id).filter(Ad.id == key).scalar())
+    job = await image_jobs.get(key)
+    if owner_id != current_user.id or job is None:
+        logger.error(f"api/endpoints/ad. get_photos_status. Задача обработки фото не найдена: {key}")
+        raise HTTPException(status_code=404, detail='Задача обработки фото не найдена')
+    return job
+
+
 # Эндпоинт изменения статуса объявления на Ждет действия
 @router.post("/status_wait/{key}", summary="Change status of Advertisement to waiting", status_code=200, response_model=ChangeAdStatusModel)
-async def change_adv_status_wait(key: UUID,
-                                 db: Session = Depends(get_db),
-                                 current_user: User = Depends(get_user)):
+def change_adv_status_wait(key: UUID,
+                           db: Session = Depends(get_db),
+                           current_user: User = Depends(get_user)):
     """
     Изменяет статус объявления на "Ждет действия" по идентификатору, доступно только для владельца объявления.
 
@@ -530,9 +597,9 @@ async def change_adv_status_wait(key: UUID,
 
 # Эндпоинт изменения статуса объявления на опубликовано
 @router.post("/status_publish/{key}", summary="Change status of Advertisement to published", status_code=200, response_model=ChangeAdStatusModel)
-async def change_adv_status_publish(key: UUID,
-                                    db: Session = Depends(get_db),
-                                    current_user: User = Depends(get_user)):
+def change_adv_status_publish(key: UUID,
+                              db: Session = Depends(get_db),
+                              current_user: User = Depends(get_user)):
     """
     Изменяет статус объявления на "Опубликовано" по идентификатору, доступно только для владельца объявления.
 
@@ -553,9 +620,9 @@ async def change_adv_status_publish(key: UUID,
 
 # Эндпоинт изменения статуса объявления на Архивировано
 @router.post("/status_archive/{key}", summary="Change status of Advertisement to archived", status_code=200, response_model=ChangeAdStatusModel)
-async def change_adv_status_archive(key: UUID,
-                                    db: Session = Depends(get_db),
-                                    current_user: User = Depends(get_user)):
+def change_adv_status_archive(key: UUID,
+                              db: Session = Depends(get_db),
+                              current_user: User = Depends(get_user)):
     """
     Изменяет статус объявления на "Архивировано" по идентификатору, доступно только для владельца объявления.
 
@@ -576,9 +643,9 @@ async def change_adv_status_archive(key: UUID,
 
 # Эндпоинт изменения статуса объявления на Заблокировано
 @router.post("/status_block/{key}", summary="Change status of Advertisement to blocked", status_code=200, response_model=ChangeAdStatusModel)
-async def change_adv_status_block(key: UUID,
-                                  db: Session = Depends(get_db),
-                                  current_user: User = Depends(get_user)):
+def change_adv_status_block(key: UUID,
+                            db: Session = Depends(get_db),
+                            current_user: User = Depends(get_user)):
     """
     Изменяет статус объявления на "Заблокировано" по идентификатору, доступно только для владельца объявления.
 
@@ -608,57 +675,18 @@ async def get_similar_advertisements(key: UUID, db=Depends(get_db), current_user
     - current_user (User): Объект пользователя(Авторизован или нет). Optional.
 
     Возвращает:
-    - Список объявлений: до 10 объявлений.
+    - Список объявлений: до 10 объявлений, от наиболее похожих (цена, местоположение, ключевые доп.поля).
     """
 
     user_id = current_user.id if current_user else 0
-    status = 3  # статус=3(publish)
-
-    # Запрос с выборкой похожих объявлений
-    advs = (
-        db.query(Ad)
-        .filter(
-            Ad.id != key,
-            Ad.status_id == status,
-            Ad.user_id != user_id,
-            Ad.catalog_id == db.query(Ad.catalog_id)
-            .filter(Ad.id == key, Ad.status_id == status)
-            .subquery()
-            .as_scalar(),
-        )
-        .order_by(Ad.created_at.desc())
-        .limit(10)
-        .all()
-    )
 
-
-    ad_list = []
-    for ad in advs:
-        if ad.photos:
-            photos = ad.photos[0].id
-        else:
-            photos = ''
-
-        favorite = user_id in [user.id for user in ad.favorited_by]
-
-        ad_out = ItemsOutModel(
-            id=ad.id,
-            title=ad.title,
-            description=ad.description,
-            price=ad.price,
-            location=ad.location.to_dict(),
-            photos=photos,
-            favorite=favorite,
-            status=str(ad.status.status),
-            created_at=str(ad.created_at)
-        )
-        ad_list.append(ad_out)
+    ad_list = await run_db(get_similar_advs, key, user_id, db)
 
     return ad_list
 
 
-@router.get('/{key}/minicard', summary="Get Adv by ID (minicard)", status_code=200, response_model=ItemsOutModel)
-async def get_minicard_of_advertisement(key: UUID, db=Depends(get_db)):
+# Миникарточка объявления (без избранного) или None
+def get_minicard(key, db):
     ad = get_adv_data(key, db)
     if ad:
         photos = ad.photos[0].id if ad.photos else ''
@@ -675,6 +703,14 @@ async def get_minicard_of_advertisement(key: UUID, db=Depends(get_db)):
             created_at=str(ad.created_at)
         )
         return ad_out
+    return None
+
+
+@router.get('/{key}/minicard', summary="Get Adv by ID (minicard)", status_code=200, response_model=ItemsOutModel)
+async def get_minicard_of_advertisement(key: UUID, db=Depends(get_db)):
+    ad_out = await minicard_cache.get_or_set({"key": key}, lambda: run_db(get_minicard, key, db), tags=(f"ad:{key}",))
+    if ad_out:
+        return ad_out
 
     logger.error(f"api/endpoints/ad. get_minicard_of_advertisement. Объявление не найдено: {key}")
     raise HTTPException(status_code=404, detail="Объявление не найдено")
@@ -3,7 +3,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 from pydantic.error_wrappers import ValidationError
 from sqlalchemy.orm import Session
 
-from app.core.config import get_current_time, get_current_time2
+from app.core.config import get_current_time
 from app.crud import (
     user as user_crud,
     devices as devices_crud,
@@ -14,6 +14,8 @@ from app.logger import setup_logger, setup_logger_refresh
 from app.schemas import auth as auth_schemas, user as user_schemas
 from app.utils import dependencies, security, exception, \
     devices as devices_utils
+from app.utils.concurrency import run_db
+from app.crud.presence import user_presence
 from app.crud.user import get_current_user as get_user, change_notification_auth, get_user_by_id
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -41,7 +43,7 @@ logger_refresh = setup_logger_refresh(__name__)
         }])
     }
 )
-async def registration(
+def registration(
         user_data: user_schemas.UserRegistration,
         user_phone: str = Depends(security.decode_phone_token),
         db: Session = Depends(dependencies.get_db)
@@ -69,7 +71,7 @@ async def registration(
     status_code=200,
     response_model=auth_schemas.ResponseTokensGoogle
 )
-async def registration_google(
+def registration_google(
         google_data: auth_schemas.RequestDeviceData,
         db: Session = Depends(dependencies.get_db)
 ):
@@ -127,7 +129,7 @@ async def registration_google(
     status_code=200,
     response_model=auth_schemas.ResponseTokensGoogle
 )
-async def registration_apple(
+def registration_apple(
         apple_data: auth_schemas.RequestDeviceData,
         db: Session = Depends(dependencies.get_db)
 ):
@@ -187,7 +189,7 @@ async def registration_apple(
         }])
     }
 )
-async def login(
+def login(
         background_tasks: BackgroundTasks,
         form_data: OAuth2PasswordRequestForm = Depends(),
         device: str = Body(),
@@ -237,7 +239,7 @@ async def login(
         }])
     }
 )
-async def reset_password(
+def reset_password(
         new_password: str = Body(embed=True),
         user_phone: str = Depends(security.decode_phone_token),
         db: Session = Depends(dependencies.get_db)
@@ -263,7 +265,7 @@ async def reset_password(
         }])
     }
 )
-async def verify_phone(
+def verify_phone(
         device_data: auth_schemas.RequestDeviceData,
         user_id: int = Body(embed=True),
         social: str = Body(embed=True),
@@ -319,7 +321,7 @@ async def verify_phone(
         }])
     }
 )
-async def refresh(
+def refresh(
         refresh_token: str = Depends(dependencies.oauth2_scheme),
         db: Session = Depends(dependencies.get_db)
 ):
@@ -338,12 +340,9 @@ async def refresh(
     devices_crud.update_refresh_token(refresh_token, refresh_token_new, db)
     logger_refresh.info(f"/auth/refresh. Новый созданный токен: {refresh_token_new}")
     current_user = get_user_by_id(db, user_id)
-    if not current_user.online:
-        current_user.online = True
-
-    # Обновляем online_at
-    current_user.online_at = get_current_time2()
-    db.commit()
+    if current_user:
+        # Обновляем время активности (записывается в БД пакетно, см. crud/presence)
+        user_presence.touch(current_user.id)
 
     return {"access_token": access_token, "refresh_token": refresh_token_new}
 
@@ -383,7 +382,7 @@ async def changing_phone(
     old_phone = current_user.phone
 
     user = user_schemas.UserChangePhone(new_phone=new_phone, old_phone=old_phone)
-    phone = user_crud.update_phone(user=user, db=db)
+    phone = await run_db(user_crud.update_phone, user=user, db=db)
 
     if not phone:
         raise HTTPException(
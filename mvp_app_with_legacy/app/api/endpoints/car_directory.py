@@ -5,6 +5,7 @@ from app.crud.car import car_suggestion
 from app.logger import setup_logger
 from app.schemas import car as car_schemas
 from app.utils import exception
+from app.utils.concurrency import run_db
 from app.utils.dependencies import get_db
 
 router = APIRouter(prefix="/car", tags=["Car Data"])
@@ -28,7 +29,8 @@ async def car_directory(car: car_schemas.Car = Depends(),
     - completedFields: null or list of objects.
     """
 
-    suggestion = car_suggestion(db=db, car=car)
+    # Проверка версии и перестроение справочника - запросы к БД, выполняются вне event loop
+    suggestion = await run_db(car_suggestion, db=db, car=car)
     if not suggestion:
         logger.error(f"api/endpoints/car_directory- car_directory. Ошибка получения данных")
         raise HTTPException(status_code=400, detail={"msg": "Invalid data"})
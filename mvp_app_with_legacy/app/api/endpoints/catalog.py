@@ -2,22 +2,21 @@ import json
 from typing import List, Dict
 from uuid import UUID
 
-from fastapi_cache.decorator import cache
 from fastapi import APIRouter, Depends
 from fastapi.responses import Response
 from sqlalchemy.orm import Session
-from app.schemas.catalog import CatalogSchema, CatalogSchemaAdditionalFields
+from app.schemas.catalog import CatalogSchema, CatalogSubCategory, CatalogSchemaAdditionalFields
 from app.utils.dependencies import get_db
-from app.crud.catalog import get_catalog, get_all_fields
+from app.crud.catalog import get_catalog_json, get_all_fields, get_fields_validator, sync_catalog_registry
 from app.utils.additional_fields import validate_fields
-from app.utils.redis import custom_key_builder
+from app.utils.concurrency import run_db
+from app.utils.redis import cached
 
 router = APIRouter(prefix="/catalog", tags=["Catalog"])
 
 
 # Получение каталога с категориями
 @router.get("", summary="Get catalog", status_code=200, response_model=List[CatalogSchema])
-@cache(namespace="catalog", expire=3600, key_builder=custom_key_builder)
 async def get_catalog_data(db: Session = Depends(get_db)):
     """
     Получение каталога
@@ -28,13 +27,32 @@ async def get_catalog_data(db: Session = Depends(get_db)):
     Возвращает:
     - Список всех объектов каталога
     """
-    catalog = get_catalog(db) # получаем каталог
-    return catalog
+    await sync_catalog_registry()
+    content = await run_db(get_catalog_json, db) # готовый JSON дерева каталога
+    return Response(content=content, media_type="application/json")
+
+
+# Получение поддерева каталога
+@router.get("/{key}/tree", summary="Get catalog subtree by UUID", status_code=200, response_model=CatalogSubCategory)
+async def get_catalog_subtree(key: UUID, db: Session = Depends(get_db)):
+    """
+    Получение поддерева каталога
+
+    Параметры:
+    - key (UUID): Идентификатор элемента каталога.
+    - db (Session): Сессия SQLAlchemy для взаимодействия с базой данных.
+
+    Возвращает:
+    - Элемент каталога со всеми вложенными категориями
+    """
+    await sync_catalog_registry()
+    content = await run_db(get_catalog_json, db, key) # готовый JSON поддерева каталога
+    return Response(content=content, media_type="application/json")
 
 
 # Получение всех доп.полей
 @router.get("/fields", summary="Get all additional fields", response_model=List[CatalogSchemaAdditionalFields])
-@cache(namespace="fields", expire=3600, key_builder=custom_key_builder)
+@cached(namespace="fields", expire=3600, tags=("catalog",), stale=600)
 async def get_additional_fields(db: Session = Depends(get_db)):
     """
     Получение всех доп.полей каталога
@@ -46,13 +64,14 @@ async def get_additional_fields(db: Session = Depends(get_db)):
     - Список всех объектов каталога с доп.полями
     """
     key = None
-    fields = get_all_fields(key, db) # получаем весь каталог с доп.полями
+    await sync_catalog_registry()
+    fields = await run_db(get_all_fields, key, db) # получаем весь каталог с доп.полями
     return fields
 
 
 # Получение доп.поля по идентификатору каталога
 @router.get("/fields/{key}", summary="Get additional fields by UUID", response_model=CatalogSchemaAdditionalFields)
-@cache(namespace="field_by_key", expire=3600, key_builder=custom_key_builder)
+@cached(namespace="field_by_key", expire=3600, tags=("catalog",), stale=600)
 async def get_additional_fields_by_key(key: UUID, db: Session = Depends(get_db)):
     """
     Получение доп.полей по идентификатору каталога
@@ -64,7 +83,8 @@ async def get_additional_fields_by_key(key: UUID, db: Session = Depends(get_db))
     Возвращает:
     - Объект каталога с доп.полями
     """
-    field = get_all_fields(key, db) # получаем один раздел каталога с его доп.полями
+    await sync_catalog_registry()
+    field = await run_db(get_all_fields, key, db) # получаем один раздел каталога с его доп.полями
     return field
 
 
@@ -84,8 +104,9 @@ async def validate_addit_fields(
     Возвращает:
     - Список ошибок, если имеются, или пустой объект {'error': "", 'aliases': {}}
     """
-    field = get_all_fields(key, db) # Получаем доп.поля по идентификатору каталога
-    invalid_data = validate_fields(field, data, db) # Валидируем поля из запроса
+    await sync_catalog_registry()
+    validator = await run_db(get_fields_validator, key, db) # Получаем скомпилированные доп.поля по идентификатору каталога
+    invalid_data = await run_db(validate_fields, validator, data, db) # Валидируем поля из запроса (справочники - из БД)
     content = json.dumps(invalid_data)
 
     status_code = 400 if invalid_data['error'] or invalid_data['aliases'] else 200
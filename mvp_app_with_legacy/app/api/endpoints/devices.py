@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, Body, BackgroundTasks
 from sqlalchemy.orm import Session
 
 from app.crud import user as user_crud, devices as devices_crud
-from app.crud.user import change_notification_auth, delete_all_notification_auth
+from app.crud.user import change_notification_auth, delete_all_notification_auth, get_other_devices_unique_ids
 from app.logger import setup_logger
 from app.schemas import user as user_schemas
 from app.utils import exception, devices as devices_utils
@@ -17,7 +17,7 @@ logger = setup_logger(__name__)
     status_code=200,
     response_model=list[user_schemas.UserDevicesOut]
 )
-async def devices_list(
+def devices_list(
         user: user_schemas.UserOut = Depends(user_crud.get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -35,7 +35,7 @@ async def devices_list(
         }])
     }
 )
-async def device_delete(
+def device_delete(
         background_tasks: BackgroundTasks,
         uniqueId: str = Body(embed=True),
         user: user_schemas.UserOut = Depends(user_crud.get_current_user),
@@ -63,7 +63,7 @@ async def device_delete(
         }])
     }
 )
-async def devices_delete_all(
+def devices_delete_all(
         background_tasks: BackgroundTasks,
         refresh_token: str = Body(embed=True),
         user: user_schemas.UserOut = Depends(user_crud.get_current_user),
@@ -75,7 +75,9 @@ async def devices_delete_all(
         raise HTTPException(status_code=404, detail={
             "msg": "Непредвиденная ошибка"
         })
-    background_tasks.add_task(delete_all_notification_auth, user.id, refresh_token, db)
+    # Устройства для выхода - до их удаления (фоновая задача выполняется после ответа)
+    unique_ids = get_other_devices_unique_ids(user.id, refresh_token, db)
+    background_tasks.add_task(delete_all_notification_auth, unique_ids)
     delete_devices = devices_crud.delete_user_devices_except_current(
         refresh_token, user, db)
     if not delete_devices:
@@ -12,6 +12,7 @@ from app.db.db_models import User, DealStateEnum
 from app.logger import setup_logger
 from app.schemas.ad import PaginatedItems
 from app.schemas.feedback import FeedbackCreate, FeedbackResponse, FeedbackOut
+from app.utils.concurrency import run_db
 from app.utils.dependencies import get_db
 
 logger = setup_logger(__name__)
@@ -19,8 +20,8 @@ router = APIRouter(prefix="/feedback", tags=["FeedBack"])
 
 
 @router.post("/create", summary="Create Feedback", status_code=201, response_model=FeedbackResponse)
-async def create_feedback(data: FeedbackCreate, db: Session = Depends(get_db),
-                          current_user: User = Depends(get_current_user)):
+def create_feedback(data: FeedbackCreate, db: Session = Depends(get_db),
+                    current_user: User = Depends(get_current_user)):
     """
     Создание отзыва
 
@@ -88,7 +89,7 @@ async def create_feedback(data: FeedbackCreate, db: Session = Depends(get_db),
 
 
 @router.get("/user/{owner_id}", summary="Get Feedbacks by Owner ID", response_model=List[FeedbackOut])
-async def get_feedbacks_by_owner_id(owner_id: int, db: Session = Depends(get_db)):
+def get_feedbacks_by_owner_id(owner_id: int, db: Session = Depends(get_db)):
     """
     Выдача всех отзывов пользователя по его идентификатору
 
@@ -149,8 +150,8 @@ async def get_feedbacks_by_owner_id(owner_id: int, db: Session = Depends(get_db)
 # DELETE feedback by id and auth
 @router.delete("/{feedback_id}", summary="Delete Feedback by ID", status_code=202,
                dependencies=[Depends(get_current_user)])
-async def delete_feedback(feedback_id: UUID, db: Session = Depends(get_db),
-                          current_user: User = Depends(get_current_user)):
+def delete_feedback(feedback_id: UUID, db: Session = Depends(get_db),
+                    current_user: User = Depends(get_current_user)):
     """
     Удаление СВОЕГО отзыва авторизованным пользователем по идентификатору
 
@@ -236,6 +237,6 @@ async def get_all_users_ads_for_feedback(
         logger.error(f"api/endpoints/feedbacks- get_all_users_ads_for_feedback. Невозможно оставить отзыв на самого себя: {user_id}")
         raise HTTPException(status_code=400, detail="Невозможно оставить отзыв на самого себя")
 
-    ad_list = get_paginated_feedback_advs(search, sort, page, limit, user_id, db)
+    ad_list = await run_db(get_paginated_feedback_advs, search, sort, page, limit, user_id, db)
 
     return ad_list
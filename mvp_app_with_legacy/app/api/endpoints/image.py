@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, responses
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, responses
 from uuid import UUID
 from sqlalchemy.orm import Session
-from pathlib import Path
 
+from app.core.config import settings
 from app.logger import setup_logger
+from app.utils.concurrency import run_db
 from app.utils.dependencies import get_db
+from app.utils.image_variants import image_variants
 from app.crud import image as image_crud
 from app.schemas import ad as ad_schema
 
@@ -12,12 +17,35 @@ from app.schemas import ad as ad_schema
 router = APIRouter(prefix="/images", tags=["Images"])
 logger = setup_logger(__name__)
 
+# Файл варианта фото по идентификатору не изменяется - клиент и прокси могут хранить его бессрочно
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def is_not_modified(request: Request, etag: str, modified_at: float):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 # Получение изображения по идентификатору с учетом разрешения(resolution) изображения
 @router.get("/{resolution}/{uuid}", summary="Get Image By UUID", response_class=responses.FileResponse)
-async def get_image(resolution: ad_schema.PostImageResolutions, uuid: UUID, db: Session = Depends(get_db)):
+async def get_image(resolution: ad_schema.PostImageResolutions, uuid: UUID, request: Request,
+                    db: Session = Depends(get_db)):
     """
     Получение изображения по разрешению и идентификатору.
 
+    Путь к фото берется из кэша в памяти процесса, к БД - только при первом обращении к фото.
+    Вариант нужного разрешения получается из мастера фото при первом запросе и хранится в кэше на диске.
+    Ответ 304, если у клиента актуальная версия (If-None-Match / If-Modified-Since).
+
     Параметры:
     - resolution: Резрешение изображения.
     - uuid: Идентификатор изображения.
@@ -27,15 +55,29 @@ async def get_image(resolution: ad_schema.PostImageResolutions, uuid: UUID, db:
     - Изображение, как файл .webp
     """
 
-    db_photo = image_crud.get_image_by_uuid(db=db, image_uuid=uuid)
+    image_road = image_crud.get_cached_image_road(uuid) or await run_db(image_crud.get_image_road, db, uuid)
     # Если фото не найдено, выводим ошибку
-    if not db_photo:
-        logger.error(f"api/endpoints/image- get_image. Не удалось получить изображение")
+    if not image_road:
         raise HTTPException(404)
-    # Формируем путь(ссылку) для выдачи изображения
-    image = f"./files{db_photo.url}/{resolution.value}.webp"
-    # Если в данной директории нет файла, выводим ошибку
-    if not Path(image).is_file():
-        logger.error(f"api/endpoints/image- get_image. Изображение не найдено в хранилище")
+    # Вариант из хранилища или из мастера фото при первом запросе
+    image_file = await image_variants.get_file(image_road, resolution.value)
+    if not image_file:
+        logger.error(f"api/endpoints/image- get_image. Изображение не найдено в хранилище: {uuid} => {resolution.value}")
         raise HTTPException(404)
-    return image
+
+    path, stat_result, modified_at = image_file
+    headers = {
+        "ETag": image_variants.get_etag(image_road, resolution.value, stat_result),
+        "Last-Modified": formatdate(modified_at, usegmt=True),
+        "Cache-Control": IMAGE_CACHE_CONTROL
+    }
+
+    if is_not_modified(request, headers["ETag"], modified_at):
+        return Response(status_code=304, headers=headers)
+
+    # Файл отдает nginx (internal location), приложение только проверяет доступ к фото
+    if settings.IMAGE_ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = f"{settings.IMAGE_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{os.path.relpath(path, './files')}"
+        return Response(headers=headers, media_type="image/webp")
+
+    return responses.FileResponse(path, stat_result=stat_result, headers=headers, media_type="image/webp")
@@ -1,12 +1,10 @@
-import re
-
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.sql.expression import or_
 
 from app.crud.main import get_app_version, get_documents_by_type, get_advs_count, get_active_users_count
-from app.db.db_models import Ad, MainCatalogTitle
 from app.logger import setup_logger
 from app.schemas.main import AppVersionData, AutocompleteData, InfoDocumentsOut
+from app.utils.autocomplete import autocomplete_index
+from app.utils.concurrency import run_db
 from app.utils.dependencies import get_db
 from sqlalchemy.orm import Session
 
@@ -28,7 +26,7 @@ async def get_version(db: Session = Depends(get_db)):
     """
 
     # Вызываем функцию получения версии приложения
-    version = await get_app_version(db)
+    version = await run_db(get_app_version, db)
     # Если не получена запись - выводим ошибку
     if not version:
         logger.error(f"api/endpoints/main- get_version. Версия приложения не найдена")
@@ -51,70 +49,18 @@ async def autocomplete_search(
 
     Возвращает:
     - categories: список объектов => id=идентификатор категории, filter=Наименование категории. до 3-х значений.
-    - autocomplete: список строк => значения из заголовков и описания объявлений. до 7 значений. (отключено, пустое значение)
+    - autocomplete: список строк => слова и фразы из заголовков объявлений и каталога, по частоте. до 7 значений.
     """
 
     search = search.strip().lower()
 
-    # search_clause = or_(
-    #     Ad.title.ilike(f'%{search}%'),
-    #     Ad.description.ilike(f'%{search}%')
-    # )
-    # query = db.query(Ad).filter(search_clause).limit(7)
-    #
-    # results = query.all()
-    #
-    # autocomplete_set = set()  # Множество для хранения уникальных результатов
-    # for result in results:
-    #     title_lower = result.title.lower()
-    #     description_lower = result.description.lower()
-    #
-    #     # Поиск окончания слова и следующего слова с использованием регулярных выражений
-    #     pattern = re.compile(rf'\b({re.escape(search)}\S*)\s*(\S+)?\b')
-    #     title_matches = pattern.findall(title_lower)
-    #     description_matches = pattern.findall(description_lower)
-    #
-    #     for match in title_matches:
-    #         if match[1]:
-    #             autocomplete_set.add(' '.join(match))
-    #         else:
-    #             autocomplete_set.add(match[0])
-    #
-    #     for match in description_matches:
-    #         if match[1]:
-    #             autocomplete_set.add(' '.join(match))
-    #         else:
-    #             autocomplete_set.add(match[0])
-    #
-    # autocomplete_list = list(autocomplete_set)
-
-    # Поиск в модели MainCatalogTitle
-    # main_catalog_title_query = db.query(MainCatalogTitle).filter(
-    #     MainCatalogTitle.filter.ilike(f'%{search}%')
-    # )
-    #
-    # main_catalog_title_results = main_catalog_title_query.limit(3)
-
-    main_catalog_title_results = (
-        db.query(MainCatalogTitle)
-        .filter(MainCatalogTitle.filter.ilike(f'%{search}%'))
-        .limit(3)
-        .all()
-    )
-
-    categories = []
-    for result in main_catalog_title_results:
-        category = {
-            "id": result.parent_id,
-            "filter": result.filter
-        }
-        categories.append(category)
-
-    autocomplete_list = []
-    # Объединение результатов
+    # Подсказки и категории из префиксного индекса в памяти (см. utils/autocomplete)
+    if not autocomplete_index.loaded:
+        await run_db(autocomplete_index.load, db)
+
     response = {
-        "categories": categories,
-        "autocomplete": autocomplete_list
+        "categories": autocomplete_index.categories(search),
+        "autocomplete": autocomplete_index.suggest(search)
     }
 
     return response
@@ -133,7 +79,7 @@ async def get_terms(db: Session = Depends(get_db)):
     """
     doc_type = 'terms'
     # Вызываем функцию получения версии приложения
-    terms = await get_documents_by_type(doc_type, db)
+    terms = await run_db(get_documents_by_type, doc_type, db)
 
     # Если не получена запись - выводим ошибку
     if not terms:
@@ -156,7 +102,7 @@ async def get_offer(db: Session = Depends(get_db)):
 
     doc_type = 'offer'
     # Вызываем функцию получения версии приложения
-    offer = await get_documents_by_type(doc_type, db)
+    offer = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not offer:
         logger.error(f"api/endpoints/main- get_offer. Оферта не найдена")
@@ -178,7 +124,7 @@ async def get_license(db: Session = Depends(get_db)):
 
     doc_type = 'license'
     # Вызываем функцию получения версии приложения
-    kvik_license = await get_documents_by_type(doc_type, db)
+    kvik_license = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not kvik_license:
         logger.error(f"api/endpoints/main- get_license. Лицензионное соглашение не найдено")
@@ -200,7 +146,7 @@ async def get_seller_codex(db: Session = Depends(get_db)):
 
     doc_type = 'seller_codex'
     # Вызываем функцию получения версии приложения
-    seller_codex = await get_documents_by_type(doc_type, db)
+    seller_codex = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not seller_codex:
         logger.error(f"api/endpoints/main- get_seller_codex. Кодекс правил не найден")
@@ -222,7 +168,7 @@ async def get_privacy(db: Session = Depends(get_db)):
 
     doc_type = 'privacy'
     # Вызываем функцию получения версии приложения
-    privacy = await get_documents_by_type(doc_type, db)
+    privacy = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not privacy:
         logger.error(f"api/endpoints/main- get_privacy. Политика конфиденциальности не найдена")
@@ -244,7 +190,7 @@ async def get_agreement(db: Session = Depends(get_db)):
 
     doc_type = 'agreement'
     # Вызываем функцию получения версии приложения
-    agreement = await get_documents_by_type(doc_type, db)
+    agreement = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not agreement:
         logger.error(f"api/endpoints/main- get_agreement. Пользовательское соглашение не найдено")
@@ -266,7 +212,7 @@ async def get_rules(db: Session = Depends(get_db)):
 
     doc_type = 'rules'
     # Вызываем функцию получения версии приложения
-    rules = await get_documents_by_type(doc_type, db)
+    rules = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not rules:
         logger.error(f"api/endpoints/main- get_rules. Правила Кликса не найдены")
@@ -288,7 +234,7 @@ async def get_user_policy(db: Session = Depends(get_db)):
 
     doc_type = 'user_policy'
     # Вызываем функцию получения версии приложения
-    rules = await get_documents_by_type(doc_type, db)
+    rules = await run_db(get_documents_by_type, doc_type, db)
     # Если не получена запись - выводим ошибку
     if not rules:
         logger.error(f"api/endpoints/main- get_rules.Политика о данных пользователей не найдена")
@@ -309,8 +255,8 @@ async def get_stats(db: Session = Depends(get_db)):
     """
 
     # Вызываем функцию получения версии приложения
-    advs_count = await get_advs_count(db)
-    users_count = await get_active_users_count(db)
+    advs_count = await run_db(get_advs_count, db)
+    users_count = await run_db(get_active_users_count, db)
     return {
         "advs_count": advs_count,
         "users_count": users_count
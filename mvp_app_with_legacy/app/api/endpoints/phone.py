@@ -7,6 +7,7 @@ from app.db.db_models import User
 from app.logger import setup_logger
 from app.schemas import auth as auth_schemas
 from app.utils import security, phone as phone_utils, exception
+from app.utils.concurrency import run_db
 from app.utils.dependencies import get_db
 from app.crud.user import get_current_user as get_user
 
@@ -28,7 +29,7 @@ async def create_call_registration(
         phone: constr(regex=r"^(\+)[7][0-9]{10}$") = Path(),
         db: Session = Depends(get_db)
 ):
-    phone_exist = user_crud.get_user_by_phone(db, phone)
+    phone_exist = await run_db(user_crud.get_user_by_phone, db, phone)
     if phone_exist:
         logger.info(f"api/endpoints/phone- create_call_registration. Пользователь с таким номером уже существует: {phone_exist}")
         raise HTTPException(
@@ -36,12 +37,12 @@ async def create_call_registration(
                 "msg": "Пользователь с таким номером уже существует"
             }
         )
-    phone_crud.check_phone_blocking(phone, db)
-    call_result = phone_utils.call(phone=phone)
+    await run_db(phone_crud.check_phone_blocking, phone, db)
+    call_result = await phone_utils.call(phone=phone)
 
     if call_result["result"] == "ok":
         code = call_result["code"]
-        phone_crud.create_phone_call(phone=phone, verification_code=code, db=db)
+        await run_db(phone_crud.create_phone_call, phone=phone, verification_code=code, db=db)
         return {"msg": "success"}
     else:
         logger.error(f"api/endpoints/phone- create_call_registration. Ошибка сервиса звонков: {call_result['error_code']}")
@@ -75,19 +76,19 @@ async def create_call_reset_password(
         phone: constr(regex=r"^(\+)[7][0-9]{10}$") = Path(),
         db: Session = Depends(get_db)
 ):
-    phone_exist = user_crud.get_user_by_phone(db, phone)
+    phone_exist = await run_db(user_crud.get_user_by_phone, db, phone)
     if not phone_exist:
         logger.info(
             f"api/endpoints/phone- create_call_reset_password. Пользователь с таким номером не существует: {phone_exist}")
         raise HTTPException(status_code=400, detail={
             "msg": "Пользователя с таким номером не существует"
         })
-    phone_crud.check_phone_blocking(phone, db)
-    call_result = phone_utils.call(phone=phone)
+    await run_db(phone_crud.check_phone_blocking, phone, db)
+    call_result = await phone_utils.call(phone=phone)
 
     if call_result["result"] == "ok":
         code = call_result["code"]
-        phone_crud.create_phone_call(phone=phone, verification_code=code, db=db)
+        await run_db(phone_crud.create_phone_call, phone=phone, verification_code=code, db=db)
         return {"msg": "success"}
     else:
         logger.error(
@@ -115,19 +116,19 @@ async def create_call_reset_password(
 async def create_call_confirm_phone(
         phone: constr(regex=r"^(\+)[7][0-9]{10}$") = Path(),
         db: Session = Depends(get_db)):
-    phone_exist = user_crud.get_user_by_phone(db, phone)
+    phone_exist = await run_db(user_crud.get_user_by_phone, db, phone)
     if phone_exist:
         logger.info(
             f"api/endpoints/phone- create_call_confirm_phone. Пользователь с таким номером уже существует: {phone_exist}")
         raise HTTPException(status_code=400, detail={
             "msg": "Пользователь с таким номером уже существует"
         })
-    phone_crud.check_phone_blocking(phone, db)
-    call_result = phone_utils.call(phone=phone)
+    await run_db(phone_crud.check_phone_blocking, phone, db)
+    call_result = await phone_utils.call(phone=phone)
 
     if call_result["result"] == "ok":
         code = call_result["code"]
-        phone_crud.create_phone_call(phone=phone, verification_code=code, db=db)
+        await run_db(phone_crud.create_phone_call, phone=phone, verification_code=code, db=db)
         return {"msg": "success"}
     else:
         logger.error(
@@ -152,7 +153,7 @@ async def create_call_confirm_phone(
         }])
     }
 )
-async def check_phone_code(
+def check_phone_code(
         phone: constr(regex=r"^(\+)[7][0-9]{10}$") = Path(),
         code: str = Path(),
         db: Session = Depends(get_db)):
@@ -192,7 +193,7 @@ async def create_call_change_phone(
             }
         )
 
-    phone_exist = user_crud.get_user_by_phone(db, phone)
+    phone_exist = await run_db(user_crud.get_user_by_phone, db, phone)
     if phone_exist:
         logger.info(f"api/endpoints/phone- create_call_change_phone. Пользователь с таким номером уже существует")
         raise HTTPException(
@@ -200,13 +201,13 @@ async def create_call_change_phone(
                 "msg": "Пользователь с таким номером уже существует"
             }
         )
-    phone_crud.check_phone_blocking(phone, db)
+    await run_db(phone_crud.check_phone_blocking, phone, db)
 
-    call_result = phone_utils.call(phone=phone)
+    call_result = await phone_utils.call(phone=phone)
 
     if call_result["result"] == "ok":
         code = call_result["code"]
-        phone_crud.create_phone_call(phone=phone, verification_code=code, db=db)
+        await run_db(phone_crud.create_phone_call, phone=phone, verification_code=code, db=db)
         return {"msg": "success"}
     else:
         logger.error(
@@ -232,7 +233,7 @@ async def create_call_change_phone(
         }])
     }
 )
-async def check_phone_code_change(
+def check_phone_code_change(
         phone: constr(regex=r"^(\+)[7][0-9]{10}$") = Path(),
         code: str = Path(),
         current_user: User = Depends(get_user),
@@ -7,7 +7,8 @@ from sqlalchemy.orm import Session
 
 from app.logger import setup_logger
 from app.utils.dependencies import get_db
-from app.crud.user import get_current_user as get_user, check_user_online
+from app.crud.presence import apply_online_status
+from app.crud.user import get_current_user as get_user
 from app.db.db_models import User, UserSubscription
 
 
@@ -64,7 +65,7 @@ def unsubscribe_user(subscriber: int, subscribed_to: int, db: Session):
 
 
 @router.post("/subscribe/{user_id}", status_code=202, response_model=UserSubscriptionModel)
-async def subscribe_user_by_id(
+def subscribe_user_by_id(
         user_id: int,
         current_user: User = Depends(get_user),
         db: Session = Depends(get_db)
@@ -80,7 +81,7 @@ async def subscribe_user_by_id(
         logger.error(f"api/endpoints/subscription- subscribe_user_by_id. Такого пользователя не существует. user_id: {user_id}")
         raise HTTPException(status_code=400, detail="Такого пользователя не существует")
 
-    check_user_online(subscription.subscribed_to, db)
+    apply_online_status(subscription.subscribed_to)
 
     return {
         "id": subscription.subscribed_to.id,
@@ -95,7 +96,7 @@ async def subscribe_user_by_id(
 
 
 @router.post("/unsubscribe/{user_id}", status_code=202)
-async def unsubscribe_user_by_id(
+def unsubscribe_user_by_id(
     user_id: int,
     current_user: User = Depends(get_user),
     db: Session = Depends(get_db)
@@ -110,7 +111,7 @@ async def unsubscribe_user_by_id(
 
 
 @router.get("/get", status_code=200,  response_model=List[UserSubscriptionModel])
-async def get_subscriptions(
+def get_subscriptions(
     current_user: User = Depends(get_user),
     db: Session = Depends(get_db)
 ):
@@ -118,7 +119,7 @@ async def get_subscriptions(
     if current_user.subscriptions:
         for subscription in current_user.subscriptions:
 
-            check_user_online(subscription.subscribed_to, db)
+            apply_online_status(subscription.subscribed_to)
 
             subscription_user = {
                 "id": subscription.subscribed_to.id,
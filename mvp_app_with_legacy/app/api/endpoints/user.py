@@ -17,14 +17,17 @@ from app.crud import (
     devices as devices_crud
 )
 from app.crud.ad import get_paginated_advs
-from app.crud.user import add_or_remove_favorites, add_list_favorites, get_current_user_or_none, inc_unique_views, \
+from app.crud.feed import FEED_ITEM_OPTIONS, build_feed_items
+from app.crud.views import user_views_buffer
+from app.crud.user import add_or_remove_favorites, add_list_favorites, get_current_user_or_none, \
     create_cash_wallet, multiply_bonus, create_transaction
 from app.db.db_models import User, Ad, favorite_advs, WalletSettings, WalletTransactions, ServicesList
 from app.logger import setup_logger
 from app.schemas import user as user_schemas, auth as auth_schemas
-from app.schemas.ad import PaginatedItems, LocationOutModel, ItemsOutModel
+from app.schemas.ad import PaginatedItems, LocationOutModel
 from app.schemas.user import ListAdvsOut, CashWalletOut, DepositOrWithdrawModel, TransactionsResponse
 from app.utils import exception
+from app.utils.autocomplete import autocomplete_index
 from app.utils.dependencies import get_db
 from starlette.responses import JSONResponse
 
@@ -89,7 +92,7 @@ async def get_me(current_user: User = Depends(user_crud.get_current_user)):
     summary="Read single User",
     response_model=user_schemas.UserMiniCardOut
 )
-async def read_user_by_id(
+def read_user_by_id(
         user_id: int,
         device_id: str = Header(default=None),
         current_user: User = Depends(user_crud.get_current_user_or_none),
@@ -116,7 +119,8 @@ async def read_user_by_id(
 
     # GET "Device-Id" header from request name it as "device_id"
     if device_id:  # IF device_id is not None ===>
-        await inc_unique_views(current_user, device_id, user_id, db_user, db)
+        # Просмотр записывается в БД пакетно, в фоне (см. crud/views)
+        user_views_buffer.add(user_id, device_id, current_user.id if current_user else None)
 
     db_user.subscriptions_count = len(db_user.subscriptions)
     db_user.subscribers_count = len(db_user.subscribers)
@@ -129,7 +133,7 @@ async def read_user_by_id(
     summary="Upload User photo",
     status_code=202
 )
-async def create_upload_file(
+def create_upload_file(
         photo: UploadFile = File(),
         current_user=Depends(user_crud.get_current_user),
         db: Session = Depends(get_db)
@@ -146,7 +150,7 @@ async def create_upload_file(
     - info: "file 'Имя файла' saved at 'Путь файла'"
     """
 
-    result = await user_crud.upload_user_photo(photo, current_user.id, db)
+    result = user_crud.upload_user_photo(photo, current_user.id, db)
 
     if result:
         return JSONResponse(status_code=202, content={"detail": "Image uploaded successfully"})
@@ -170,7 +174,7 @@ async def create_upload_file(
         }])
     }
 )
-async def change_password(
+def change_password(
         data: user_schemas.UserChangePassword,
         current_user: user_schemas.UserId = Depends(user_crud.get_current_user),
         db: Session = Depends(get_db)
@@ -213,7 +217,7 @@ async def change_password(
 # Получение активных(опубликованных) объявлений по идентификатору пользователя
 @router.get("/{user_id}/published", summary="Get User's published advs", status_code=200,
             response_model=PaginatedItems)
-async def get_user_card_published(
+def get_user_card_published(
         user_id: int,
         sort: str = "date_desc",
         page: int = 1,
@@ -265,7 +269,7 @@ async def get_user_card_published(
 # Получение архивных(завершенных) объявлений по идентификатору пользователя
 @router.get("/{user_id}/archived", summary="Get User's archived advs", status_code=200,
             response_model=PaginatedItems)
-async def get_user_card_archived(
+def get_user_card_archived(
         user_id: int,
         sort: str = "date_desc",
         page: int = 1,
@@ -315,7 +319,7 @@ async def get_user_card_archived(
 
 
 @router.delete("/deactivate", summary="Deactivate User", status_code=200)
-async def deactivate_user(
+def deactivate_user(
         current_user: user_schemas.UserId = Depends(user_crud.get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -349,8 +353,10 @@ async def deactivate_user(
         for device in user.device:
             db.delete(device)
 
+        archived_ads = []
         for ad in user.ads:
             ad.status_id = 4
+            archived_ads.append(ad.id)
 
         characters = string.ascii_letters + string.digits
         unique_characters = random.sample(characters, len(characters))
@@ -371,6 +377,10 @@ async def deactivate_user(
 
         # Подтверждаем транзакцию
         db.commit()
+
+        # Объявления убираются из подсказок только после успешного commit
+        for ad_id in archived_ads:
+            autocomplete_index.remove_ad(ad_id)
     else:
         logger.error(f"api/endpoints/user- deactivate_user. Пользователь на найден. user_id: {current_user.id}")
         raise HTTPException(status_code=400, detail='User not found')
@@ -379,7 +389,7 @@ async def deactivate_user(
 
 
 @router.get("/image/{uuid}", summary="Get Image By UUID", response_class=responses.FileResponse)
-async def get_user_image(uuid: UUID, db: Session = Depends(get_db)):
+def get_user_image(uuid: UUID, db: Session = Depends(get_db)):
     """
     Получение изображения по разрешению и идентификатору.
 
@@ -411,7 +421,7 @@ async def get_user_image(uuid: UUID, db: Session = Depends(get_db)):
     "/edit",
     summary="Change Users data by Identifier"
 )
-async def edit_user_data_by_id(
+def edit_user_data_by_id(
         name: Optional[str] = Form(None),
         location: Optional[str] = Form(None),
         photo: Optional[UploadFile] = File(None),
@@ -431,25 +441,25 @@ async def edit_user_data_by_id(
     - errors: Список идентификаторов пользователей, у которых НЕ изменился статус.
     """
 
-    response_name, response_location, user_photo = await user_crud.edit_user_data(current_user.id, name, location,
-                                                                                  photo, delete_photo, db)
+    response_name, response_location, user_photo = user_crud.edit_user_data(current_user.id, name, location,
+                                                                            photo, delete_photo, db)
     # return response_name, response_location, user_photo
     return {"name": response_name, "location": response_location, "photo": user_photo}
 
 
 @router.post('/favorite/{adv_id}', summary="Add/remove adv to/from favorites", status_code=202)
-async def add_or_remove_favorite_advs_to_user(
+def add_or_remove_favorite_advs_to_user(
         adv_id: UUID,
         current_user: User = Depends(user_crud.get_current_user),
         db: Session = Depends(get_db)
 ):
-    result = await add_or_remove_favorites(current_user.id, adv_id, db)
+    result = add_or_remove_favorites(current_user.id, adv_id, db)
     return result
 
 
 @router.get("/favorite/get", summary="Get User's favorite advs", status_code=200,
             response_model=PaginatedItems)
-async def get_all_favorite_advs_of_user(
+def get_all_favorite_advs_of_user(
         # sort: str = "date_desc",
         page: int = 1,
         limit: int = Query(default=50, lte=100),
@@ -498,41 +508,27 @@ async def get_all_favorite_advs_of_user(
 
     total = favorite_ads.count()
     offset = (page - 1) * limit
-    favorite_ads = favorite_ads.offset(offset).limit(limit).all()
-
-    ad_list = []
-    for ad in favorite_ads:
-        photos = ad.photos[0].id if ad.photos else ''
-        favorite = current_user.id in [user.id for user in ad.favorited_by]
-        ad_out = ItemsOutModel(
-            id=ad.id,
-            title=ad.title,
-            description=ad.description,
-            price=ad.price,
-            location=ad.location.to_dict(),
-            photos=photos,
-            favorite=favorite,
-            status=ad.status.status,
-            created_at=str(ad.created_at)
-        )
-        ad_list.append(ad_out)
+    favorite_ads = favorite_ads.options(*FEED_ITEM_OPTIONS).offset(offset).limit(limit).all()
+
+    # Все объявления выборки - из избранного текущего пользователя
+    ad_list = build_feed_items(favorite_ads, current_user.id, db, favorite_ids={ad.id for ad in favorite_ads})
 
     return PaginatedItems(total=total, items=ad_list)
 
 
 @router.post('/favorite_list', summary="Add list of advs to favorites", status_code=202)
-async def add_favorite_advs_to_user_by_list(
+def add_favorite_advs_to_user_by_list(
         ad_list: List[UUID],
         current_user: User = Depends(user_crud.get_current_user),
         db: Session = Depends(get_db)
 ):
-    result = await add_list_favorites(current_user.id, ad_list, db)
+    result = add_list_favorites(current_user.id, ad_list, db)
     return result
 
 
 @router.post("/favorite_list/get", summary="Get favorite advs by list", status_code=200,
              response_model=PaginatedItems)
-async def get_all_favorite_advs_of_user(
+def get_all_favorite_advs_of_user(
         request_data: ListAdvsOut,
         db: Session = Depends(get_db)
 ):
@@ -558,30 +554,16 @@ async def get_all_favorite_advs_of_user(
 
     total = query.count()
     offset = (page - 1) * limit
-    advs = query.offset(offset).limit(limit).all()
-
-    adv_list = []
-    for ad in advs:
-        photos = ad.photos[0].id if ad.photos else ''
-        favorite = True
-        ad_out = ItemsOutModel(
-            id=ad.id,
-            title=ad.title,
-            description=ad.description,
-            price=ad.price,
-            location=ad.location.to_dict(),
-            photos=photos,
-            favorite=favorite,
-            status=ad.status.status,
-            created_at=str(ad.created_at)
-        )
-        adv_list.append(ad_out)
+    advs = query.options(*FEED_ITEM_OPTIONS).offset(offset).limit(limit).all()
+
+    # Список избранного передан клиентом - все объявления выборки в избранном
+    adv_list = build_feed_items(advs, None, db, favorite_ids={ad.id for ad in advs})
 
     return PaginatedItems(total=total, items=adv_list)
 
 
 @router.post('/request_contact/{user_id}', summary="Increment users contact request", status_code=200)
-async def increment_users_contact_request(
+def increment_users_contact_request(
         user_id: int,
         db: Session = Depends(get_db)
 ):
@@ -599,7 +581,7 @@ async def increment_users_contact_request(
 
 
 @router.get("/wallet/get", summary="Get current Users wallets")
-async def get_users_wallet(current_user: User = Depends(user_crud.get_current_user), db: Session = Depends(get_db)):
+def get_users_wallet(current_user: User = Depends(user_crud.get_current_user), db: Session = Depends(get_db)):
     """
     Получение Кошелька авторизованного пользователя.
 
@@ -628,8 +610,8 @@ async def get_users_wallet(current_user: User = Depends(user_crud.get_current_us
 
 
 @router.post("/wallet/deposit/cash", summary="Deposit current Users cash wallet")
-async def deposit_users_cash_wallet(cash: DepositOrWithdrawModel, current_user: User = Depends(user_crud.get_current_user),
-                                    db: Session = Depends(get_db)):
+def deposit_users_cash_wallet(cash: DepositOrWithdrawModel, current_user: User = Depends(user_crud.get_current_user),
+                              db: Session = Depends(get_db)):
     """
     Пополнение Кошелька авторизованного пользователя.
 
@@ -693,7 +675,7 @@ async def deposit_users_cash_wallet(cash: DepositOrWithdrawModel, current_user:
 
 
 @router.post("/wallet/withdraw/cash", summary="Withdraw current Users cash wallet")
-async def withdraw_users_cash_wallet(
+def withdraw_users_cash_wallet(
         cash: DepositOrWithdrawModel,
         transaction_token: str = Header(...),
         current_user: User = Depends(user_crud.get_current_user),
@@ -762,7 +744,7 @@ async def withdraw_users_cash_wallet(
 
 
 @router.get("/wallet/transactions", summary="Get All Users Transactions")
-async def get_users_transactions(
+def get_users_transactions(
         sort: str = "date_desc",
         # page: int = 1,
         # limit: int = Query(default=50, lte=100),
@@ -834,7 +816,7 @@ async def get_users_transactions(
 
 
 @router.get("/wallet/settings", summary="Get Minimal Deposit")
-async def get_wallet_settings(current_user: User = Depends(user_crud.get_current_user), db: Session = Depends(get_db)):
+def get_wallet_settings(current_user: User = Depends(user_crud.get_current_user), db: Session = Depends(get_db)):
     """
     Получение минимальной суммы пополнения кошелька
 
@@ -864,7 +846,7 @@ async def get_wallet_settings(current_user: User = Depends(user_crud.get_current
 
 
 @router.get("/wallet/services/get", summary="Withdraw current Users cash wallet")
-async def get_wallet_services(
+def get_wallet_services(
         current_user: User = Depends(user_crud.get_current_user),  # ToDo: Is only authorized ?
         db: Session = Depends(get_db)):
 
@@ -14,6 +14,13 @@ class Settings(BaseSettings):
 
     NOTIFICATION_TOKEN_URL: str = os.getenv("NOTIFICATION_TOKEN_URL")
     NOTIFICATION_TOKEN_PATH: str = os.getenv("NOTIFICATION_TOKEN_PATH")
+    # Пакетная авторизация устройств (пусто - сервис уведомлений не поддерживает, запросы по одному устройству)
+    NOTIFICATION_TOKEN_BATCH_PATH: str = os.getenv("NOTIFICATION_TOKEN_BATCH_PATH", "")
+    NOTIFICATION_BATCH_SIZE: int = os.getenv("NOTIFICATION_BATCH_SIZE", 100)  # Устройств в пакетном запросе
+    NOTIFICATION_CONCURRENCY: int = os.getenv("NOTIFICATION_CONCURRENCY", 10)  # Одновременных запросов к сервису уведомлений
+    NOTIFICATION_MAX_CONNECTIONS: int = os.getenv("NOTIFICATION_MAX_CONNECTIONS", 20)  # Соединений с сервисом уведомлений
+    NOTIFICATION_TIMEOUT: int = os.getenv("NOTIFICATION_TIMEOUT", 5)  # Таймаут запроса (секунды)
+    NOTIFICATION_RETRIES: int = os.getenv("NOTIFICATION_RETRIES", 5)  # Повторов недоставленного запроса
 
     EXPECTED_USER_AGENT: str = os.getenv("EXPECTED_USER_AGENT")
     APP_API_KEY: str = os.getenv("APP_API_KEY")
@@ -35,6 +42,38 @@ class Settings(BaseSettings):
 
     ONLINE_USER_EXPIRE_MINUTES: int = os.getenv("ONLINE_USER_EXPIRE_MINUTES")
 
+    FEED_COUNT_CACHE_TTL: int = os.getenv("FEED_COUNT_CACHE_TTL", 30)
+    FEED_CACHE_TTL: int = os.getenv("FEED_CACHE_TTL", 30)  # Страницы ленты для неавторизованных в Redis (секунды)
+    AD_CARD_CACHE_TTL: int = os.getenv("AD_CARD_CACHE_TTL", 60)  # Карточки объявлений в Redis (секунды)
+    MINICARD_CACHE_TTL: int = os.getenv("MINICARD_CACHE_TTL", 300)  # Миникарточки объявлений в Redis (секунды)
+    RESPONSE_CACHE_LOCAL_TTL: int = os.getenv("RESPONSE_CACHE_LOCAL_TTL", 5)  # Ответы в памяти процесса (секунды)
+    RESPONSE_CACHE_LOCAL_SIZE: int = os.getenv("RESPONSE_CACHE_LOCAL_SIZE", 2000)  # Ответов в памяти процесса
+
+    DB_POOL_SIZE: int = os.getenv("DB_POOL_SIZE", 50)
+    CATALOG_REFRESH_INTERVAL: int = os.getenv("CATALOG_REFRESH_INTERVAL", 300)  # Перезагрузка метаданных каталога (секунды)
+    AUTOCOMPLETE_REFRESH_INTERVAL: int = os.getenv("AUTOCOMPLETE_REFRESH_INTERVAL", 300)  # Перезагрузка индекса подсказок (секунды)
+    CAR_DIRECTORY_REFRESH_INTERVAL: int = os.getenv("CAR_DIRECTORY_REFRESH_INTERVAL", 600)  # Проверка версии справочника автомобилей (секунды)
+
+    SIMILAR_ADS_LIMIT: int = os.getenv("SIMILAR_ADS_LIMIT", 10)  # Похожих объявлений в выдаче
+    SIMILAR_ADS_STORED: int = os.getenv("SIMILAR_ADS_STORED", 20)  # Хранится похожих на объявление (запас на снятые с публикации)
+    SIMILAR_ADS_CANDIDATES: int = os.getenv("SIMILAR_ADS_CANDIDATES", 500)  # Кандидатов при пересчете похожих (ближайшие по цене)
+
+    VIEWS_FLUSH_INTERVAL: int = os.getenv("VIEWS_FLUSH_INTERVAL", 10)  # Период записи просмотров в БД (секунды)
+
+    DB_CONCURRENCY: int = os.getenv("DB_CONCURRENCY", 40)  # Потоков для синхронных запросов к БД (меньше DB_POOL_SIZE)
+
+    IMAGE_WORKERS: int = os.getenv("IMAGE_WORKERS", 2)  # Процессов обработки фото (на каждый процесс приложения)
+    IMAGE_JOBS_CONCURRENCY: int = os.getenv("IMAGE_JOBS_CONCURRENCY", 4)  # Объявлений, фото которых обрабатываются одновременно
+    IMAGE_JOB_RETRIES: int = os.getenv("IMAGE_JOB_RETRIES", 2)  # Повторов обработки фото при ошибке
+    IMAGE_JOB_STATUS_TTL: int = os.getenv("IMAGE_JOB_STATUS_TTL", 3600)  # Хранение статуса обработки фото (секунды)
+    IMAGE_JOBS_DIR: str = os.getenv("IMAGE_JOBS_DIR", "./files/image_jobs")  # Загруженные фото до завершения обработки
+    IMAGE_FILES_CACHE_SIZE: int = os.getenv("IMAGE_FILES_CACHE_SIZE", 100000)  # Путей к фото в кэше
+    IMAGE_FILES_CACHE_TTL: int = os.getenv("IMAGE_FILES_CACHE_TTL", 3600)  # Хранение пути к фото в кэше (секунды)
+    IMAGE_VARIANTS_DIR: str = os.getenv("IMAGE_VARIANTS_DIR", "./files/variants")  # Кэш вариантов фото на диске
+    IMAGE_VARIANTS_CACHE_SIZE: int = os.getenv("IMAGE_VARIANTS_CACHE_SIZE", 5120)  # Размер кэша вариантов фото (МБ, на все процессы)
+    # Префикс internal location nginx (корень - ./files) для выдачи фото через X-Accel-Redirect (пусто - файл отдает приложение)
+    IMAGE_ACCEL_REDIRECT_PREFIX: str = os.getenv("IMAGE_ACCEL_REDIRECT_PREFIX", "")
+
     ACCESS_TOKEN_SECRET_KEY: str = os.getenv("ACCESS_TOKEN_SECRET_KEY")
     ACCESS_TOKEN_ALGORITHM: str = os.getenv("ACCESS_TOKEN_ALGORITHM")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
@@ -62,6 +101,15 @@ class Settings(BaseSettings):
 
     TELEFON_IP_API_URL: str = os.getenv("TELEFON_IP_API_URL")
 
+    TELEPHONY_PROVIDER: str = os.getenv("TELEPHONY_PROVIDER", "voicepassword")  # voicepassword, telefon_ip, fake
+    TELEPHONY_TIMEOUT: int = os.getenv("TELEPHONY_TIMEOUT", 10)  # Таймаут запроса к сервису звонков (секунды)
+    TELEPHONY_CONNECT_TIMEOUT: int = os.getenv("TELEPHONY_CONNECT_TIMEOUT", 3)  # Таймаут соединения (секунды)
+    TELEPHONY_MAX_CONNECTIONS: int = os.getenv("TELEPHONY_MAX_CONNECTIONS", 20)  # Соединений с сервисом звонков
+    TELEPHONY_RETRIES: int = os.getenv("TELEPHONY_RETRIES", 2)  # Повторов, если запрос не дошел до сервиса звонков
+    TELEPHONY_BREAKER_FAILURES: int = os.getenv("TELEPHONY_BREAKER_FAILURES", 5)  # Ошибок подряд до отключения сервиса звонков
+    TELEPHONY_BREAKER_RESET: int = os.getenv("TELEPHONY_BREAKER_RESET", 30)  # Отключение сервиса звонков после ошибок (секунды)
+    TELEPHONY_FAKE_DELAY: int = os.getenv("TELEPHONY_FAKE_DELAY", 0)  # Задержка ответа тестового сервиса звонков (мс)
+
     REDIS_HOST: str = os.getenv("REDIS_HOST")
     REDIS_PORT: str = os.getenv("REDIS_PORT")
 
@@ -1,29 +1,59 @@
-import ast
 import json
 import os
 import shutil
 import uuid
 from datetime import datetime
 from fastapi import HTTPException
-from sqlalchemy import or_, func, distinct, cast, Integer, Float
+from sqlalchemy import or_, func, distinct, Index
 from sqlalchemy.sql.expression import and_
 
-from app.core.config import get_current_time2
-from app.crud.catalog import get_all_fields
-from app.crud.user import check_user_online
+from app.crud.image import evict_image_road, count_image_references
+from app.crud.catalog import get_all_fields, get_fields_validator, catalog_registry
+from app.crud.feed import FEED_ITEM_OPTIONS, get_favorite_ids, build_feed_items
+from app.crud.field_values import add_field_values, delete_field_values, range_filter_subquery, \
+    bool_filter_subquery
+from app.crud.geo import get_radius_subquery, upsert_ad_geo_point
+from app.crud.search import get_search_subquery, upsert_ad_search_document
+from app.crud.similar import get_similar_ads, update_similar_ads, remove_similar_ads
+from app.crud.presence import apply_online_status
 from app.logger import setup_logger
 from app.schemas.ad import ItemsOutModel, PaginatedItems, AdOutModel, OwnerOutModel
 from app.utils.ad import validate_location, get_dynamic_title
 from app.utils.additional_fields import validate_fields
+from app.utils.autocomplete import autocomplete_index
 from app.utils.image import save_images
-from sqlalchemy.orm import Session, aliased, joinedload
-from app.db.db_models import Ad, AdStatus, AdPhotos, Location, AdFields, AdvCategories, Catalog, AdditionalFields, User, \
-    UserLocation, AdvViews
+from app.utils.image_variants import image_variants
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_clause, make_count_key, get_total_count, \
+    COUNT_EXACT
+from sqlalchemy.orm import Session, joinedload, selectinload
+from app.db.db_models import Ad, AdStatus, AdPhotos, Location, AdFields, AdvCategories, User, \
+    UserLocation
 from app.db.list_constants import LIST_OF_RANGES, FIELDS_LIST
-from math import radians
 
 logger = setup_logger(__name__)
 
+# Опции загрузки карточки объявления (см. get_adv_detail_data)
+AD_DETAIL_OPTIONS = (
+    selectinload(Ad.fields),
+    selectinload(Ad.photos),
+    joinedload(Ad.location),
+    joinedload(Ad.status),
+    joinedload(Ad.user).joinedload(User.photo),
+)
+
+# Составные индексы курсорной пагинации ленты: условие (ключ сортировки, id) < (значение, id) курсора
+# (utils/pagination.keyset_clause) и порядок выдачи обслуживаются одним индексом
+ADS_KEYSET_INDEXES = (
+    Index("ix_ads_created_at_id", Ad.created_at, Ad.id),
+    Index("ix_ads_price_id", Ad.price, Ad.id),
+)
+
+
+# Создание индексов пагинации для существующей таблицы объявлений (новая база получает их в create_all)
+def create_ads_keyset_indexes(db: Session):
+    for index in ADS_KEYSET_INDEXES:
+        index.create(bind=db.connection(), checkfirst=True)
+
 # Изменение статуса объявления
 def change_post_status(db: Session, post_id: uuid, status_id: int):
     db_post = db.query(Ad).filter(Ad.id == post_id).first()
@@ -51,20 +81,28 @@ def change_post_status(db: Session, post_id: uuid, status_id: int):
         db_post.blocked_at = datetime.now()
 
     db.commit()
+
+    # Подсказки автокомплита и похожие объявления строятся только по опубликованным объявлениям.
+    # Редактирование снимает объявление с публикации и возвращает статус после загрузки фото - списки
+    # похожих пересчитываются с новыми ценой, местоположением и доп.полями
+    if status_id == 3:
+        autocomplete_index.add_ad(db_post.id, db_post.title)
+        update_similar_ads(db_post.id, db)
+    elif old_status == 3:
+        autocomplete_index.remove_ad(db_post.id)
+        remove_similar_ads(db_post.id, db)
     return old_status
 
 
-# Внесение записей для фотографий объявления
+# Внесение записей для фотографий объявления - images_roads: список (путь, порядковый номер)
 def write_post_images_roads(db: Session, post_id: uuid, images_roads: list):
-    images_roads_objects = [AdPhotos(url=x, ad_id=post_id, id=uuid.uuid4()) for x in images_roads]
-    db.bulk_save_objects(images_roads_objects)
-    db.commit()
-    return True
-
-
-async def write_image_road(db: Session, post_id: uuid, image_road: str, order: int):
-    image_road_object = AdPhotos(url=image_road, ad_id=post_id, id=uuid.uuid4(), order=order)
-    db.add(image_road_object)
+    # Фото, уже записанные для объявления (повторная обработка задачи после перезапуска), не дублируются
+    existing = {url for url, in db.query(AdPhotos.url).filter(AdPhotos.ad_id == post_id)}
+    for image_road, order in images_roads:
+        if image_road in existing:
+            continue
+        existing.add(image_road)
+        db.add(AdPhotos(url=image_road, ad_id=post_id, id=uuid.uuid4(), order=order))
     db.commit()
     return True
 
@@ -82,12 +120,17 @@ def delete_old_images(images, ad_id, db):
         # Собираем все id фотографий, которые нужно удалить
         images_to_delete = [str(adv_image.id) for adv_image in db.query(AdPhotos.id).filter(AdPhotos.ad_id == ad_id).all() if not any(image["id"] == str(adv_image.id) for image in images)]
 
-        # Удаляем все выбранные фотографии и соответствующие директории
+        # Удаляем все выбранные фотографии и директории, на которые больше не ссылается ни одна фотография
         for image_id in images_to_delete:
             adv_image = db.query(AdPhotos).get(image_id)
             if adv_image:
                 adv_url = f"./files{adv_image.url}/"
                 db.delete(adv_image)
+                db.flush()
+                evict_image_road(image_id)
+                if count_image_references(db, adv_image.url):
+                    continue
+                image_variants.remove(adv_image.url)
                 if os.path.exists(adv_url):
                     shutil.rmtree(os.path.dirname(adv_url))
                 # print(f'Deleted directory: {os.path.dirname(adv_url)}')
@@ -173,6 +216,9 @@ def publish_adv(background_tasks, user_id, key, form_data, photos, db):
     db.refresh(ad)
     ad_id = ad.id
     print('ad_id', ad_id)
+
+    # Координаты объявления для поиска по радиусу
+    upsert_ad_geo_point(ad_id, location.lat, location.long, db)
     try:
         categories = form_data.get("categories")
         categories = json.loads(categories)
@@ -195,6 +241,9 @@ def publish_adv(background_tasks, user_id, key, form_data, photos, db):
         logger.error(f"crud/ad. publish_adv. Ошибка при создании записей в модели AdFields: {key} => {str(e)}")
         return
 
+    # Поисковый документ (заголовок, описание, доп.поля)
+    upsert_ad_search_document(ad.id, db)
+
     try:
         # Устанавливаем статус-опубликовано и бэкграундом запускаем обработку и добавление фотографий
         ad_status = 3  # => status = publish
@@ -232,6 +281,7 @@ def publish_adv(background_tasks, user_id, key, form_data, photos, db):
 
 # Публикация доп.полей
 def publish_fields(item_id, fields, db):
+    published_fields = {}
     for key, value in fields.items():
         str_value = str(value)
         if len(str_value) == 0:
@@ -239,6 +289,9 @@ def publish_fields(item_id, fields, db):
         elif value or type(value) == bool:
             ad_field = AdFields(ad_id=item_id, key=key, value=str_value)
             db.add(ad_field)
+            published_fields[key] = value
+    # Числовые и логические значения - в типизированную таблицу для фильтров
+    add_field_values(item_id, published_fields, db)
     db.commit()
     return
 
@@ -282,11 +335,11 @@ def edit_adv(background_tasks, catalog_id, key, user_id, form_data, new_photos,
         if "fields" in form_data:
             fields = json.loads(form_data.get("fields"))
 
-            additional_fields_in_catalog = get_all_fields(ad.catalog_id, db)
+            fields_validator = get_fields_validator(ad.catalog_id, db)
 
-            if additional_fields_in_catalog['additional_fields'] and fields:
+            if fields_validator.fields and fields:
 
-                invalid_fields = validate_fields(additional_fields_in_catalog, fields, db)
+                invalid_fields = validate_fields(fields_validator, fields, db)
                 if invalid_fields['error'] or invalid_fields['aliases']:  # Ошибки доп.полей
                     errors['fields'] = invalid_fields
 
@@ -385,6 +438,11 @@ def edit_adv(background_tasks, catalog_id, key, user_id, form_data, new_photos,
         ad.updated_at = datetime.now()
         db.commit()
 
+        if "location" in form_data:
+            upsert_ad_geo_point(ad.id, ad.location.lat, ad.location.long, db)
+
+        upsert_ad_search_document(ad.id, db)
+
         status_id = old_status
         background_tasks.add_task(save_images, images=new_photos, post_id=ad.id, status_id=status_id, db=db, old_photos=old_photos)
     except Exception as e:
@@ -434,6 +492,7 @@ def edit_adv(background_tasks, catalog_id, key, user_id, form_data, new_photos,
 def delete_fields(item_id, db):
     try:
         db.query(AdFields).filter_by(ad_id=item_id).delete()
+        delete_field_values(item_id, db)
         db.commit()
     except Exception as e:
         db.rollback()
@@ -489,41 +548,23 @@ def check_if_editable(catalog_id, item_id, db):
 
 # Функция запроса на получения объявлений с учётом фильтров, сортировки и поиска, а также формирования выдачи
 def get_paginated_advs(query_type, category, sort, page, limit, status, db, current_user, filters, price_from, price_to,
-                       location, search, radius, auth_user_id=None):
+                       location, search, radius, auth_user_id=None, cursor=None, count_mode=COUNT_EXACT):
     offset = (page - 1) * limit  # Получаем значение смещения для пагинации
 
-    ads, total = get_query_by_type(query_type, sort, category, status, current_user, db, filters, offset, limit,
-                                   price_from, price_to, location, search, radius)
+    ads, distances, pagination = get_query_by_type(query_type, sort, category, status, current_user, db, filters, offset, limit,
+                                        price_from, price_to, location, search, radius, cursor=cursor,
+                                        count_mode=count_mode)
 
-    ad_list = []
-    for ad in ads:
-        photos = ad.photos[0].id if ad.photos else ''
-        if auth_user_id is not None:
-            favorite = auth_user_id in [user.id for user in ad.favorited_by]
-            # print(f'auth_user_id {auth_user_id}: ad_id: {ad.id} - {favorite}')
-        else:
-            # favorite = current_user in [user.id for user in ad.favorited_by]
-            favorite = False
+    ad_list = build_feed_items(ads, auth_user_id, db, distances=distances)
 
-        ad_out = ItemsOutModel(
-            id=ad.id,
-            title=ad.title,
-            description=ad.description,
-            price=ad.price,
-            location=ad.location.to_dict() if ad.location else {},
-            photos=photos,
-            favorite=favorite,
-            status=ad.status.status,
-            created_at=str(ad.created_at)
-        )
-        ad_list.append(ad_out)
-
-    return PaginatedItems(total=total, items=ad_list)
+    return PaginatedItems(items=ad_list, **pagination)
 
 
 # Функция получения списка объявлений с учётом фильтров, сортировки и поиска
+# Пагинация: по странице (offset/limit) или по курсору (keyset) - если получен cursor, то offset не используется
+# count_mode - режим подсчета total (см. utils/pagination)
 def get_query_by_type(query_type, sort, category, status, user_id, db, filters, offset, limit, price_from,
-                      price_to, location, search, radius):
+                      price_to, location, search, radius, cursor=None, count_mode=COUNT_EXACT):
     # query_type = 'all_no_user_no_category'
     # Получаем объявления со статусом=опубликовано с полученной сортировкой
 
@@ -556,13 +597,15 @@ def get_query_by_type(query_type, sort, category, status, user_id, db, filters,
             .join(Ad.categories)
             .filter(AdvCategories.category_id == category)
         )
-    sort_column = (  # Сортируем объявления по значению sort
-        Ad.created_at.asc() if sort == 'date_asc' else
-        Ad.created_at.desc() if sort == 'date_desc' else
-        Ad.price.asc() if sort == 'price_asc' else
-        Ad.price.desc() if sort == 'price_desc' else
-        Ad.created_at.desc()
-    )
+
+    # Ключ сортировки и направление (ключ + Ad.id используются и для курсорной пагинации)
+    sort_key_name = 'price' if sort in ('price_asc', 'price_desc') else 'created_at'
+    sort_key = getattr(Ad, sort_key_name)
+    sort_desc = sort not in ('date_asc', 'price_asc')
+    sort_column = sort_key.desc() if sort_desc else sort_key.asc()  # Сортируем объявления по значению sort
+    order_clauses = [sort_column]
+    distance_expression = None
+    rank_expression = None
 
 
     # Если получены фильтры местроположения, то применяем их
@@ -609,6 +652,7 @@ def get_query_by_type(query_type, sort, category, status, user_id, db, filters,
         except StopIteration:
             exception_filters_list = []
 
+        typed_subqueries = []
         filter_clauses = []
         for key, value in filters.items():
 
@@ -616,38 +660,27 @@ def get_query_by_type(query_type, sort, category, status, user_id, db, filters,
             # объект с ключом year_of_issue в котором есть поля ключ(from):значение(строка) и ключ(to):значение(строка)
             # выборка тех записей в которых значение key(year_of_issue) >= from и <= to
             if key in exception_filters_list:
-                # Обработка фильтрации для year_of_issue с полями from и to
+                # Обработка фильтрации для year_of_issue с полями from и to (по типизированным значениям)
                 if isinstance(value, dict):
                     value_from = value.get('from', None)
                     value_to = value.get('to', None)
 
-                    if value_from == 'null':
-                        value_from = None
-
-                    if value_to == 'null':
-                        value_to = None
-
-                    if value_from and value_to and value_from != '' and value_to != '':
-                        filter_clauses.append(
-                            and_(
-                                AdFields.key == key,
-                                cast(AdFields.value, Integer).between(int(value_from), int(value_to))
-                            )
-                        )
-                    elif value_from and value_from != '':
-                        filter_clauses.append(
-                            and_(
-                                AdFields.key == key,
-                                cast(AdFields.value, Integer) >= int(value_from)
-                            )
-                        )
-                    elif value_to and value_to != '':
-                        filter_clauses.append(
-                            and_(
-                                AdFields.key == key,
-                                cast(AdFields.value, Integer) <= int(value_to)
-                            )
-                        )
+                    value_from = None if value_from in (None, 'null', '') else value_from
+                    value_to = None if value_to in (None, 'null', '') else value_to
+
+                    try:
+                        value_from = float(value_from) if value_from is not None else None
+                        value_to = float(value_to) if value_to is not None else None
+                    except (TypeError, ValueError):
+                        logger.error(f"crud/ad. get_query_by_type. Некорректный диапазон фильтра: {key} => {value}")
+                        raise HTTPException(status_code=400, detail={key: "Неправильное значение"})
+
+                    if value_from is not None or value_to is not None:
+                        typed_subqueries.append(range_filter_subquery(key, value_from, value_to, db))
+
+            # == BOOLEAN_FILTERS ==
+            elif isinstance(value, bool):
+                typed_subqueries.append(bool_filter_subquery(key, value, db))
 
             # == MAIN_FILTERS ==
             elif isinstance(value, list):
@@ -658,14 +691,19 @@ def get_query_by_type(query_type, sort, category, status, user_id, db, filters,
                 # обычные поля, ключ - значение(строка) - строго только это значение
                 filter_clauses.append(and_(AdFields.key == key, AdFields.value == value))
 
-        subquery = (
-            db.query(AdFields.ad_id)
-            .filter(or_(*filter_clauses))
-            .group_by(AdFields.ad_id)
-            .having(func.count(distinct(AdFields.key)) == len(filters))
-            .as_scalar()
-        )
-        query = query.filter(Ad.id.in_(subquery))
+        # Диапазоны и логические поля - отдельные подзапросы по индексам (key, value), пересекаются планировщиком
+        for subquery in typed_subqueries:
+            query = query.filter(Ad.id.in_(subquery))
+
+        if filter_clauses:
+            subquery = (
+                db.query(AdFields.ad_id)
+                .filter(or_(*filter_clauses))
+                .group_by(AdFields.ad_id)
+                .having(func.count(distinct(AdFields.key)) == len(filter_clauses))
+                .as_scalar()
+            )
+            query = query.filter(Ad.id.in_(subquery))
 
     # Если получены фильтры цены, то применяем их
     if price_from is not None:
@@ -674,57 +712,95 @@ def get_query_by_type(query_type, sort, category, status, user_id, db, filters,
     if price_to is not None:
         query = query.filter(Ad.price <= int(price_to))
 
-    # Если получено поле поиска, то применяем поиск
+    # Если получено поле поиска, то применяем полнотекстовый поиск (см. crud/search).
+    # Строка из пробелов - без поиска (все объявления), как и пустая
+    search = search.strip() if search else None  # Remove leading/trailing whitespaces
     if search:
-        search = search.strip()  # Remove leading/trailing whitespaces
-        search_clause = or_(
-            Ad.title.ilike(f'%{search}%'),
-            Ad.description.ilike(f'%{search}%')
-        )
-        query = query.filter(search_clause)
+        search_subquery = get_search_subquery(search, db)
+        query = query.join(search_subquery, Ad.id == search_subquery.c.ad_id)
+        rank_expression = search_subquery.c.rank
+
+        if sort == 'relevance':
+            # Сортировка по релевантности (убывание)
+            sort_key_name, sort_key, sort_desc = 'rank', rank_expression, True
+            order_clauses = [rank_expression.desc()]
 
     # Если получены фильтры местоположения и радиус, то применяем их
     if location and radius:
         latitude = location.get('lat', None)
         longitude = location.get('long', None)
-        if sort:
-            query = query.order_by(sort_column)
         if latitude is not None and longitude is not None:
-            lat1, lon1 = radians(float(latitude)), radians(float(longitude))
-
-            # Alias for the Location table
-            loc_alias = aliased(Location)
-
-            # Add filter for distance comparison using the join
-            query = query.join(loc_alias, Ad.id == loc_alias.ad_id)
-            query = query.filter(
-                func.acos(
-                    func.sin(func.radians(cast(loc_alias.lat, Float))) * func.sin(lat1)
-                    + func.cos(func.radians(cast(loc_alias.lat, Float))) * func.cos(lat1)
-                    * func.cos(func.radians(cast(loc_alias.long, Float)) - lon1)
-                )
-                * 6371  # Earth's radius in kilometers
-                <= radius
-            )
+            # Объявления в радиусе: предфильтр по индексу координат, затем точное расстояние (в метрах)
+            radius_subquery = get_radius_subquery(float(latitude), float(longitude), float(radius), db)
+            query = query.join(radius_subquery, Ad.id == radius_subquery.c.ad_id)
+            query = query.filter(radius_subquery.c.distance <= float(radius) * 1000)
+            distance_expression = radius_subquery.c.distance
+
+            if sort and sort != 'distance':
+                # Расстояние - дополнительная сортировка (в курсорном режиме порядок строго (ключ, id))
+                if not cursor:
+                    order_clauses.append(distance_expression.asc())
+            else:
+                # Сортировка по расстоянию (возрастание)
+                sort_key_name, sort_key, sort_desc = 'distance', distance_expression, False
+                order_clauses = [distance_expression.asc()]
+
+    # Запрос для подсчета общего кол-ва записей (до условия курсора и сортировки)
+    count_query = query
+    count_key = make_count_key(query_type=query_type, category=category, status=status, user_id=user_id,
+                               filters=filters, price_from=price_from, price_to=price_to, location=location,
+                               search=search, radius=radius)
+
+    # Уникальный порядок: ключ сортировки + идентификатор объявления
+    order_clauses.append(Ad.id.desc() if sort_desc else Ad.id.asc())
+    query = query.order_by(*order_clauses).options(*FEED_ITEM_OPTIONS)
+
+    # Вычисляемые колонки: расстояние (для выдачи) и релевантность (ключ курсора при сортировке по ней)
+    extra_columns = []
+    if distance_expression is not None:
+        extra_columns.append(distance_expression.label('distance'))
+    if sort_key_name == 'rank':
+        extra_columns.append(rank_expression.label('rank'))
+    if extra_columns:
+        query = query.add_columns(*extra_columns)
+
+    # Применяем пагинацию: курсор - продолжаем после последнего полученного объявления, иначе смещение
+    if cursor:
+        cursor_value, cursor_id = decode_cursor(cursor, sort, sort_key_name)
+        query = query.filter(keyset_clause(sort_key, Ad.id, sort_desc, cursor_value, cursor_id))
+    else:
+        query = query.offset(offset)
+
+    # Берем на одну запись больше, чтобы узнать есть ли следующая страница
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    total, total_type = get_total_count(count_query, count_mode, count_key, db, 0 if cursor else offset, len(rows))
+    rows = rows[:limit]
+
+    distances = {}
+    if extra_columns:
+        ads = [row[0] for row in rows]
+        if distance_expression is not None:
+            distances = {row[0].id: row.distance for row in rows}
+    else:
+        ads = rows
 
-            # Вычисляем расстояние от заданной точки до местоположения объявления
-            distance_expression = (
-                    func.acos(
-                        func.sin(func.radians(cast(loc_alias.lat, Float))) * func.sin(lat1)
-                        + func.cos(func.radians(cast(loc_alias.lat, Float))) * func.cos(lat1)
-                        * func.cos(func.radians(cast(loc_alias.long, Float)) - lon1)
-                    )
-                    * 6371 * 1000  # Convert Earth's radius to meters
-            )
-            # Добавляем сортировку по расстоянию (возрастание)
-            query = query.order_by(distance_expression.asc())
+    if not rows:
+        last_value = None
+    elif sort_key_name in ('distance', 'rank'):
+        last_value = getattr(rows[-1], sort_key_name)
     else:
-        query = query.order_by(sort_column)
+        last_value = getattr(ads[-1], sort_key_name)
+
+    next_cursor = encode_cursor(sort, last_value, ads[-1].id) if has_more else None
+    pagination = {"total": total, "total_type": total_type, "has_more": has_more, "next_cursor": next_cursor}
+    return ads, distances, pagination
+
 
-    # Получаем общее кол-во полученных записей и применяем пагинацию
-    total = query.count()
-    ads = query.offset(offset).limit(limit).all()
-    return ads, total
+# Похожие объявления: до SIMILAR_ADS_LIMIT опубликованных объявлений из сохраненного списка (crud/similar)
+def get_similar_advs(key, user_id, db):
+    advs = get_similar_ads(key, user_id, db, options=FEED_ITEM_OPTIONS)
+    return build_feed_items(advs, user_id, db)
 
 
 def get_adv_data(key, db):
@@ -734,6 +810,21 @@ def get_adv_data(key, db):
     return ad
 
 
+# Объявление для карточки (GET /items/{key}): доп.поля, фото, местоположение, статус и владелец с фото
+# загружаются вместе с объявлением, а не отдельными запросами при обращении
+def get_adv_detail_data(key, db):
+    ad = db.query(Ad).options(*AD_DETAIL_OPTIONS).filter(Ad.id == key).first()
+    if not ad:
+        logger.error(f"crud/ad- get_adv_detail_data. Объявление не найдено: {key}")
+    return ad
+
+
+# Владелец объявления (для тегов кэша карточки)
+def get_adv_owner_id(key, db):
+    return db.query(Ad.user_id).filter(Ad.id == key).scalar()
+
+
+# Карточка объявления. Объявление должно быть получено через get_adv_detail_data
 def get_adv_out(ad, user_id, db):
     communication = {
         "phone": ad.contact_by_phone,
@@ -747,16 +838,14 @@ def get_adv_out(ad, user_id, db):
     else:
         photos = []
 
-    if user_id:
-        favorite = user_id in [user.id for user in ad.favorited_by]
-    else:
-        favorite = False
+    owner = apply_online_status(ad.user)
+    user_ads, user_ads_count = get_owner_ads_to_adv(owner.id, ad.id, db)
 
-    # ad.views += 1
-    # db.commit()
+    # Избранное - для самого объявления и объявлений владельца одним запросом
+    favorite_ids = get_favorite_ids(user_id, [ad.id] + [user_ad.id for user_ad in user_ads], db)
+    favorite = ad.id in favorite_ids
 
-    owner, user_ads, user_ads_count  = get_owner_to_adv(ad.user_id, ad.id, db)
-    adv_list = set_owner_advlist_to_adv(user_ads, ad.status.status, user_id)
+    adv_list = build_feed_items(user_ads, user_id, db, favorite_ids=favorite_ids)
     owner_out = set_owner_out_model_to_adv(owner, user_ads_count, adv_list, ad.contact_by_phone)
     ad_out = set_ad_out_model_to_adv(ad, communication, fields, photos, owner_out, favorite)
 
@@ -766,70 +855,40 @@ def get_adv_out(ad, user_id, db):
 def get_fields_to_adv(catalog_id, adv_fields, db):
     fields = {}
 
-    catalogs = db.query(Catalog).filter(Catalog.id == catalog_id).outerjoin(AdditionalFields).filter(
-        or_(AdditionalFields.parent_id != None, AdditionalFields.parent_id == None)).all()
-
-    additional_fields = catalogs[0].additional_fields
+    # Скомпилированные доп.поля элемента каталога - из реестра каталога
+    validator = catalog_registry.get(db).validators[str(catalog_id)]
     if adv_fields:
         for field in adv_fields:
-            matching_field = next((item for item in additional_fields if item.alias == field.key), None)
+            matching_field = validator.fields.get(field.key)
             if matching_field:
-                try:
-                    field_value_list = ast.literal_eval(field.value)
-                    fields[matching_field.title] = field_value_list
-                except (SyntaxError, ValueError):
-                    value = field.value.lower()
-                    fields[
-                        matching_field.title] = True if value == "true" else False if value == "false" else field.value
+                fields[matching_field['title']] = validator.decode(field.key, field.value)
     return fields
 
 
-def get_owner_to_adv(user_id, key, db):
-    owner = db.query(User).get(user_id)
-    check_user_online(owner, db)
-
-    user_ads = db.query(Ad).order_by(Ad.created_at.desc()).filter(Ad.user_id == owner.id, Ad.id != key,
-                                                                  Ad.status_id == 3).limit(2).all()
-    user_ads_count = db.query(func.count(Ad.id)).filter(Ad.user_id == owner.id, Ad.status_id == 3).scalar()
+# Два последних опубликованных объявления владельца (кроме текущего) и общее кол-во его опубликованных
+# объявлений - одним запросом: кол-во считается оконной функцией до LIMIT. Берем 3 строки,
+# т.к. текущее объявление входит в кол-во, но не в список
+def get_owner_ads_to_adv(owner_id, key, db):
+    rows = (
+        db.query(Ad, func.count(Ad.id).over().label('total'))
+        .filter(Ad.user_id == owner_id, Ad.status_id == 3)
+        .order_by(Ad.created_at.desc(), Ad.id.desc())
+        .options(*FEED_ITEM_OPTIONS)
+        .limit(3)
+        .all()
+    )
 
-    return owner, user_ads, user_ads_count
+    user_ads_count = rows[0].total if rows else 0
+    user_ads = [row[0] for row in rows if row[0].id != key][:2]
+    return user_ads, user_ads_count
 
 
 def get_owner_lite_to_adv(user_id, db):
     owner = db.query(User).get(user_id)
-    check_user_online(owner, db)
+    apply_online_status(owner)
     return owner
 
 
-def set_owner_advlist_to_adv(user_ads, ad_status, user_id):
-    adv_list = []
-    for user_ad in user_ads:
-        if user_ad.photos:
-            user_photos = user_ad.photos[0].id
-        else:
-            user_photos = ''
-
-        if user_id:
-            favorite = user_id in [user.id for user in user_ad.favorited_by]
-        else:
-            favorite = False
-
-        # Создание объекта AdAdvModel для каждого объявления пользователя
-        adv = ItemsOutModel(
-            id=user_ad.id,
-            title=user_ad.title,
-            description=user_ad.description,
-            price=user_ad.price,
-            location=user_ad.location.to_dict(),
-            photos=user_photos,
-            favorite=favorite,
-            status=ad_status,
-            created_at=str(user_ad.created_at)
-        )
-        adv_list.append(adv)
-    return adv_list
-
-
 def set_owner_out_model_to_adv(owner, user_ads_count, adv_list, contact_by_phone):
     photo_id = None
     if owner.photo:
@@ -888,59 +947,3 @@ def set_ad_out_model_to_adv(ad, communication, fields, photos, owner_out, favori
         owner=owner_out
     )
     return ad_out
-
-
-async def inc_adv_unique_views(current_user_id, device_id, adv, db):
-    if current_user_id:
-        adv_views_auth = db.query(AdvViews).filter(AdvViews.device_id == device_id,
-                                                     AdvViews.adv_viewed_id == adv.id,
-                                                     AdvViews.user_id == current_user_id).first()
-
-        # Если нет записей с авторизацией, проверям есть ли записи без авторизации для текущего устройства
-        if not adv_views_auth:
-            adv_views_no_auth = db.query(AdvViews).filter(AdvViews.device_id == device_id,
-                                                            AdvViews.adv_viewed_id == adv.id,
-                                                            AdvViews.user_id == None).first()
-
-            # Если нет записей БЕЗ авторизации, то создаем новую и увеличиваем просмотры
-            if not adv_views_no_auth:
-                # CREATE NEW views record without auth => then =>
-                new_adv_view = AdvViews(id=uuid.uuid4(),
-                                          user_id=current_user_id,
-                                          adv_viewed_id=adv.id,
-                                          device_id=device_id,
-                                          created_at=get_current_time2())
-                db.add(new_adv_view)
-                adv.views += 1
-                db.commit()
-
-
-
-            # Если существует запись БЕЗ авторизации, добавляем в эту запись авторизацию
-            else:
-                adv_views_no_auth.user_id = current_user_id
-                db.commit()
-
-        # Если запись с авторизацией уже есть, то пропускаем
-        else:
-            pass
-
-    # Если запрос без авторизации
-    else:
-        # Проверяем существуют ли записи без учета авторизации для текущего устройства
-        adv_views_no_auth = db.query(AdvViews).filter(AdvViews.device_id == device_id,
-                                                        AdvViews.adv_viewed_id == adv.id).first()
-        # Если нет записей, то создаем новую и увеличиваем просмотры
-        if not adv_views_no_auth:
-            # CREATE NEW views record without auth => then =>
-            new_adv_view = AdvViews(id=uuid.uuid4(),
-                                      adv_viewed_id=adv.id,
-                                      device_id=device_id,
-                                      created_at=get_current_time2())
-            db.add(new_adv_view)
-            adv.views += 1
-            db.commit()
-
-        # Если нашли хоть одну запись для текущего устройства, то пропускаем
-        else:
-            pass
@@ -0,0 +1,32 @@
+from sqlalchemy import func, select
+
+from app.db.db_models import DataBackfill
+from app.db.session import engine, SessionLocal
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+BACKFILL_LOCK_ID = 7301  # Ключ pg_advisory_lock заполнения данных при запуске
+
+
+# Разовые заполнения данных при запуске приложения: (имя, функция(db)).
+# Выполняет один процесс - остальные процессы (APP_WORKERS > 1) не ждут и не повторяют его работу.
+# Выполненное заполнение отмечается в data_backfills и при следующих запусках пропускается.
+# Блокировка - на отдельном соединении: сессия заполнения возвращает соединение в пул после каждого commit
+def run_backfills(backfills):
+    with engine.connect() as lock_connection:
+        if not lock_connection.execute(select(func.pg_try_advisory_lock(BACKFILL_LOCK_ID))).scalar():
+            logger.info("crud/backfill. run_backfills. Заполнение данных выполняет другой процесс")
+            return
+        try:
+            with SessionLocal() as db:
+                completed = {name for (name,) in db.query(DataBackfill.name)}
+                for name, backfill in backfills:
+                    if name in completed:
+                        continue
+                    backfill(db)
+                    db.add(DataBackfill(name=name))
+                    db.commit()
+                    logger.info(f"crud/backfill. run_backfills. Заполнение выполнено: {name}")
+        finally:
+            lock_connection.execute(select(func.pg_advisory_unlock(BACKFILL_LOCK_ID)))
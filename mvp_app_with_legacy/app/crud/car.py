@@ -1,192 +1,230 @@
+import threading
+import time
+
 from fastapi import HTTPException
+from sqlalchemy import Text, cast, event, func, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.db.db_models import Car, CarMark
+from app.logger import setup_logger
 from app.schemas import car as car_schema
 
+logger = setup_logger(__name__)
+
+# Шаги выбора автомобиля (поля схемы Car) в порядке заполнения
+CAR_LEVELS = ('brand', 'model', 'year_of_issue', 'bodytype', 'doors', 'generation', 'fueltype', 'drivetype',
+              'transmission', 'modification')
+# Колонки Car для шагов после года выпуска
+CAR_SUBTREE_COLUMNS = ('bodyType', 'doors', 'generation', 'fuelType', 'driveType', 'transmission', 'modification')
+
+
+# Сортировка значений как ORDER BY ... ASC в PostgreSQL: NULL в конце
+def _sort_key(value):
+    return value is None, value
+
+
+# Узел справочника: значения следующего шага и переход к следующему узлу по значению
+class CarNode:
+    __slots__ = ('children', 'values', 'str_values')
+
+    def __init__(self, children):
+        self.children = children  # значение => следующий узел
+        self.values = sorted(children, key=_sort_key)
+        self.str_values = frozenset(map(str, children))  # для проверки значений из формы
+
+    def get(self, value):
+        return self.children.get(value)
+
+
+# Комплектации модификации (последний шаг) - уникальные (комплектация, мощность, объем двигателя)
+class CarLeaf:
+    __slots__ = ('complectations', 'values', 'str_values')
+
+    def __init__(self, complectations):
+        self.complectations = sorted(complectations, key=lambda item: tuple(map(_sort_key, item)))
+        self.values = [complectation for complectation, _, _ in self.complectations]
+        self.str_values = frozenset(map(str, self.values))
+
+
+# Модель марки: годы выпуска и строки справочника. Узлы шагов после года выпуска строятся
+# при первом обращении к году, т.к. строка справочника входит во все годы своего диапазона
+class CarModel:
+    def __init__(self, rows):
+        self.rows = rows
+        self._years = {}  # год => узел кузовов
+
+        years = set()
+        for row in rows:
+            if row.yearFrom is not None and row.yearTo is not None:
+                years.update(range(row.yearFrom, row.yearTo + 1))
+        self.years = CarNode(dict.fromkeys(years))
+
+    def get(self, year):
+        if year not in self.years.children:
+            return None
+        if year not in self._years:
+            rows = [row for row in self.rows
+                    if row.yearFrom is not None and row.yearTo is not None and row.yearFrom <= year <= row.yearTo]
+            self._years[year] = build_car_subtree(rows)
+        return self._years[year]
+
+
+def build_car_subtree(rows):
+    tree = {}
+    for row in rows:
+        node = tree
+        for column in CAR_SUBTREE_COLUMNS[:-1]:
+            node = node.setdefault(getattr(row, column), {})
+        node.setdefault(row.modification, set()).add((row.complectation, row.power, row.engineSize))
+    return _to_car_node(tree, len(CAR_SUBTREE_COLUMNS))
+
+
+def _to_car_node(tree, depth):
+    if depth == 1:
+        return CarNode({value: CarLeaf(complectations) for value, complectations in tree.items()})
+    return CarNode({value: _to_car_node(subtree, depth - 1) for value, subtree in tree.items()})
+
+
+# Справочник автомобилей в памяти: марка => модель => год => кузов => ... => модификация => комплектации.
+# Каждый шаг выбора - переход по словарю без запросов к БД
+class CarTree:
+    def __init__(self, rows, marks, version):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.marks = marks
+
+        models = {}
+        for row in rows:
+            models.setdefault(row.mark, {}).setdefault(row.model, []).append(row)
+        self.brands = CarNode({
+            mark: CarNode({model: CarModel(model_rows) for model, model_rows in mark_models.items()})
+            for mark, mark_models in models.items()
+        })
+
+    # Узел для заполненных шагов path (значения CAR_LEVELS по порядку) или None, если такого нет
+    def find(self, path):
+        node = self.brands
+        for value in path:
+            node = node.get(value)
+            if node is None:
+                return None
+        # Для модели следующий шаг - год выпуска
+        return node.years if isinstance(node, CarModel) else node
+
+    # Список марок отдается из CarMark, остальные шаги - из дерева. Возвращаемые списки общие - не изменять
+    def suggestion(self, path):
+        if not path:
+            return {"name": CAR_LEVELS[0], "values": self.marks}
+
+        node = self.find(path)
+        if node is None or not node.values:
+            raise HTTPException(404)
+
+        if isinstance(node, CarLeaf):
+            _, power, engine_size = node.complectations[0]
+            return {"name": "complectation", "values": node.values,
+                    "completedFields": [{"name": "power", "value": power},
+                                        {"name": "enginesize", "value": engine_size}]}
+        return {"name": CAR_LEVELS[len(path)], "values": node.values}
+
+    # Допустимые значения следующего шага (строками) или None, если шаги заполнены неверно
+    def allowed_values(self, path):
+        if not path:
+            return frozenset(self.marks)
+        node = self.find(path)
+        return node.str_values if node is not None else None
+
+
+# Контрольная сумма строк (md5 от отсортированных md5 строк) - не зависит от порядка строк в таблице
+def _checksum(db: Session, *columns):
+    row_hash = func.md5(cast(tuple_(*columns), Text))
+    return db.query(func.md5(func.string_agg(row_hash, aggregate_order_by('', row_hash)))).scalar()
+
+
+# Справочник автомобилей процесса. Версия справочника (контрольная сумма колонок Car и CarMark, из которых
+# строится дерево) проверяется раз в CAR_DIRECTORY_REFRESH_INTERVAL, дерево перестраивается только при ее
+# изменении (в т.ч. переименование или замена строк без изменения их кол-ва, загрузка справочника в обход ORM)
+# или после изменения строк справочника через ORM в этом процессе
+class CarDirectory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = None
+
+    def invalidate(self):
+        with self._lock:
+            self._tree = None
+
+    def get(self, db: Session):
+        tree = self._tree
+        if tree is None or time.monotonic() - tree.checked_at > settings.CAR_DIRECTORY_REFRESH_INTERVAL:
+            with self._lock:
+                # Проверяем, только если другой поток не успел сделать это раньше
+                if self._tree is tree:
+                    version = self._get_version(db)
+                    if tree is not None and tree.version == version:
+                        tree.checked_at = time.monotonic()
+                    else:
+                        self._tree = self._load(db, version)
+                tree = self._tree
+        return tree
+
+    @staticmethod
+    def _columns():
+        return (
+            Car.mark, Car.model, Car.yearFrom, Car.yearTo, Car.bodyType, Car.doors, Car.generation, Car.fuelType,
+            Car.driveType, Car.transmission, Car.modification, Car.complectation, Car.power, Car.engineSize
+        )
+
+    def _get_version(self, db: Session):
+        return _checksum(db, *self._columns()), _checksum(db, CarMark.title)
+
+    def _load(self, db: Session, version):
+        rows = db.query(*self._columns()).all()
+        marks = [title for (title,) in db.query(CarMark.title).order_by(CarMark.title.asc())]
+
+        tree = CarTree(rows, marks, version)
+        logger.info(f"crud/car. load. Загружен справочник автомобилей: {len(rows)} строк, версия {version}")
+        return tree
+
+
+car_directory = CarDirectory()
+
+
+# Изменения строк справочника через ORM сбрасывают дерево после commit
+@event.listens_for(Session, "after_flush")
+def _car_directory_changed(session, flush_context):
+    if any(isinstance(obj, (Car, CarMark)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["car_directory_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_car_directory(session):
+    if session.info.pop("car_directory_changed", False):
+        car_directory.invalidate()
+
+
+# Заполненные шаги выбора. Шаги заполняются строго по порядку - иначе None
+def get_car_path(car: car_schema.Car):
+    values = [getattr(car, name) for name in CAR_LEVELS]
+    depth = next((index for index, value in enumerate(values) if not value), len(values))
+    if any(values[depth:]):
+        return None
+    return values[:depth]
+
 
 def car_suggestion(db: Session, car: car_schema.Car):
-    if not car.brand and not car.model and not car.year_of_issue and not car.bodytype \
-            and not car.doors and not car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_marks(db=db)
-
-    if car.brand and not car.model and not car.year_of_issue and not car.bodytype \
-            and not car.doors and not car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_models(db=db, mark=car.brand)
-
-    if car.brand and car.model and not car.year_of_issue and not car.bodytype \
-            and not car.doors and not car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_years(db=db, mark=car.brand, model=car.model)
-
-    if car.brand and car.model and car.year_of_issue and not car.bodytype \
-            and not car.doors and not car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_body_types(db=db, mark=car.brand, model=car.model, year=car.year_of_issue)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and not car.doors and not car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_doors(db=db, mark=car.brand, model=car.model, year=car.year_of_issue, body_type=car.bodytype)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and car.doors and not car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_generations(db=db, mark=car.brand, model=car.model, year=car.year_of_issue, body_type=car.bodytype,
-                               door=car.doors)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and car.doors and car.generation and not car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_fuel_types(db=db, mark=car.brand, model=car.model, year=car.year_of_issue, body_type=car.bodytype,
-                              door=car.doors, generation=car.generation)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and car.doors and car.generation and car.fueltype and not car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_drive_types(db=db, mark=car.brand, model=car.model, year=car.year_of_issue, body_type=car.bodytype,
-                               door=car.doors, generation=car.generation, fuel_type=car.fueltype)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and car.doors and car.generation and car.fueltype and car.drivetype \
-            and not car.transmission and not car.modification:
-        return get_transmissions(db=db, mark=car.brand, model=car.model, year=car.year_of_issue, body_type=car.bodytype,
-                                 door=car.doors, generation=car.generation, fuel_type=car.fueltype,
-                                 drive_type=car.drivetype)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and car.doors and car.generation and car.fueltype and car.drivetype \
-            and car.transmission and not car.modification:
-        return get_modifications(db=db, mark=car.brand, model=car.model, year=car.year_of_issue, body_type=car.bodytype,
-                                 door=car.doors, generation=car.generation, fuel_type=car.fueltype,
-                                 drive_type=car.drivetype, transmission=car.transmission)
-
-    if car.brand and car.model and car.year_of_issue and car.bodytype \
-            and car.doors and car.generation and car.fueltype and car.drivetype \
-            and car.transmission and car.modification:
-        return get_complectations(db=db, mark=car.brand, model=car.model, year=car.year_of_issue,
-                                  body_type=car.bodytype, door=car.doors, generation=car.generation,
-                                  fuel_type=car.fueltype, drive_type=car.drivetype, transmission=car.transmission,
-                                  modification=car.modification)
-
-    return False
-
-
-def get_marks(db: Session):
-    query = db.query(CarMark.title).order_by(CarMark.title.asc()).all()
-    marks = [x.title for x in query]
-    return {"name": "brand", "values": marks}
-
-
-def get_models(db: Session, mark):
-    query = db.query(Car.model).filter(Car.mark == mark).order_by(Car.model.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    models = [x.model for x in query]
-    return {"name": "model", "values": models}
-
-
-def get_years(db: Session, mark, model):
-    query = db.query(Car.yearFrom, Car.yearTo).filter(Car.mark == mark, Car.model == model).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    years = set()
-    for i in query:
-        years.update(list(range(i.yearFrom, i.yearTo + 1)))
-    return {"name": "year_of_issue", "values": years}
-
-
-def get_body_types(db: Session, mark, model, year):
-    query = db.query(Car.bodyType).filter(Car.mark == mark, Car.model == model,
-                                          Car.yearFrom <= year, Car.yearTo >= year) \
-        .order_by(Car.bodyType.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    body_types = [x.bodyType for x in query]
-    return {"name": "bodytype", "values": body_types}
-
-
-def get_doors(db: Session, mark, model, year, body_type):
-    query = db.query(Car.doors).filter(Car.mark == mark, Car.model == model,
-                                       Car.yearFrom <= year, Car.yearTo >= year, Car.bodyType == body_type) \
-        .order_by(Car.doors.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    doors = [x.doors for x in query]
-    return {"name": "doors", "values": doors}
-
-
-def get_generations(db: Session, mark, model, year, body_type, door):
-    query = db.query(Car.generation).filter(Car.mark == mark, Car.model == model,
-                                            Car.yearFrom <= year, Car.yearTo >= year, Car.bodyType == body_type,
-                                            Car.doors == door) \
-        .order_by(Car.generation.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    generations = [x.generation for x in query]
-    return {"name": "generation", "values": generations}
-
-
-def get_fuel_types(db: Session, mark, model, year, body_type, door, generation):
-    query = db.query(Car.fuelType).filter(Car.mark == mark, Car.model == model,
-                                          Car.yearFrom <= year, Car.yearTo >= year, Car.bodyType == body_type,
-                                          Car.doors == door, Car.generation == generation) \
-        .order_by(Car.fuelType.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    fuel_types = [x.fuelType for x in query]
-    return {"name": "fueltype", "values": fuel_types}
-
-
-def get_drive_types(db: Session, mark, model, year, body_type, door, generation, fuel_type):
-    query = db.query(Car.driveType).filter(Car.mark == mark, Car.model == model,
-                                           Car.yearFrom <= year, Car.yearTo >= year, Car.bodyType == body_type,
-                                           Car.doors == door, Car.generation == generation,
-                                           Car.fuelType == fuel_type) \
-        .order_by(Car.driveType.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    drive_types = [x.driveType for x in query]
-    return {"name": "drivetype", "values": drive_types}
-
-
-def get_transmissions(db: Session, mark, model, year, body_type, door, generation, fuel_type, drive_type):
-    query = db.query(Car.transmission).filter(Car.mark == mark, Car.model == model,
-                                              Car.yearFrom <= year, Car.yearTo >= year, Car.bodyType == body_type,
-                                              Car.doors == door, Car.generation == generation,
-                                              Car.fuelType == fuel_type, Car.driveType == drive_type) \
-        .order_by(Car.transmission.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    transmissions = [x.transmission for x in query]
-    return {"name": "transmission", "values": transmissions}
-
-
-def get_modifications(db: Session, mark, model, year, body_type, door, generation, fuel_type, drive_type, transmission):
-    query = db.query(Car.modification).filter(Car.mark == mark, Car.model == model,
-                                              Car.yearFrom <= year, Car.yearTo >= year, Car.bodyType == body_type,
-                                              Car.doors == door, Car.generation == generation,
-                                              Car.fuelType == fuel_type, Car.driveType == drive_type,
-                                              Car.transmission == transmission) \
-        .order_by(Car.modification.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    modifications = [x.modification for x in query]
-    return {"name": "modification", "values": modifications}
-
-
-def get_complectations(db: Session, mark, model, year, body_type, door, generation,
-                       fuel_type, drive_type, transmission, modification):
-    query = db.query(Car.complectation, Car.power, Car.engineSize) \
-        .filter(Car.mark == mark, Car.model == model, Car.yearFrom <= year, Car.yearTo >= year,
-                Car.bodyType == body_type, Car.doors == door, Car.generation == generation, Car.fuelType == fuel_type,
-                Car.driveType == drive_type, Car.transmission == transmission, Car.modification == modification) \
-        .order_by(Car.complectation.asc()).distinct().all()
-    if len(query) == 0:
-        raise HTTPException(404)
-    complectations = [x.complectation for x in query]
-    return {"name": "complectation", "values": complectations,
-            "completedFields": [{"name": "power", "value": query[0].power},
-                                {"name": "enginesize", "value": query[0].engineSize}]}
+    path = get_car_path(car)
+    if path is None:
+        return False
+    return car_directory.get(db).suggestion(path)
+
+
+# Проверка значения следующего шага выбора (для доп.полей объявления)
+def is_car_value_allowed(db: Session, car: car_schema.Car, value):
+    path = get_car_path(car)
+    if path is None:
+        return False
+    allowed_values = car_directory.get(db).allowed_values(path)
+    return allowed_values is not None and str(value) in allowed_values
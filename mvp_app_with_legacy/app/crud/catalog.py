@@ -1,142 +1,268 @@
+import json
+import threading
+import time
+
 from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
 from sqlalchemy.orm import Session, selectinload
+
+from app.core.config import settings
 from app.db.db_models import Catalog, AdditionalFields, DynamicTitle, ChoiceTypes
 from app.logger import setup_logger
-from app.schemas.catalog import CatalogSubCategory, CatalogSchema
+from app.schemas.catalog import CatalogPath, CatalogTitle
+from app.utils.additional_fields import FieldsValidator
+from app.utils.redis import invalidate_cache_tags, get_tag_version
 logger = setup_logger(__name__)
 
-# Рекурсивная функция для построения древовидной структуры каталога
-def build_catalog_tree(catalog_items, parent_id=None):
-    sub_categories = []
+# Узел дерева каталога (формат CatalogSchema / CatalogSubCategory)
+def build_catalog_node(catalog_item):
+    return {
+        "id": str(catalog_item.id),
+        "path": catalog_item.path[0].to_dict(),
+        "title": catalog_item.title[0].to_dict(),
+        "is_publish": catalog_item.is_publish,
+        "sub_categories": []
+    }
 
-    for catalog_item in catalog_items:
-        if catalog_item.parent_id == parent_id:
-            sub_category = CatalogSubCategory(
-                id=catalog_item.id,
-                parent_id=catalog_item.parent_id,
-                path=catalog_item.path[0].to_dict(),
-                title=catalog_item.title[0].to_dict(),
-                is_publish=catalog_item.is_publish
-            )
-            sub_category.sub_categories = build_catalog_tree(catalog_items, parent_id=catalog_item.id)
-            sub_categories.append(sub_category)
-
-    return sub_categories
-
-
-# Функция построения каталога
-def get_catalog(db: Session):
-    # Получаем все каталоги с предварительной загрузкой связанных данных
-    catalog_data = db.query(Catalog).options(
-        selectinload(Catalog.path),
-        selectinload(Catalog.title)
-    ).all()
-
-    if not catalog_data:
-        logger.error(f"crud/catalog- get_catalog. Каталог не найден: no catalog_data")
-        raise HTTPException(status_code=404, detail="Каталог не найден")
 
-    catalog_tree = []
+# Дерево каталога за один проход: узлы индексируются по id, каждый узел добавляется
+# в sub_categories родителя (порядок узлов - порядок элементов каталога). Возвращает корни и все узлы
+def build_catalog_tree(catalog_items):
+    nodes = {str(catalog_item.id): build_catalog_node(catalog_item) for catalog_item in catalog_items}
 
-    for catalog_item in catalog_data:
+    roots = []
+    for catalog_item in catalog_items:
+        node = nodes[str(catalog_item.id)]
         if catalog_item.parent_id is None:
-            catalog_schema = CatalogSchema(
-                id=catalog_item.id,
-                path=catalog_item.path[0].to_dict(),
-                title=catalog_item.title[0].to_dict(),
-                is_publish=catalog_item.is_publish
-            )
-            catalog_schema.sub_categories = build_catalog_tree(catalog_data, parent_id=catalog_item.id)
-            catalog_tree.append(catalog_schema)
-
-    if not catalog_tree:
-        logger.error(f"crud/catalog- get_catalog. Каталог не найден: no catalog_tree")
+            # У корневых элементов path и title ограничены полями CatalogPath / CatalogTitle (как в CatalogSchema)
+            roots.append(dict(
+                node,
+                path={name: node["path"][name] for name in CatalogPath.__fields__},
+                title={name: node["title"][name] for name in CatalogTitle.__fields__}
+            ))
+        else:
+            parent = nodes.get(str(catalog_item.parent_id))
+            if parent is not None:
+                parent["sub_categories"].append(node)
+
+    return roots, nodes
+
+
+# JSON в том виде, в каком его отдал бы FastAPI: UUID, даты, Enum и т.п. в path/title/data приводятся
+# через jsonable_encoder, а не ломают загрузку реестра
+def to_json_bytes(data):
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(',', ':')).encode()
+
+
+# Дерево каталога (или поддерево элемента key) - готовый JSON из реестра каталога
+def get_catalog_json(db: Session, key=None):
+    metadata = catalog_registry.get(db)
+    content = metadata.subtree_json(key) if key else metadata.tree_json
+    if not content:
+        logger.error(f"crud/catalog- get_catalog_json. Каталог не найден: {key}")
         raise HTTPException(status_code=404, detail="Каталог не найден")
+    return content
 
-    return catalog_tree
 
+# Доп.поля, динамический заголовок и данные элемента каталога в виде словаря (формат CatalogSchemaAdditionalFields)
+def build_catalog_fields(catalog):
+    additional_fields = []
 
-# Функция получения доп. полей для элемента каталога
-def get_all_fields(key, db: Session):
-    query = db.query(Catalog).options(
-        selectinload(Catalog.additional_fields),
-        selectinload(Catalog.dynamic_title)
-    )
-    if key:
-        query = query.filter(Catalog.id == key)
-    catalogs = query.all()
-    if not catalogs:
-        logger.error(f"crud/catalog- get_all_fields. Ошибка получения доп.полей")
-        raise HTTPException(status_code=404, detail="Ошибка получения доп.полей")
+    for field in catalog.additional_fields:
+        field_data_dict = {}
 
-    # Формируем каталог и соответствующие доп.поля
-    result = []
-    for catalog in catalogs:
-        additional_fields = []
-
-        for field in catalog.additional_fields:
-            field_data_dict = {}
-
-            for field_data in field.field_data:
-                properties = {}
-                dependencies_data = []
-
-                if field_data.type == ChoiceTypes.SELECT:
-                    properties = { "options": field_data.properties }
-                elif field_data.type == ChoiceTypes.TEXT:
-                    properties = { "measure": field_data.properties[0] }
-                elif field_data.type == ChoiceTypes.CHECKBOXES:
-                    properties = { "checks": field_data.properties }
-                elif field_data.type == ChoiceTypes.NUMBER:
-                    properties = {
-                        "measure": field_data.properties.measure,
-                        "type": field_data.properties.type,
-                        "min": field_data.properties.min,
-                        "max": field_data.properties.max
-                    }
-                elif field_data.type == ChoiceTypes.REQUEST:
-                    properties = {
-                        "url": field_data.properties.url,
-                        "dependencies": dependencies_data
-                    }
-                    if field_data.properties.dependencies:
-                        dependencies_data.extend(
-                            dependency.dependency
-                            for dependency in field_data.properties.dependencies
-                        )
-
-                elif field_data.type == ChoiceTypes.COLOR:
-                    properties = { "colors": field_data.properties }
-
-                dependencies = [dependency.dependency for dependency in field_data.dependencies]
-
-                field_data_dict = {
-                    "type": field_data.type.value,
-                    "edit": field_data.edit,
-                    "show_filter": field_data.show_filter,
-                    "range": field_data.range,
-                    "dependencies": dependencies,
-                    "properties": properties
+        for field_data in field.field_data:
+            properties = {}
+            dependencies_data = []
+
+            if field_data.type == ChoiceTypes.SELECT:
+                properties = { "options": field_data.properties }
+            elif field_data.type == ChoiceTypes.TEXT:
+                properties = { "measure": field_data.properties[0] }
+            elif field_data.type == ChoiceTypes.CHECKBOXES:
+                properties = { "checks": field_data.properties }
+            elif field_data.type == ChoiceTypes.NUMBER:
+                properties = {
+                    "measure": field_data.properties.measure,
+                    "type": field_data.properties.type,
+                    "min": field_data.properties.min,
+                    "max": field_data.properties.max
+                }
+            elif field_data.type == ChoiceTypes.REQUEST:
+                properties = {
+                    "url": field_data.properties.url,
+                    "dependencies": dependencies_data
                 }
+                if field_data.properties.dependencies:
+                    dependencies_data.extend(
+                        dependency.dependency
+                        for dependency in field_data.properties.dependencies
+                    )
+
+            elif field_data.type == ChoiceTypes.COLOR:
+                properties = { "colors": field_data.properties }
 
-            additional_fields.append({
-                "alias": field.alias,
-                "title": field.title,
-                "required": field.required,
-                "data": field_data_dict
-            })
-
-        dynamic_title = [title.title for title in catalog.dynamic_title] if catalog.dynamic_title else []
-
-        result.append({
-            "id": str(catalog.id),
-            "parent_id": str(catalog.parent_id),
-            "path": catalog.path[0].to_dict(),
-            "title": catalog.title[0].to_dict(),
-            "is_publish": catalog.is_publish,
-            "dynamic_title": dynamic_title,
-            "additional_fields": additional_fields
+            dependencies = [dependency.dependency for dependency in field_data.dependencies]
+
+            field_data_dict = {
+                "type": field_data.type.value,
+                "edit": field_data.edit,
+                "show_filter": field_data.show_filter,
+                "range": field_data.range,
+                "dependencies": dependencies,
+                "properties": properties
+            }
+
+        additional_fields.append({
+            "alias": field.alias,
+            "title": field.title,
+            "required": field.required,
+            "data": field_data_dict
         })
+
+    dynamic_title = [title.title for title in catalog.dynamic_title] if catalog.dynamic_title else []
+
+    return {
+        "id": str(catalog.id),
+        "parent_id": str(catalog.parent_id),
+        "path": catalog.path[0].to_dict(),
+        "title": catalog.title[0].to_dict(),
+        "is_publish": catalog.is_publish,
+        "dynamic_title": dynamic_title,
+        "additional_fields": additional_fields
+    }
+
+
+# Метаданные каталога, собранные за одну загрузку. Используются только для чтения
+class CatalogMetadata:
+    def __init__(self, catalogs, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.fields_list = []  # доп.поля всех элементов каталога
+        self.fields_by_id = {}  # catalog_id => доп.поля элемента каталога
+        self.validators = {}  # catalog_id => скомпилированные доп.поля (FieldsValidator)
+        self.parents = {}  # catalog_id => parent_id (None для корневых)
+
+        for catalog in catalogs:
+            catalog_id = str(catalog.id)
+            catalog_fields = build_catalog_fields(catalog)
+            self.fields_list.append(catalog_fields)
+            self.fields_by_id[catalog_id] = catalog_fields
+            self.validators[catalog_id] = FieldsValidator(catalog_fields["additional_fields"])
+            self.parents[catalog_id] = str(catalog.parent_id) if catalog.parent_id else None
+
+        # Дерево каталога сериализуется один раз, поддеревья - при первом запросе
+        roots, self._tree_nodes = build_catalog_tree(catalogs)
+        self.tree_json = to_json_bytes(roots) if roots else None
+        self._subtrees_json = {}
+
+    def dynamic_title(self, catalog_id):
+        return self.fields_by_id[str(catalog_id)]["dynamic_title"]
+
+    def subtree_json(self, catalog_id):
+        catalog_id = str(catalog_id)
+        content = self._subtrees_json.get(catalog_id)
+        if content is None and catalog_id in self._tree_nodes:
+            content = self._subtrees_json[catalog_id] = to_json_bytes(self._tree_nodes[catalog_id])
+        return content
+
+
+# Реестр метаданных каталога в памяти процесса: загружается один раз и перезагружается
+# при изменении строк каталога в этом процессе (см. _catalog_changed), при изменении общей версии
+# каталога - тега кэша "catalog" в Redis (изменения из других процессов, см. sync_catalog_registry)
+# или по истечении CATALOG_REFRESH_INTERVAL (если Redis недоступен)
+class CatalogRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metadata = None
+        self._version = 0
+        self._shared_version = None
+
+    def invalidate(self):
+        with self._lock:
+            self._metadata = None
+
+    # Общая версия изменилась - следующий get() загрузит каталог заново. Версия в Redis увеличивается
+    # после commit изменений, поэтому загруженные после этого данные не старше этой версии
+    def sync_version(self, shared_version):
+        if shared_version is None or shared_version == self._shared_version:
+            return
+        with self._lock:
+            if shared_version != self._shared_version:
+                self._shared_version = shared_version
+                self._metadata = None
+
+    def get(self, db: Session):
+        metadata = self._metadata
+        if metadata is None or time.monotonic() - metadata.loaded_at > settings.CATALOG_REFRESH_INTERVAL:
+            with self._lock:
+                # Перезагружаем, только если другой поток не успел сделать это раньше
+                if self._metadata is metadata:
+                    self._version += 1
+                    self._metadata = CatalogMetadata(self._load(db), self._version)
+                metadata = self._metadata
+        return metadata
+
+    @staticmethod
+    def _load(db: Session):
+        return db.query(Catalog).options(
+            selectinload(Catalog.path),
+            selectinload(Catalog.title),
+            selectinload(Catalog.additional_fields).selectinload(AdditionalFields.field_data),
+            selectinload(Catalog.dynamic_title)
+        ).all()
+
+
+catalog_registry = CatalogRegistry()
+
+
+# Сверка реестра с общей версией каталога перед чтением: ответы, кэшированные под новой версией тега
+# "catalog", строятся по перезагруженному реестру, а не по устаревшему реестру этого процесса
+async def sync_catalog_registry():
+    catalog_registry.sync_version(await get_tag_version("catalog"))
+
+
+def _catalog_classes():
+    classes = {Catalog, AdditionalFields, DynamicTitle}
+    for attribute in (Catalog.path, Catalog.title, Catalog.additional_fields, Catalog.dynamic_title,
+                      AdditionalFields.field_data):
+        classes.add(attribute.property.mapper.class_)
+    return tuple(classes)
+
+
+# Изменения строк каталога через ORM сбрасывают реестр после commit
+@event.listens_for(Session, "after_flush")
+def _catalog_changed(session, flush_context):
+    catalog_classes = _catalog_classes()
+    if any(isinstance(obj, catalog_classes) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["catalog_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_catalog_registry(session):
+    if session.info.pop("catalog_changed", False):
+        catalog_registry.invalidate()
+        invalidate_cache_tags("catalog")
+
+
+# Функция получения доп. полей для элемента каталога (из реестра, без запросов к БД после загрузки).
+# Возвращаемые словари общие для всех запросов - не изменять
+def get_all_fields(key, db: Session):
+    metadata = catalog_registry.get(db)
+    result = metadata.fields_by_id.get(str(key)) if key else metadata.fields_list
+    if not result:
+        logger.error(f"crud/catalog- get_all_fields. Ошибка получения доп.полей")
+        raise HTTPException(status_code=404, detail="Ошибка получения доп.полей")
+
     # Возвращаем одну запись если получени идентификатор каталога, иначе выводим все записи
-    return result[0] if key else result
+    return result
+
 
+# Скомпилированные доп.поля элемента каталога для проверки и вывода значений
+def get_fields_validator(key, db: Session):
+    validator = catalog_registry.get(db).validators.get(str(key))
+    if validator is None:
+        logger.error(f"crud/catalog- get_fields_validator. Ошибка получения доп.полей: {key}")
+        raise HTTPException(status_code=404, detail="Ошибка получения доп.полей")
+    return validator
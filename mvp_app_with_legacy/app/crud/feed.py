@@ -0,0 +1,63 @@
+from uuid import UUID
+
+from sqlalchemy.orm import Session, selectinload
+
+from app.db.db_models import Ad, favorite_advs
+from app.schemas.ad import ItemsOutModel
+
+# Опции загрузки для списков объявлений: фото, местоположение и статус всех объявлений страницы
+# загружаются пакетно (по одному запросу на связь), а не отдельным запросом на каждое объявление
+FEED_ITEM_OPTIONS = (
+    selectinload(Ad.photos),
+    selectinload(Ad.location),
+    selectinload(Ad.status),
+)
+
+
+# Идентификаторы объявлений из ad_ids, добавленных пользователем в избранное - одним запросом
+def get_favorite_ids(user_id, ad_ids, db: Session):
+    if not user_id or not ad_ids:
+        return set()
+
+    rows = (
+        db.query(favorite_advs.c.ad_id)
+        .filter(favorite_advs.c.user_id == user_id, favorite_advs.c.ad_id.in_(ad_ids))
+        .all()
+    )
+    return {row.ad_id for row in rows}
+
+
+# Список карточек объявлений (ItemsOutModel) за фиксированное кол-во запросов независимо от размера страницы.
+# favorite_ids - если избранное уже известно (например, все объявления из избранного пользователя)
+def build_feed_items(ads, user_id, db: Session, distances=None, favorite_ids=None):
+    if favorite_ids is None:
+        favorite_ids = get_favorite_ids(user_id, [ad.id for ad in ads], db)
+    distances = distances or {}
+
+    items = []
+    for ad in ads:
+        item = ItemsOutModel(
+            id=ad.id,
+            title=ad.title,
+            description=ad.description,
+            price=ad.price,
+            location=ad.location.to_dict() if ad.location else {},
+            photos=ad.photos[0].id if ad.photos else '',
+            favorite=ad.id in favorite_ids,
+            status=str(ad.status.status),
+            created_at=str(ad.created_at),
+            distance=distances.get(ad.id)
+        )
+        items.append(item)
+    return items
+
+
+# Флаги избранного пользователя в карточке объявления из кэша (карточка кэшируется без пользователя):
+# для объявления и объявлений владельца - одним запросом
+def overlay_favorites(card, user_id, db: Session):
+    owner_ads = (card.get("owner") or {}).get("adv") or []
+    favorite_ids = get_favorite_ids(user_id, [UUID(str(card["id"]))] + [UUID(str(item["id"])) for item in owner_ads], db)
+    card["favorite"] = UUID(str(card["id"])) in favorite_ids
+    for item in owner_ads:
+        item["favorite"] = UUID(str(item["id"])) in favorite_ids
+    return card
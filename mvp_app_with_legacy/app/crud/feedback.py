@@ -4,8 +4,10 @@ from typing import Union
 
 from sqlalchemy import or_
 
+from app.crud.feed import FEED_ITEM_OPTIONS, build_feed_items
+from app.crud.search import get_search_subquery
 from app.db.db_models import User, FeedBackUsers, Ad, DealStateEnum
-from app.schemas.ad import ItemsOutModel, PaginatedItems
+from app.schemas.ad import PaginatedItems
 
 
 def create_feedback_object(user_id, data, db):
@@ -61,26 +63,7 @@ def get_paginated_feedback_advs(search, sort, page, limit, current_user_id, db):
 
     ads, total = get_feedback_advs_query(search, sort, limit, offset, current_user_id, db)
 
-    ad_list = []
-    for ad in ads:
-        photos = ad.photos[0].id if ad.photos else ''
-        if current_user_id is not None:
-            favorite = current_user_id in [user.id for user in ad.favorited_by]
-        else:
-            favorite = False
-
-        ad_out = ItemsOutModel(
-            id=ad.id,
-            title=ad.title,
-            description=ad.description,
-            price=ad.price,
-            location=ad.location.to_dict() if ad.location else {},
-            photos=photos,
-            favorite=favorite,
-            status=ad.status.status,
-            created_at=str(ad.created_at)
-        )
-        ad_list.append(ad_out)
+    ad_list = build_feed_items(ads, current_user_id, db)
 
     return PaginatedItems(total=total, items=ad_list)
 
@@ -100,20 +83,19 @@ def get_feedback_advs_query(search, sort, limit, offset, user_id, db):
         Ad.created_at.desc()
     )
 
-    # Если получено поле поиска, то применяем поиск
+    # Если получено поле поиска, то применяем полнотекстовый поиск
     if search:
         search = search.strip()  # Remove leading/trailing whitespaces
-        search_clause = or_(
-            Ad.title.ilike(f'%{search}%'),
-            Ad.description.ilike(f'%{search}%')
-        )
-        query = query.filter(search_clause)
+        search_subquery = get_search_subquery(search, db)
+        query = query.join(search_subquery, Ad.id == search_subquery.c.ad_id)
+        if sort == 'relevance':
+            sort_column = search_subquery.c.rank.desc()
 
     query = query.order_by(sort_column)
 
     # Получаем общее кол-во полученных записей и применяем пагинацию
     total = query.count()
-    ads = query.offset(offset).limit(limit).all()
+    ads = query.options(*FEED_ITEM_OPTIONS).offset(offset).limit(limit).all()
     return ads, total
 
 
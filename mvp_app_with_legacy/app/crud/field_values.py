@@ -0,0 +1,100 @@
+import re
+
+from sqlalchemy import or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.db.db_models import AdFields, AdFieldValue
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+NUMBER_PATTERN = r'^-?[0-9]+(\.[0-9]+)?$'
+BOOL_VALUES = {'True': True, 'False': False}
+
+_number_re = re.compile(NUMBER_PATTERN)
+
+
+# Типизированное значение доп.поля: (число, логическое) или None, если значение строковое
+def parse_typed_value(value):
+    if isinstance(value, bool):
+        return None, value
+    if isinstance(value, (int, float)):
+        return float(value), None
+
+    str_value = str(value).strip()
+    if str_value in BOOL_VALUES:
+        return None, BOOL_VALUES[str_value]
+    if _number_re.match(str_value):
+        return float(str_value), None
+    return None
+
+
+# Типизированные записи для доп.полей объявления (без commit - в одной транзакции с AdFields)
+def add_field_values(ad_id, fields: dict, db: Session):
+    for key, value in fields.items():
+        typed_value = parse_typed_value(value)
+        if typed_value is None:
+            continue
+        value_num, value_bool = typed_value
+        db.add(AdFieldValue(ad_id=ad_id, key=key, value_num=value_num, value_bool=value_bool))
+
+
+def delete_field_values(ad_id, db: Session):
+    db.query(AdFieldValue).filter_by(ad_id=ad_id).delete()
+
+
+# Заполнение типизированных значений для доп.полей, опубликованных до появления ad_field_values.
+# Выполняется один раз (crud/backfill.run_backfills)
+def backfill_ad_field_values(db: Session, batch_size=1000):
+    created = 0
+    while True:
+        ad_fields = (
+            db.query(AdFields.ad_id, AdFields.key, AdFields.value)
+            .outerjoin(AdFieldValue, and_(AdFieldValue.ad_id == AdFields.ad_id, AdFieldValue.key == AdFields.key))
+            .filter(
+                AdFieldValue.id == None,
+                or_(AdFields.value.op('~')(NUMBER_PATTERN), AdFields.value.in_(BOOL_VALUES.keys()))
+            )
+            .distinct()
+            .limit(batch_size)
+            .all()
+        )
+        if not ad_fields:
+            break
+
+        field_values = []
+        for ad_field in ad_fields:
+            value_num, value_bool = parse_typed_value(ad_field.value)
+            field_values.append(
+                {"ad_id": ad_field.ad_id, "key": ad_field.key, "value_num": value_num, "value_bool": value_bool}
+            )
+        # Значение могло появиться параллельно (публикация объявления) - такие пропускаем
+        db.execute(insert(AdFieldValue).values(field_values).on_conflict_do_nothing(
+            index_elements=[AdFieldValue.ad_id, AdFieldValue.key]
+        ))
+        db.commit()
+        created += len(field_values)
+
+    if created:
+        logger.info(f"crud/field_values. backfill_ad_field_values. Добавлено значений доп.полей: {created}")
+    return created
+
+
+# Подзапрос объявлений, у которых числовое доп.поле key попадает в диапазон [value_from, value_to]
+def range_filter_subquery(key, value_from, value_to, db: Session):
+    clauses = [AdFieldValue.key == key]
+    if value_from is not None:
+        clauses.append(AdFieldValue.value_num >= value_from)
+    if value_to is not None:
+        clauses.append(AdFieldValue.value_num <= value_to)
+    return db.query(AdFieldValue.ad_id).filter(*clauses).as_scalar()
+
+
+# Подзапрос объявлений с логическим доп.полем key равным value
+def bool_filter_subquery(key, value: bool, db: Session):
+    return (
+        db.query(AdFieldValue.ad_id)
+        .filter(AdFieldValue.key == key, AdFieldValue.value_bool == value)
+        .as_scalar()
+    )
@@ -0,0 +1,113 @@
+from math import radians, cos
+
+from sqlalchemy import func, and_, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.db.db_models import AdGeoPoint, Location
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.045  # Длина одного градуса широты в км
+
+
+def parse_coordinates(lat, long):
+    try:
+        lat, long = float(lat), float(long)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        return None
+    return lat, long
+
+
+# Запись/обновление координат объявления (при публикации и редактировании местоположения).
+# Некорректные координаты записываются как NULL - так же, как при заполнении (backfill_ad_geo_points)
+def upsert_ad_geo_point(ad_id, lat, long, db: Session):
+    coordinates = parse_coordinates(lat, long)
+    if coordinates is None:
+        logger.error(f"crud/geo. upsert_ad_geo_point. Некорректные координаты: {ad_id} => {lat}, {long}")
+
+    lat_value, long_value = coordinates or (None, None)
+    statement = insert(AdGeoPoint).values(ad_id=ad_id, lat=lat_value, long=long_value)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[AdGeoPoint.ad_id],
+        set_={'lat': statement.excluded.lat, 'long': statement.excluded.long}
+    ))
+    db.commit()
+    return coordinates is not None
+
+
+# Заполнение координат для объявлений, у которых их ещё нет (объявления до появления ad_geo_points)
+def backfill_ad_geo_points(db: Session, batch_size=1000):
+    created = 0
+    while True:
+        locations = (
+            db.query(Location.ad_id, Location.lat, Location.long)
+            .outerjoin(AdGeoPoint, AdGeoPoint.ad_id == Location.ad_id)
+            .filter(AdGeoPoint.ad_id == None, Location.ad_id != None)
+            .limit(batch_size)
+            .all()
+        )
+        if not locations:
+            break
+
+        geo_points = []
+        for location in locations:
+            # Некорректные координаты записываем как NULL, чтобы не выбирать их повторно
+            coordinates = parse_coordinates(location.lat, location.long) or (None, None)
+            geo_points.append({"ad_id": location.ad_id, "lat": coordinates[0], "long": coordinates[1]})
+        # Координаты могли появиться параллельно (публикация объявления) - такие пропускаем
+        db.execute(insert(AdGeoPoint).values(geo_points).on_conflict_do_nothing(index_elements=[AdGeoPoint.ad_id]))
+        db.commit()
+        created += len(geo_points)
+
+    if created:
+        logger.info(f"crud/geo. backfill_ad_geo_points. Добавлено координат объявлений: {created}")
+    return created
+
+
+# Ограничивающий прямоугольник вокруг точки: условие по индексу (lat, long)
+def bounding_box_clause(lat, long, radius_km):
+    delta_lat = radius_km / KM_PER_DEGREE
+    clauses = [AdGeoPoint.lat.between(lat - delta_lat, lat + delta_lat)]
+
+    lat_cos = cos(radians(lat))
+    # У полюсов долгота не ограничивает выборку
+    if lat_cos > 0.01:
+        delta_long = radius_km / (KM_PER_DEGREE * lat_cos)
+        long_min, long_max = long - delta_long, long + delta_long
+        if delta_long >= 180:  # Радиус охватывает все долготы
+            return and_(*clauses)
+
+        if long_min < -180:  # Переход через 180-й меридиан
+            clauses.append(or_(AdGeoPoint.long >= long_min + 360, AdGeoPoint.long <= long_max))
+        elif long_max > 180:
+            clauses.append(or_(AdGeoPoint.long >= long_min, AdGeoPoint.long <= long_max - 360))
+        else:
+            clauses.append(AdGeoPoint.long.between(long_min, long_max))
+
+    return and_(*clauses)
+
+
+# Расстояние (в метрах) по формуле гаверсинусов - устойчива для малых расстояний, в отличие от acos
+def distance_expression(lat, long):
+    lat1, long1 = radians(lat), radians(long)
+    lat2, long2 = func.radians(AdGeoPoint.lat), func.radians(AdGeoPoint.long)
+    haversine = (
+        func.power(func.sin((lat2 - lat1) / 2), 2)
+        + cos(lat1) * func.cos(lat2) * func.power(func.sin((long2 - long1) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * 1000 * func.asin(func.least(1.0, func.sqrt(haversine)))
+
+
+# Подзапрос объявлений в радиусе (км) от точки: ad_id и расстояние в метрах.
+# Расстояние вычисляется один раз - только для строк, прошедших предфильтр по прямоугольнику
+def get_radius_subquery(lat, long, radius_km, db: Session):
+    return (
+        db.query(AdGeoPoint.ad_id, distance_expression(lat, long).label('distance'))
+        .filter(bounding_box_clause(lat, long, radius_km))
+        .subquery()
+    )
@@ -1,12 +1,21 @@
+import threading
 from uuid import UUID
 
+from cachetools import TTLCache
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.db.db_models import AdPhotos
 from app.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Идентификатор фото => путь к каталогу фото (AdPhotos.url). Путь фото не изменяется,
+# поэтому повторная выдача фото - без запроса к БД
+_image_roads = TTLCache(maxsize=settings.IMAGE_FILES_CACHE_SIZE, ttl=settings.IMAGE_FILES_CACHE_TTL)
+_image_roads_lock = threading.Lock()
+
 # Функция получения изображения по ее идентификатору
 def get_image_by_uuid(db: Session, image_uuid: UUID):
     """
@@ -27,3 +36,36 @@ def get_image_by_uuid(db: Session, image_uuid: UUID):
     else:
         logger.error(f"crud/image- get_image_by_uuid. Ошибка получения изображения")
         return False
+
+
+def get_cached_image_road(image_uuid: UUID):
+    with _image_roads_lock:
+        return _image_roads.get(image_uuid)
+
+
+# Путь к каталогу фото (из кэша или по записи в БД). None - если фото нет
+def get_image_road(db: Session, image_uuid: UUID):
+    image_road = get_cached_image_road(image_uuid)
+    if image_road:
+        return image_road
+
+    image_road = db.query(AdPhotos.url).filter(AdPhotos.id == image_uuid).scalar()
+    if not image_road:
+        logger.error(f"crud/image- get_image_road. Изображение не найдено: {image_uuid}")
+        return None
+
+    with _image_roads_lock:
+        _image_roads[image_uuid] = image_road
+    return image_road
+
+
+# Удаление фото из кэша путей (при удалении фото)
+def evict_image_road(image_uuid):
+    with _image_roads_lock:
+        _image_roads.pop(UUID(str(image_uuid)), None)
+
+
+# Кол-во записей фото, ссылающихся на каталог фото. Каталог общий для фото с одинаковым содержимым
+# (utils/image.get_image_road) и удаляется только когда ссылок на него не осталось
+def count_image_references(db: Session, image_road: str):
+    return db.query(func.count(AdPhotos.id)).filter(AdPhotos.url == image_road).scalar()
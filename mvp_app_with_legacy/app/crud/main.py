@@ -5,7 +5,7 @@ from app.schemas.main import InfoDocumentsRulesOut, InfoDocumentsOut
 logger = setup_logger(__name__)
 
 # Функция получения версии приложения из БД
-async def get_app_version(db: Session):
+def get_app_version(db: Session):
     """
     Получение версии приложения.
 
@@ -23,7 +23,7 @@ async def get_app_version(db: Session):
     return version[0]
 
 
-async def get_documents_by_type(doc_type, db):
+def get_documents_by_type(doc_type, db):
     """
     Получение версии приложения.
 
@@ -62,7 +62,7 @@ async def get_documents_by_type(doc_type, db):
     return info_documents_out
 
 
-async def get_advs_count(db):
+def get_advs_count(db):
     """
     Получение версии приложения.
 
@@ -82,7 +82,7 @@ async def get_advs_count(db):
     return advs_count
 
 
-async def get_active_users_count(db):
+def get_active_users_count(db):
     """
     Получение версии приложения.
 
@@ -0,0 +1,77 @@
+import threading
+from datetime import timedelta
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.core.config import settings, get_current_time2
+from app.db.db_models import User
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# Присутствие пользователей: время последней активности копится в памяти и записывается в БД
+# пакетно (flush), а признак online вычисляется при чтении из online_at - без изменения строк
+class UserPresence:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_seen = {}  # user_id => время последней активности (ещё не записанное в БД)
+
+    def touch(self, user_id):
+        with self._lock:
+            self._last_seen[user_id] = get_current_time2()
+
+    def last_seen(self, user_id):
+        with self._lock:
+            return self._last_seen.get(user_id)
+
+    # Актуальные online и online_at пользователя (с учетом ещё не записанной активности)
+    def get_status(self, db_user):
+        online_at = db_user.online_at
+        last_seen = self.last_seen(db_user.id)
+        if last_seen and (online_at is None or last_seen > online_at):
+            online_at = last_seen
+
+        if online_at is None:
+            return False, None
+        expire_at = online_at + timedelta(minutes=settings.ONLINE_USER_EXPIRE_MINUTES)
+        return expire_at >= get_current_time2(), online_at
+
+    # Возврат не записанного пакета: новая активность, пришедшая во время записи, не перезаписывается
+    def requeue(self, last_seen):
+        with self._lock:
+            for user_id, online_at in last_seen.items():
+                current = self._last_seen.get(user_id)
+                if current is None or online_at > current:
+                    self._last_seen[user_id] = online_at
+
+    def flush(self, db: Session):
+        with self._lock:
+            last_seen, self._last_seen = self._last_seen, {}
+        if not last_seen:
+            return 0
+
+        try:
+            db.bulk_update_mappings(
+                User, [{"id": user_id, "online": True, "online_at": online_at} for user_id, online_at in last_seen.items()]
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"crud/presence. flush. Ошибка записи активности пользователей: {str(e)}")
+            self.requeue(last_seen)
+            return 0
+        return len(last_seen)
+
+
+user_presence = UserPresence()
+
+
+# Вычисление online для загруженного пользователя. Значения выставляются как "загруженные из БД",
+# поэтому объект не помечается измененным и при следующем commit ничего не записывается
+def apply_online_status(db_user):
+    online, online_at = user_presence.get_status(db_user)
+    set_committed_value(db_user, 'online', online)
+    set_committed_value(db_user, 'online_at', online_at)
+    return db_user
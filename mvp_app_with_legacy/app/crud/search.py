@@ -0,0 +1,87 @@
+from sqlalchemy import Float, func, not_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.crud.field_values import NUMBER_PATTERN, BOOL_VALUES
+from app.db.db_models import Ad, AdFields, AdSearchDocument
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SEARCH_CONFIG = 'russian'  # Словарь полнотекстового поиска (стемминг и стоп-слова)
+
+
+# tsvector объявления: заголовок, описание и строковые значения доп.полей с разными весами
+def search_document_expression(title, description, fields_text):
+    return (
+        func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(title, '')), 'A')
+        .op('||')(func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(description, '')), 'B'))
+        .op('||')(func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(fields_text, '')), 'C'))
+    )
+
+
+# Выборка (ad_id, документ) для объявлений - основа и для записи одного объявления, и для заполнения
+def _search_documents_select(db: Session):
+    fields_text = (
+        db.query(AdFields.ad_id, func.string_agg(AdFields.value, ' ').label('text'))
+        .filter(
+            not_(AdFields.value.op('~')(NUMBER_PATTERN)),
+            AdFields.value.notin_(BOOL_VALUES.keys())
+        )
+        .group_by(AdFields.ad_id)
+        .subquery()
+    )
+    return (
+        db.query(Ad.id, search_document_expression(Ad.title, Ad.description, fields_text.c.text))
+        .outerjoin(fields_text, fields_text.c.ad_id == Ad.id)
+    )
+
+
+# Запись/обновление поискового документа (при публикации и редактировании объявления)
+def upsert_ad_search_document(ad_id, db: Session):
+    select_query = _search_documents_select(db).filter(Ad.id == ad_id)
+    statement = insert(AdSearchDocument).from_select(['ad_id', 'document'], select_query)
+    statement = statement.on_conflict_do_update(
+        index_elements=[AdSearchDocument.ad_id],
+        set_={'document': statement.excluded.document}
+    )
+    db.execute(statement)
+    db.commit()
+
+
+# Заполнение поисковых документов для объявлений, у которых их ещё нет
+def backfill_ad_search_documents(db: Session, batch_size=1000):
+    created = 0
+    while True:
+        select_query = (
+            _search_documents_select(db)
+            .outerjoin(AdSearchDocument, AdSearchDocument.ad_id == Ad.id)
+            .filter(AdSearchDocument.ad_id == None)
+            .limit(batch_size)
+        )
+        # Документ мог появиться параллельно (публикация объявления) - такие пропускаем
+        statement = insert(AdSearchDocument).from_select(['ad_id', 'document'], select_query)
+        result = db.execute(statement.on_conflict_do_nothing(index_elements=[AdSearchDocument.ad_id]))
+        db.commit()
+        if not result.rowcount:
+            break
+        created += result.rowcount
+
+    if created:
+        logger.info(f"crud/search. backfill_ad_search_documents. Добавлено поисковых документов: {created}")
+    return created
+
+
+# Подзапрос объявлений, подходящих под поисковую строку: ad_id и релевантность (rank).
+# websearch_to_tsquery принимает пользовательский ввод как есть (кавычки, "or", "-слово") без ошибок синтаксиса.
+# ts_rank_cd возвращает real (float4), а значение из курсора передается как float8 - сравнение real с float8
+# расширяет real (0.1 => 0.100000001...), и объявления с тем же rank, что у курсора, выпадают из следующей страницы.
+# Поэтому rank приводится к float8: в курсор попадает то же значение, с которым он сравнивается
+def get_search_subquery(search, db: Session):
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, search)
+    rank = func.ts_rank_cd(AdSearchDocument.document, ts_query).cast(Float(53))
+    return (
+        db.query(AdSearchDocument.ad_id, rank.label('rank'))
+        .filter(AdSearchDocument.document.op('@@')(ts_query))
+        .subquery()
+    )
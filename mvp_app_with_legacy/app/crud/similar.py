@@ -0,0 +1,254 @@
+from math import radians, sin, cos, asin, sqrt
+
+from fastapi import HTTPException
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud.catalog import get_fields_validator
+from app.crud.field_values import parse_typed_value
+from app.crud.geo import EARTH_RADIUS_KM
+from app.db.db_models import Ad, AdFields, AdGeoPoint, AdSimilar, AdSimilarState
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+PUBLISHED_STATUS = 3
+
+# Вклад признаков в оценку похожести (0..1)
+PRICE_WEIGHT = 0.4
+DISTANCE_WEIGHT = 0.3
+FIELDS_WEIGHT = 0.3
+DISTANCE_HALF_KM = 50  # Расстояние, на котором близость по местоположению равна 0.5
+
+
+# Признаки объявления для оценки похожести
+class SimilarProfile:
+    __slots__ = ('id', 'price', 'point', 'fields')
+
+    def __init__(self, ad_id, price, lat=None, long=None, fields=None):
+        self.id = ad_id
+        self.price = price
+        self.point = (lat, long) if lat is not None and long is not None else None
+        self.fields = fields or {}  # alias => число или строка
+
+
+def price_similarity(price, other_price):
+    if not price or not other_price or price <= 0 or other_price <= 0:
+        return 0.0
+    return min(price, other_price) / max(price, other_price)
+
+
+def distance_similarity(point, other_point):
+    if point is None or other_point is None:
+        return 0.0
+    lat1, long1, lat2, long2 = map(radians, (*point, *other_point))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((long2 - long1) / 2) ** 2
+    distance = 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+    return DISTANCE_HALF_KM / (DISTANCE_HALF_KM + distance)
+
+
+# Доля совпадающих ключевых доп.полей. Числа сравниваются по близости, остальное - на равенство
+def fields_similarity(fields, other_fields):
+    keys = fields.keys() | other_fields.keys()
+    if not keys:
+        return 0.0
+
+    total = 0.0
+    for key in keys:
+        value, other_value = fields.get(key), other_fields.get(key)
+        if value is None or other_value is None:
+            continue
+        if isinstance(value, float) and isinstance(other_value, float):
+            scale = max(abs(value), abs(other_value))
+            total += 1.0 - abs(value - other_value) / scale if scale else 1.0
+        elif value == other_value:
+            total += 1.0
+    return total / len(keys)
+
+
+# Оценка похожести двух объявлений одного каталога (симметричная)
+def similarity(profile: SimilarProfile, other: SimilarProfile):
+    return (
+        PRICE_WEIGHT * price_similarity(profile.price, other.price)
+        + DISTANCE_WEIGHT * distance_similarity(profile.point, other.point)
+        + FIELDS_WEIGHT * fields_similarity(profile.fields, other.fields)
+    )
+
+
+# Ключевые доп.поля каталога - поля, по которым в каталоге есть фильтр
+def _get_key_fields(catalog_id, db: Session):
+    try:
+        validator = get_fields_validator(catalog_id, db)
+    except HTTPException:
+        return []
+    return [alias for alias, field in validator.fields.items() if field['data'].get('show_filter')]
+
+
+def _load_fields(ad_ids, key_fields, db: Session):
+    fields = {}
+    if not key_fields:
+        return fields
+
+    rows = (
+        db.query(AdFields.ad_id, AdFields.key, AdFields.value)
+        .filter(AdFields.ad_id.in_(ad_ids), AdFields.key.in_(key_fields))
+        .all()
+    )
+    for row in rows:
+        typed_value = parse_typed_value(row.value)
+        value = typed_value[0] if typed_value and typed_value[0] is not None else row.value
+        fields.setdefault(row.ad_id, {})[row.key] = value
+    return fields
+
+
+# Кандидаты в похожие: опубликованные объявления того же каталога других продавцов, ближайшие по цене
+def _load_candidates(ad, db: Session):
+    query = (
+        db.query(Ad.id, Ad.price, AdGeoPoint.lat, AdGeoPoint.long)
+        .outerjoin(AdGeoPoint, AdGeoPoint.ad_id == Ad.id)
+        .filter(
+            Ad.catalog_id == ad.catalog_id,
+            Ad.status_id == PUBLISHED_STATUS,
+            Ad.id != ad.id,
+            Ad.user_id != ad.user_id
+        )
+    )
+    if ad.price:
+        query = query.order_by(func.abs(Ad.price - ad.price))
+    else:
+        query = query.order_by(Ad.created_at.desc())
+    return query.limit(settings.SIMILAR_ADS_CANDIDATES).all()
+
+
+# Оставляет в списках объявлений ad_ids не более SIMILAR_ADS_STORED лучших похожих
+def _trim_similar_ads(ad_ids, db: Session):
+    ranked = (
+        select(
+            AdSimilar.ad_id,
+            AdSimilar.similar_ad_id,
+            func.row_number().over(partition_by=AdSimilar.ad_id, order_by=AdSimilar.score.desc()).label('rank')
+        )
+        .where(AdSimilar.ad_id.in_(ad_ids))
+        .subquery()
+    )
+    extra = select(ranked.c.ad_id, ranked.c.similar_ad_id).where(ranked.c.rank > settings.SIMILAR_ADS_STORED)
+    db.query(AdSimilar).filter(
+        tuple_(AdSimilar.ad_id, AdSimilar.similar_ad_id).in_(extra)
+    ).delete(synchronize_session=False)
+
+
+# Пересчет похожих для опубликованного объявления (при публикации и после редактирования).
+# Оценка симметрична, поэтому объявление сразу добавляется и в списки кандидатов -
+# остальные списки не пересчитываются. Строки списков кандидатов пишутся в порядке ad_id,
+# чтобы параллельные пересчеты блокировали их в одном порядке
+def update_similar_ads(ad_id, db: Session):
+    try:
+        ad = db.query(Ad.id, Ad.user_id, Ad.catalog_id, Ad.price).filter(Ad.id == ad_id).first()
+        if not ad:
+            return False
+
+        candidates = _load_candidates(ad, db)
+        point = db.query(AdGeoPoint.lat, AdGeoPoint.long).filter(AdGeoPoint.ad_id == ad_id).first()
+        fields = _load_fields([ad_id, *(row.id for row in candidates)], _get_key_fields(ad.catalog_id, db), db)
+
+        profile = SimilarProfile(ad_id, ad.price, *(point or ()), fields=fields.get(ad_id))
+        scored = sorted(
+            ((similarity(profile, SimilarProfile(row.id, row.price, row.lat, row.long, fields.get(row.id))), row.id)
+             for row in candidates),
+            key=lambda item: item[0], reverse=True
+        )
+
+        db.query(AdSimilar).filter(AdSimilar.ad_id == ad_id).delete(synchronize_session=False)
+        if scored:
+            db.execute(insert(AdSimilar).values([
+                {"ad_id": ad_id, "similar_ad_id": similar_ad_id, "score": score}
+                for score, similar_ad_id in scored[:settings.SIMILAR_ADS_STORED]
+            ]))
+
+            statement = insert(AdSimilar).values([
+                {"ad_id": similar_ad_id, "similar_ad_id": ad_id, "score": score}
+                for score, similar_ad_id in sorted(scored, key=lambda item: item[1])
+            ])
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[AdSimilar.ad_id, AdSimilar.similar_ad_id],
+                set_={'score': statement.excluded.score}
+            ))
+            _trim_similar_ads([similar_ad_id for _, similar_ad_id in scored], db)
+        _mark_computed(ad_id, db)
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error(f"crud/similar. update_similar_ads. Ошибка пересчета похожих объявлений: {ad_id} => {str(e)}")
+        return False
+
+
+def _mark_computed(ad_id, db: Session):
+    statement = insert(AdSimilarState).values(ad_id=ad_id, computed_at=func.now())
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[AdSimilarState.ad_id],
+        set_={'computed_at': statement.excluded.computed_at}
+    ))
+
+
+# Объявление снято с публикации: удаляется его список и ссылки на него в списках других объявлений.
+# Сократившиеся списки других объявлений дополняются при публикации новых объявлений каталога
+def remove_similar_ads(ad_id, db: Session):
+    try:
+        db.query(AdSimilar).filter(
+            or_(AdSimilar.ad_id == ad_id, AdSimilar.similar_ad_id == ad_id)
+        ).delete(synchronize_session=False)
+        db.query(AdSimilarState).filter(AdSimilarState.ad_id == ad_id).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"crud/similar. remove_similar_ads. Ошибка удаления похожих объявлений: {ad_id} => {str(e)}")
+
+
+def _query_similar_ads(ad_id, user_id, db: Session, options):
+    return (
+        db.query(Ad)
+        .join(AdSimilar, AdSimilar.similar_ad_id == Ad.id)
+        .filter(AdSimilar.ad_id == ad_id, Ad.status_id == PUBLISHED_STATUS, Ad.user_id != user_id)
+        .order_by(AdSimilar.score.desc())
+        .options(*options)
+        .limit(settings.SIMILAR_ADS_LIMIT)
+        .all()
+    )
+
+
+# Список строится один раз: отметка вставляется до пересчета, поэтому из параллельных просмотров
+# пересчитывает только один. При ошибке пересчета отметка снимается
+def _build_similar_ads_once(ad_id, db: Session):
+    try:
+        statement = insert(AdSimilarState).values(ad_id=ad_id).on_conflict_do_nothing()
+        claimed = db.execute(statement).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"crud/similar. _build_similar_ads_once. Ошибка отметки пересчета: {ad_id} => {str(e)}")
+        return False
+    if not claimed:
+        return False
+
+    if update_similar_ads(ad_id, db):
+        return True
+    db.query(AdSimilarState).filter(AdSimilarState.ad_id == ad_id).delete(synchronize_session=False)
+    db.commit()
+    return False
+
+
+# Похожие объявления из сохраненного списка. Список пересчитывается при выдаче только для опубликованного
+# объявления, для которого он ещё не строился (опубликовано до появления ad_similar). Неполный построенный
+# список и список без объявлений самого пользователя (user_id) отдаются как есть - без записи в БД
+def get_similar_ads(ad_id, user_id, db: Session, options=()):
+    ads = _query_similar_ads(ad_id, user_id, db, options)
+    if len(ads) < settings.SIMILAR_ADS_LIMIT:
+        computed = db.query(AdSimilarState.ad_id).filter(AdSimilarState.ad_id == ad_id).first()
+        if computed is None:
+            status_id = db.query(Ad.status_id).filter(Ad.id == ad_id).scalar()
+            if status_id == PUBLISHED_STATUS and _build_similar_ads_once(ad_id, db):
+                ads = _query_similar_ads(ad_id, user_id, db, options)
+    return ads
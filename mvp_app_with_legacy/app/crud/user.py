@@ -2,26 +2,27 @@ import hashlib
 import io
 import json
 import uuid
-from datetime import timedelta
 from pathlib import Path
 from typing import Optional, List
 from fastapi import Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from app.core.config import settings, get_current_time2
-from app.db.db_models import User, UserLocation, Ad, UserDevices, UserViews, CashWallet, WalletTransactions
+from app.crud.feed import FEED_ITEM_OPTIONS, get_favorite_ids, build_feed_items
+from app.crud.presence import user_presence, apply_online_status
+from app.db.db_models import User, UserLocation, Ad, UserDevices, CashWallet, WalletTransactions
 from app.logger import setup_logger
 from app.schemas import user as user_schemas
-from app.schemas.ad import LocationOutModel, ItemsOutModel
+from app.schemas.ad import LocationOutModel
 from app.utils import security, exception
 from app.utils.ad import validate_location
 from app.utils.dependencies import oauth2_scheme, get_db
+from app.utils.notifications import notification_client
 import os
 import shutil
 from PIL import Image
 from pillow_heif import register_heif_opener
 from app.db.db_models import UserPhoto
-import httpx
 logger = setup_logger(__name__)
 
 def create_user(db: Session, user: user_schemas.UserCreate):
@@ -92,14 +93,13 @@ def get_current_user(db: Session = Depends(get_db),
         logger.error(f"crud/user- get_current_user. Пользователь не авторизован")
         raise exception.credentials_exception
 
-    user.online_at = get_current_time2()
-    if not user.online:
-        user.online = True
-        db.commit()
+    # Активность записывается в БД пакетно (см. crud/presence)
+    user_presence.touch(user.id)
+    apply_online_status(user)
     return user
 
 
-async def get_current_user_or_none(db: Session = Depends(get_db), access_token: str = Depends(oauth2_scheme)) -> \
+def get_current_user_or_none(db: Session = Depends(get_db), access_token: str = Depends(oauth2_scheme)) -> \
 Optional[User]:
     try:
         user = get_current_user(db, access_token)
@@ -112,7 +112,7 @@ Optional[User]:
 def get_user_by_id(db: Session, user_id: int):
     db_user = db.query(User).get(user_id)
     if db_user:
-        check_user_online(db_user, db)
+        apply_online_status(db_user)
         return db_user
     else:
         logger.error(f"crud/user- get_user_by_id. Пользователь по id не найден")
@@ -206,7 +206,7 @@ def update_phone(db: Session, user: user_schemas.UserChangePhone):
     return True
 
 
-async def edit_user_data(key, name, location, photo, delete_photo, db):
+def edit_user_data(key, name, location, photo, delete_photo, db):
     # user = db.query(User).filter(User.id == key).first()
     user = db.query(User).get(key)
     errors = {}
@@ -260,10 +260,10 @@ async def edit_user_data(key, name, location, photo, delete_photo, db):
         db.add(user)
 
     if photo:
-        await save_user_photo(photo, key, db)
+        save_user_photo(photo, key, db)
 
     if delete_photo and not photo:
-        await delete_user_photo(db, key)
+        delete_user_photo(db, key)
 
     user.updatedAt = get_current_time2()
     db.commit()
@@ -297,15 +297,15 @@ def get_user_image_by_uuid(db: Session, image_uuid: uuid.UUID):
         return False
 
 
-async def upload_user_photo(photo, user_id, db):
+def upload_user_photo(photo, user_id, db):
     if photo:
-        result = await save_user_photo(photo, user_id, db)
+        result = save_user_photo(photo, user_id, db)
     else:
         result = False
     return result
 
 
-async def save_user_photo(image, user_id, db):
+def save_user_photo(image, user_id, db):
     try:
         image_content = image.file.read()
         image_hash = hashlib.md5(image_content).hexdigest()
@@ -328,8 +328,8 @@ async def save_user_photo(image, user_id, db):
         elif orientation_value == 8:
             im = im.rotate(90, expand=True)
 
-        await save_user_image_square_thumbnails(image=im, road=road)
-        await write_user_image_road(db=db, user_id=user_id, image_road=road)
+        save_user_image_square_thumbnails(image=im, road=road)
+        write_user_image_road(db=db, user_id=user_id, image_road=road)
 
     except Exception as e:
         print('error', str(e))
@@ -338,7 +338,7 @@ async def save_user_photo(image, user_id, db):
     return True
 
 
-async def save_user_image_square_thumbnails(image, road):
+def save_user_image_square_thumbnails(image, road):
     width, height = image.size
     if width > height:
         cropped = (width - height) / 2
@@ -350,10 +350,10 @@ async def save_user_image_square_thumbnails(image, road):
         im = im.resize((300, 300))
     else:
         im = image.resize((300, 300))
-    await save_file_in_folder(image=im, road=road, resolution="300x300")
+    save_file_in_folder(image=im, road=road, resolution="300x300")
 
 
-async def write_user_image_road(db: Session, user_id: int, image_road: str):
+def write_user_image_road(db: Session, user_id: int, image_road: str):
     user_images = db.query(UserPhoto).filter(UserPhoto.user_id == user_id).all()
 
     for user_image in user_images:
@@ -370,7 +370,7 @@ async def write_user_image_road(db: Session, user_id: int, image_road: str):
     return True
 
 
-async def delete_user_photo(db: Session, user_id: int):
+def delete_user_photo(db: Session, user_id: int):
     user_images = db.query(UserPhoto).filter(UserPhoto.user_id == user_id).all()
 
     for user_image in user_images:
@@ -382,7 +382,7 @@ async def delete_user_photo(db: Session, user_id: int):
             shutil.rmtree(os.path.dirname(user_url))
 
 
-async def save_file_in_folder(image, road, resolution):
+def save_file_in_folder(image, road, resolution):
     Path(f"./files/{road}").mkdir(parents=True, exist_ok=True)
     image.save(f"./files/{road}/{resolution}.webp", format="webp")
 
@@ -399,7 +399,7 @@ def get_image_orientation(image_content):
     return orientation_value
 
 
-async def add_or_remove_favorites(user_id: int, ad_id: uuid, db: Session):
+def add_or_remove_favorites(user_id: int, ad_id: uuid, db: Session):
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         logger.error(f"crud/user- add_or_remove_favorites. Пользователь не найден")
@@ -421,47 +421,36 @@ async def add_or_remove_favorites(user_id: int, ad_id: uuid, db: Session):
     return {"favorite": action}
 
 
-async def add_list_favorites(user_id: int, ad_list: List[uuid.UUID], db: Session):
+def add_list_favorites(user_id: int, ad_list: List[uuid.UUID], db: Session):
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         logger.error(f"crud/user- add_list_favorites. Пользователь не найден")
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
+    # Объявления списка и уже добавленные в избранное - одним запросом каждое
+    ads_by_id = {ad.id: ad for ad in db.query(Ad).filter(Ad.id.in_(ad_list)).options(*FEED_ITEM_OPTIONS)}
+    favorite_ids = get_favorite_ids(user_id, list(ads_by_id), db)
+
     added_ads = []
     # already_added_ads = []
     # not_added_ads = []
     for ad_id in ad_list:
-        ad = db.query(Ad).get(ad_id)
+        ad = ads_by_id.get(ad_id)
         if ad:
-            if ad not in user.favorite_advs:
+            if ad.id not in favorite_ids:
                 added_ads.append(ad)
                 user.favorite_advs.append(ad)
+                favorite_ids.add(ad.id)
         #     if ad in user.favorite_advs:
         #         already_added_ads.append(ad_id)
         # else:
         #     not_added_ads.append(ad_id)
 
-    db.commit()
+    # Ответ строится до commit: после него объявления и их связи истекают (expire_on_commit)
+    # и загружались бы заново по одному. Все добавленные объявления - в избранном пользователя
+    added_ads_response = build_feed_items(added_ads, user_id, db, favorite_ids={ad.id for ad in added_ads})
 
-    added_ads_response = []
-    for ad in added_ads:
-        if ad.photos:
-            photos = ad.photos[0].id
-        else:
-            photos = ''
-
-        item = ItemsOutModel(
-            id=ad.id,
-            title=ad.title,
-            description=ad.description,
-            price=ad.price,
-            location=ad.location.to_dict(),
-            photos=photos,
-            favorite=True,  # Предполагаем, что объявление добавлено в избранное
-            status=str(ad.status.status),
-            created_at=str(ad.created_at)
-        )
-        added_ads_response.append(item)
+    db.commit()
 
     return {"items": added_ads_response}
     # return { "items": added_ads_response, "already_added_ads": already_added_ads, "not_added_ads": not_added_ads }
@@ -470,129 +459,27 @@ async def add_list_favorites(user_id: int, ad_list: List[uuid.UUID], db: Session
 async def change_notification_auth(unique_id: str, is_auth: bool):
     if settings.MODE == "TEST":
         return
+    await notification_client.set_auth(unique_id, is_auth)
 
-    data = {
-        "unique_id": unique_id,
-        "is_auth": is_auth
-    }
-    NOTIFICATION_TOKEN_LINK = settings.NOTIFICATION_TOKEN_URL + settings.NOTIFICATION_TOKEN_PATH
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(NOTIFICATION_TOKEN_LINK, json=data)
-            return response
-    except:
-        logger.error(f"crud/user- change_notification_auth. Ошибка соединения")
-        raise HTTPException(status_code=404, detail={
-            "msg": "Ошибка соединения"
-        })
-
-
-async def delete_all_notification_auth(user_id: int, refresh_token: str, db):
-    user_devices_list = db.query(UserDevices).filter(
+
+# Уникальные идентификаторы устройств пользователя, кроме текущего (получаются до удаления устройств)
+def get_other_devices_unique_ids(user_id: int, refresh_token: str, db):
+    user_devices_list = db.query(UserDevices.uniqueId).filter(
         UserDevices.user_id == user_id,
         UserDevices.token != refresh_token
     ).all()
-    responses_list = []
-    is_auth = False
+    return [user_device.uniqueId for user_device in user_devices_list]
 
-    unique_id_list = [user_device.uniqueId for user_device in user_devices_list]
 
-    for unique_id in unique_id_list:
-        data = {
-            "unique_id": unique_id,
-            "is_auth": is_auth
-        }
-        NOTIFICATION_TOKEN_LINK = settings.NOTIFICATION_TOKEN_URL + settings.NOTIFICATION_TOKEN_PATH
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(NOTIFICATION_TOKEN_LINK, json=data)
-                responses_list.append(response)
-        except:
-            logger.error(f"crud/user- delete_all_notification_auth. Ошибка соединения unique_id: {unique_id}")
-            raise HTTPException(status_code=404, detail={
-                "msg": "Ошибка соединения"
-            })
-    return responses_list
-
-
-def check_user_online(db_user, db):
-    if db_user.online:
-        now = get_current_time2()
-        if not db_user.online_at:
-            db_user.online = False
-            db.commit()
-        else:
-            db_user_online_at = db_user.online_at
-            db_user_expire_at = db_user_online_at + timedelta(minutes=settings.ONLINE_USER_EXPIRE_MINUTES)
-            if db_user_expire_at < now:
-                db_user.online = False
-                db.commit()
-
-
-def inc_user_views(db_user, db):
-    try:
-        db_user.views += 1
-        db.commit()
-        return True
-    except:
-        logger.error(f"crud/user- inc_user_views. Ошибка добавления просмотра для user_id: {db_user.id}")
-        return False
-
-
-async def inc_unique_views(current_user, device_id, user_id, db_user, db):
-    if current_user:
-        user_views_auth = db.query(UserViews).filter(UserViews.device_id == device_id,
-                                                     UserViews.user_viewed_id == user_id,
-                                                     UserViews.user_id == current_user.id).first()
-
-        # Если нет записей с авторизацией, проверям есть ли записи без авторизации для текущего устройства
-        if not user_views_auth:
-            user_views_no_auth = db.query(UserViews).filter(UserViews.device_id == device_id,
-                                                            UserViews.user_viewed_id == user_id,
-                                                            UserViews.user_id == None).first()
-
-            # Если нет записей БЕЗ авторизации, то создаем новую и увеличиваем просмотры
-            if not user_views_no_auth:
-                # CREATE NEW views record without auth => then =>
-                new_user_view = UserViews(id=uuid.uuid4(),
-                                          user_id=current_user.id,
-                                          user_viewed_id=user_id,
-                                          device_id=device_id,
-                                          created_at=get_current_time2())
-                db.add(new_user_view)
-                db.commit()
-
-                inc_user_views(db_user, db)
-
-            # Если существует запись БЕЗ авторизации, добавляем в эту запись авторизацию
-            else:
-                user_views_no_auth.user_id = current_user.id
-                db.commit()
-
-        # Если запись с авторизацией уже есть, то пропускаем
-        else:
-            pass
-
-    # Если запрос без авторизации
-    else:
-        # Проверяем существуют ли записи без учета авторизации для текущего устройства
-        user_views_no_auth = db.query(UserViews).filter(UserViews.device_id == device_id,
-                                                        UserViews.user_viewed_id == user_id).first()
-        # Если нет записей, то создаем новую и увеличиваем просмотры
-        if not user_views_no_auth:
-            # CREATE NEW views record without auth => then =>
-            new_user_view = UserViews(id=uuid.uuid4(),
-                                      user_viewed_id=user_id,
-                                      device_id=device_id,
-                                      created_at=get_current_time2())
-            db.add(new_user_view)
-            db.commit()
-
-            inc_user_views(db_user, db)
-
-        # Если нашли хоть одну запись для текущего устройства, то пропускаем
-        else:
-            pass
+# Выход на устройствах: запросы к сервису уведомлений - общим клиентом, параллельно или пакетами.
+# Недоставленное повторяется в фоне (utils/notifications)
+async def delete_all_notification_auth(unique_ids: list):
+    if settings.MODE == "TEST":
+        return
+    delivered = await notification_client.set_auth_many(unique_ids, is_auth=False)
+    if delivered < len(unique_ids):
+        logger.error(f"crud/user- delete_all_notification_auth. Доставлено {delivered} из {len(unique_ids)}, "
+                     f"остальные - в очереди повторов")
 
 
 # Создание денежного кошелька
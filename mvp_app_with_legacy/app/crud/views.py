@@ -0,0 +1,131 @@
+import threading
+import uuid
+from collections import Counter
+
+from cachetools import TTLCache
+from sqlalchemy.orm import Session
+
+from app.core.config import get_current_time2
+from app.db.db_models import Ad, AdvViews, User, UserViews
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# Буфер уникальных просмотров: просмотр фиксируется в памяти, а в БД записывается пакетно (flush).
+# Повторные просмотры (объект, устройство, пользователь) отсекаются в памяти ещё до записи,
+# окончательная проверка уникальности - по записям в БД при записи пакета.
+# Пакет, который не удалось записать, возвращается в буфер и повторяется при следующих flush
+# (не более max_retries раз), после чего просмотры снимаются с отметки и будут учтены при повторном просмотре
+class ViewsBuffer:
+    def __init__(self, model, target_column, counter_column, seen_size=100000, seen_ttl=3600, max_retries=3):
+        self.model = model  # AdvViews / UserViews
+        self.target_column = target_column  # колонка просматриваемого объекта в model
+        self.counter_column = counter_column  # счетчик просмотров объекта (Ad.views / User.views)
+        self._lock = threading.Lock()
+        self._events = []
+        self._seen = TTLCache(maxsize=seen_size, ttl=seen_ttl)
+        self.max_retries = max_retries
+        self._attempts = {}  # просмотр => кол-во неудачных попыток записи
+
+    def add(self, target_id, device_id, user_id=None):
+        event = (target_id, device_id, user_id)
+        with self._lock:
+            if event in self._seen:
+                return False
+            self._seen[event] = True
+            self._events.append(event)
+        return True
+
+    def drain(self):
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    # Возврат не записанного пакета в буфер (перед новыми просмотрами)
+    def requeue(self, events):
+        dropped = 0
+        with self._lock:
+            retry = []
+            for event in events:
+                attempts = self._attempts.get(event, 0) + 1
+                if attempts > self.max_retries:
+                    self._attempts.pop(event, None)
+                    self._seen.pop(event, None)
+                    dropped += 1
+                    continue
+                self._attempts[event] = attempts
+                retry.append(event)
+            self._events = retry + self._events
+        if dropped:
+            logger.error(f"crud/views. requeue. Не записано просмотров {self.model.__tablename__}: {dropped}")
+
+    # Запись накопленных просмотров: одна выборка существующих записей, пакетная вставка новых
+    # и атомарное увеличение счетчиков (views = views + n) по каждому объекту
+    def flush(self, db: Session):
+        events = self.drain()
+        if not events:
+            return 0
+
+        target_column = getattr(self.model, self.target_column)
+        target_ids = {target_id for target_id, _, _ in events}
+        device_ids = {device_id for _, device_id, _ in events}
+
+        try:
+            records = {}
+            existing = (
+                db.query(self.model)
+                .filter(target_column.in_(target_ids), self.model.device_id.in_(device_ids))
+                .all()
+            )
+            for view in existing:
+                records.setdefault((getattr(view, self.target_column), view.device_id), []).append(view)
+
+            increments = Counter()
+            for target_id, device_id, user_id in events:
+                views = records.setdefault((target_id, device_id), [])
+                if user_id:
+                    # Запись с авторизацией уже есть - пропускаем
+                    if any(view.user_id == user_id for view in views):
+                        continue
+                    # Есть запись БЕЗ авторизации - добавляем в неё авторизацию
+                    view_no_auth = next((view for view in views if view.user_id is None), None)
+                    if view_no_auth:
+                        view_no_auth.user_id = user_id
+                        continue
+                # Без авторизации - учитываем только первый просмотр с устройства
+                elif views:
+                    continue
+
+                new_view = self.model(id=uuid.uuid4(), user_id=user_id, device_id=device_id,
+                                      created_at=get_current_time2(), **{self.target_column: target_id})
+                db.add(new_view)
+                views.append(new_view)
+                increments[target_id] += 1
+
+            counter_model = self.counter_column.class_
+            for target_id, count in increments.items():
+                db.query(counter_model).filter(counter_model.id == target_id).update(
+                    {self.counter_column: self.counter_column + count}, synchronize_session=False
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"crud/views. flush. Ошибка записи просмотров {self.model.__tablename__}: {str(e)}")
+            self.requeue(events)
+            return 0
+
+        if self._attempts:
+            with self._lock:
+                for event in events:
+                    self._attempts.pop(event, None)
+
+        return sum(increments.values())
+
+
+adv_views_buffer = ViewsBuffer(AdvViews, 'adv_viewed_id', Ad.views)
+user_views_buffer = ViewsBuffer(UserViews, 'user_viewed_id', User.views)
+
+
+def flush_views(db: Session):
+    return adv_views_buffer.flush(db) + user_views_buffer.flush(db)
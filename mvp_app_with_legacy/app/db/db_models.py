@@ -1,8 +1,8 @@
 import uuid
 from enum import Enum
 from sqlalchemy import Column, Integer, String, TIMESTAMP, BOOLEAN, ForeignKey, BigInteger, Enum as EnumSQL, FLOAT, \
-    DateTime, Sequence, Table, MetaData, Float, func, CheckConstraint
-from sqlalchemy.dialects.postgresql import UUID
+    DateTime, Sequence, Table, MetaData, Float, func, CheckConstraint, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
@@ -10,4 +10,84 @@ from sqlalchemy.orm import relationship
 Base = declarative_base()
 metadata = MetaData()
 
-### MODELS ###
\ No newline at end of file
+### MODELS ###
+
+
+# Координаты местоположения объявления в числовом виде (Location.lat/long хранятся строками).
+# Индекс (lat, long) обслуживает предфильтр ограничивающим прямоугольником при поиске по радиусу.
+# Некорректные координаты - NULL: строка есть (не выбирается повторно при заполнении), но в радиус не попадает
+class AdGeoPoint(Base):
+    __tablename__ = "ad_geo_points"
+
+    ad_id = Column(UUID(as_uuid=True), primary_key=True)
+    lat = Column(Float, nullable=True)
+    long = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("ix_ad_geo_points_lat_long", "lat", "long"),
+    )
+
+
+# Типизированная проекция доп.полей объявления (AdFields.value хранится строкой), одна запись на доп.поле.
+# Числовые и логические значения дублируются сюда при публикации/редактировании полей,
+# индексы (key, value) обслуживают фильтры-диапазоны без приведения типов и полного перебора EAV
+class AdFieldValue(Base):
+    __tablename__ = "ad_field_values"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ad_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    key = Column(String, nullable=False)
+    value_num = Column(Float, nullable=True)
+    value_bool = Column(BOOLEAN, nullable=True)
+
+    __table_args__ = (
+        Index("ix_ad_field_values_key_num", "key", "value_num", "ad_id"),
+        Index("ix_ad_field_values_key_bool", "key", "value_bool", "ad_id"),
+        UniqueConstraint("ad_id", "key", name="uq_ad_field_values_ad_id_key"),
+    )
+
+
+# Поисковый документ объявления: заголовок (вес A), описание (вес B) и строковые значения доп.полей (вес C),
+# разобранные русским словарем полнотекстового поиска. GIN-индекс обслуживает поиск по словоформам
+class AdSearchDocument(Base):
+    __tablename__ = "ad_search_documents"
+
+    ad_id = Column(UUID(as_uuid=True), primary_key=True)
+    document = Column(TSVECTOR, nullable=False)
+
+    __table_args__ = (
+        Index("ix_ad_search_documents_document", "document", postgresql_using="gin"),
+    )
+
+
+# Похожие объявления: для опубликованного объявления хранятся лучшие по оценке похожести объявления
+# того же каталога. Списки пересчитываются при публикации/снятии с публикации (crud/similar),
+# индекс (ad_id, score) обслуживает выдачу похожих одним запросом
+class AdSimilar(Base):
+    __tablename__ = "ad_similar"
+
+    ad_id = Column(UUID(as_uuid=True), primary_key=True)
+    similar_ad_id = Column(UUID(as_uuid=True), primary_key=True)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_ad_similar_ad_id_score", "ad_id", "score"),
+        Index("ix_ad_similar_similar_ad_id", "similar_ad_id"),
+    )
+
+
+# Выполненные разовые заполнения данных при запуске (crud/backfill): выполненное не повторяется
+class DataBackfill(Base):
+    __tablename__ = "data_backfills"
+
+    name = Column(String, primary_key=True)
+    completed_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+# Отметка о построении списка похожих объявления: пересчет при выдаче (crud/similar.get_similar_ads) выполняется
+# только для объявлений без списка, неполный построенный список (мало объявлений в каталоге) не пересчитывается
+class AdSimilarState(Base):
+    __tablename__ = "ad_similar_state"
+
+    ad_id = Column(UUID(as_uuid=True), primary_key=True)
+    computed_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
@@ -3,14 +3,14 @@ from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
-# engine = create_engine(settings.DATABASE_URL, pool_size=50)
+# engine = create_engine(settings.DATABASE_URL, pool_size=settings.DB_POOL_SIZE)
 
 
 if settings.MODE == 'TEST':
-    engine = create_engine(settings.TEST_DATABASE_URL, pool_size=50)
+    engine = create_engine(settings.TEST_DATABASE_URL, pool_size=settings.DB_POOL_SIZE)
 elif settings.MODE == 'DEV':
-    engine = create_engine(settings.DATABASE_URL, pool_size=50)
+    engine = create_engine(settings.DATABASE_URL, pool_size=settings.DB_POOL_SIZE)
 else:
-    engine = create_engine(settings.DATABASE_URL, pool_size=50)  # standard env
+    engine = create_engine(settings.DATABASE_URL, pool_size=settings.DB_POOL_SIZE)  # standard env
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
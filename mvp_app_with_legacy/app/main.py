@@ -9,7 +9,22 @@ from fastapi.staticfiles import StaticFiles
 from app.api.routers import api_router
 from app.core.config import settings
 from app.db.db_models import Base
-from app.db.session import engine
+from app.db.session import engine, SessionLocal
+from app.crud.geo import backfill_ad_geo_points
+from app.crud.field_values import backfill_ad_field_values
+from app.crud.search import backfill_ad_search_documents
+from app.crud.backfill import run_backfills
+from app.crud.ad import create_ads_keyset_indexes
+from app.crud.presence import user_presence
+from app.crud.views import flush_views
+from app.crud.car import car_directory
+from app.utils.autocomplete import autocomplete_index
+from app.utils.image import resume_image_jobs
+from app.utils.image_jobs import image_jobs
+from app.utils.image_variants import image_variants
+from app.utils.phone import telephony
+from app.utils.notifications import notification_client
+from app.utils.concurrency import run_db
 import asyncio
 from app.logger import setup_logger
 from pathlib import Path
@@ -154,3 +169,72 @@ async def startup_event():
     redis = aioredis.from_url(f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}", encoding="utf8",
                               decode_responses=True)
     FastAPICache.init(RedisBackend(redis), prefix="kvik-cache")
+
+    # Дозаполняем (один раз, одним процессом) для уже существующих объявлений: координаты для поиска
+    # по радиусу, типизированные значения доп.полей для фильтров-диапазонов, поисковые документы
+    # и индексы курсорной пагинации ленты
+    run_backfills([
+        ("ad_geo_points", backfill_ad_geo_points),
+        ("ad_field_values", backfill_ad_field_values),
+        ("ad_search_documents", backfill_ad_search_documents),
+        ("ads_keyset_indexes", create_ads_keyset_indexes),
+    ])
+    # Загружаем индекс подсказок автокомплита и справочник автомобилей
+    with SessionLocal() as db:
+        autocomplete_index.load(db)
+        car_directory.get(db)
+    # Очистка кэша вариантов фото на диске до бюджета (общего для всех процессов)
+    await run_db(image_variants.sweep)
+    # Обработка фото, прерванная перезапуском
+    await resume_image_jobs()
+
+    # Общий клиент сервиса push-уведомлений и фоновые повторы недоставленного
+    notification_client.start()
+    # Настройка сервиса звонков (неизвестный или fake вне тестов - ошибка запуска)
+    telephony.start()
+
+    asyncio.create_task(flush_buffers_periodically())
+    asyncio.create_task(reload_autocomplete_periodically())
+
+
+# Периодическая запись накопленных в памяти просмотров объявлений и профилей и активности пользователей в БД
+async def write_buffers():
+    def flush():
+        with SessionLocal() as db:
+            flush_views(db)
+            user_presence.flush(db)
+
+    try:
+        await run_db(flush)
+    except Exception as e:
+        logger.error(f"main. write_buffers. Ошибка записи буферов: {str(e)}")
+
+
+async def flush_buffers_periodically():
+    while True:
+        await asyncio.sleep(settings.VIEWS_FLUSH_INTERVAL)
+        await write_buffers()
+
+
+# Периодическая перезагрузка индекса подсказок: объявления, опубликованные и снятые с публикации
+# в других процессах, и изменения заголовков каталога
+async def reload_autocomplete_periodically():
+    def reload():
+        with SessionLocal() as db:
+            autocomplete_index.load(db)
+
+    while True:
+        await asyncio.sleep(settings.AUTOCOMPLETE_REFRESH_INTERVAL)
+        try:
+            await run_db(reload)
+        except Exception as e:
+            logger.error(f"main. reload_autocomplete_periodically. Ошибка загрузки индекса подсказок: {str(e)}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Записываем данные, накопленные с последней записи
+    await write_buffers()
+    image_jobs.shutdown()
+    await telephony.close()
+    await notification_client.close()
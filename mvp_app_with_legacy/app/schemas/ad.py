@@ -129,11 +129,15 @@ class ItemsOutModel(BaseModel):
     favorite: bool
     status: str
     created_at: str
+    distance: Optional[float] = None  # Расстояние до объявления в метрах (при поиске по радиусу)
 
 
 class PaginatedItems(BaseModel):
     total: int
+    total_type: str = 'exact'  # exact / cached / estimate / has_more
+    has_more: Optional[bool] = None
     items: List[ItemsOutModel]
+    next_cursor: Optional[str] = None
 
 
 class ChangeAdStatusModel(BaseModel):
@@ -144,6 +148,17 @@ class AddOrEditAdvModel(BaseModel):
     id: UUID
 
 
+class PhotosJobModel(BaseModel):
+    ad_id: UUID
+    status: str  # queued / processing / done / failed
+    total: int
+    processed: int
+    failed: int
+    attempts: int
+    created_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+
+
 class AdvAndCatalogModel(BaseModel):
     ad_info: AdCatalogOutModel
     catalog_info: CatalogSchemaAdditionalFields
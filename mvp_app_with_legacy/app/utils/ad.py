@@ -3,11 +3,10 @@ from typing import List
 
 from fastapi import HTTPException, UploadFile
 
-from app.db.db_models import Catalog
 from app.logger import setup_logger
 from app.schemas.ad import LocationOutModel
 
-from app.crud.catalog import get_all_fields
+from app.crud.catalog import get_all_fields, get_fields_validator, catalog_registry
 from app.utils.additional_fields import validate_fields
 from app.db.list_constants import FIELDS_LIST, ALLOWED_FORMATS
 logger = setup_logger(__name__)
@@ -21,11 +20,11 @@ def get_dynamic_title(key, fields, db):
     # Если пустое заполняем обычно title = form_data.get("title")
     title = ""
     try:
-        dynamic_title_field = db.query(Catalog).filter_by(id=key).first().dynamic_title
+        dynamic_title_field = catalog_registry.get(db).dynamic_title(key)
         try:
             for dynamic_title in dynamic_title_field:
-                if dynamic_title.title in fields:
-                    title += fields[dynamic_title.title] + ' '
+                if dynamic_title in fields:
+                    title += fields[dynamic_title] + ' '
 
         except Exception as e:
             logger.error(f"utils/ad. get_dynamic_title. Ошибка 1: {str(e)}")
@@ -47,6 +46,8 @@ def validate_ad(key, form_data, db):
         invalid_fields = "По этому ID не найдены доп.поля"
         logger.error(f"utils/ad. validate_ad. Ошибка 1: {invalid_fields}")
         raise HTTPException(status_code=400, detail=invalid_fields)
+    # Скомпилированные доп.поля - до разбора формы: их отсутствие не ошибка формата данных
+    validator = get_fields_validator(key, db)
 
     try:
         description = form_data.get("description")
@@ -91,7 +92,7 @@ def validate_ad(key, form_data, db):
 
             invalid_form_data = validate_form_data(title, description, price)
             if field['additional_fields'] or additional_fields:
-                invalid_fields = validate_fields(field, additional_fields, db)
+                invalid_fields = validate_fields(validator, additional_fields, db)
             else:
                 invalid_fields = {'error': "", 'aliases': {}}
             invalid_location = validate_location(location_data)
@@ -209,16 +210,15 @@ def validate_categories(key, categories, db):
         logger.error(f"utils/ad. validate_categories. Ошибка 1: {errors}")
         return errors
 
-    catalog_id = key
-    catalog_list = [str(key)] # list of strings
+    catalog_id = str(key)
+    catalog_list = [catalog_id] # list of strings
+    catalog_parents = catalog_registry.get(db).parents
 
     while catalog_id:
-        catalog_id = db.query(Catalog.parent_id).filter(Catalog.id==catalog_id).first()[0]
+        catalog_id = catalog_parents[catalog_id]
 
         if catalog_id is not None:
-            catalog_list.append(str(catalog_id))
-        else:
-            catalog_id = None
+            catalog_list.append(catalog_id)
 
     for category in categories:
         if category not in catalog_list:
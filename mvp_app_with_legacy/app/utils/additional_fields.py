@@ -1,59 +1,135 @@
+import ast
+import re
+from functools import partial
+
 from app.utils.quarter import get_yearly_quarters
 from app.schemas.car import Car
 from app.crud import car as car_crud
 
+BOOL_VALUES = {'True': True, 'False': False}
 
-def validate_fields(field, data, db):
-    catalog_data = field # полученные данные раздела каталога по идентификатору
-    validate_data = data # полученные данные из запроса
-    invalid_data = {'error': "", 'aliases': {}}  # массив для записи ошибок
+# Целое или дробное число без ведущих нулей - такие значения literal_eval разбирает как int/float
+_number_re = re.compile(r'^-?(0|[1-9][0-9]*)(\.[0-9]+)?$')
+# Начало строки, с которого может начинаться литерал Python (число, строка, список, кортеж, словарь, set())
+_literal_re = re.compile(r'^\s*([-+.0-9\'"\[({]|[bBrRuUfF]{1,2}[\'"]|set\()')
+_literal_names = ('True', 'False', 'None')
 
-    if not validate_data: # если запрос пустой, то записываем ошибку и возвращаем ее, без продолжения
-        invalid_data['error'] = "В запросе не найдены данные"
-        return invalid_data
 
-    for key, value in validate_data.items(): # для каждого alias-ключа и его значения| проходим по данным из запроса
-        # key = значение alias, value = данные из запроса по текущему alias-у
-        # Пример =>   key  : value
-        # ========> "model": "BMW"
+# Значение доп.поля объявления из строки AdFields.value: литерал Python (список, число, True/False),
+# иначе true/false без учета регистра или исходная строка.
+# literal_eval вызывается только для строк, которые могут быть литералом
+def decode_literal(value):
+    if _literal_re.match(value) or value.strip() in _literal_names:
+        try:
+            return ast.literal_eval(value)
+        except (SyntaxError, ValueError):
+            pass
 
-        # получем одно доп.поле совпадающее с alias-ом из запроса
-        catalog_item = [catalog_item for catalog_item in catalog_data['additional_fields'] if
-                        catalog_item.get('alias') == key]
-        # print('catalog_item', catalog_item)
-        # если совпадений нет, то пишем ошибку и пропускаем этот круг цикла
-        if not catalog_item:
-            invalid_data['aliases'][key] = "Ошибка входных данных. В каталоге нет такого поля"
-            continue
+    lowered = value.lower()
+    return True if lowered == "true" else False if lowered == "false" else value
 
-        required = catalog_item[0]['required'] # обязательное ли к заполнению поле - значение true/false
-        item_type = catalog_item[0]['data']['type'] # тип поля в каталоге
 
-        item_properties = catalog_item[0]['data']['properties'] # данные properties в каталоге для этого поля
+def decode_checkbox(value):
+    if value in BOOL_VALUES:
+        return BOOL_VALUES[value]
+    return decode_literal(value)
 
-        # Валидируем все доп.поля по типу
-        if item_type == 'select':
-            validate_select_field(item_properties['options'], required, invalid_data, key, value)
 
-        elif item_type == 'checkboxes':
-            validate_checkboxes_field(item_properties['checks'], required, invalid_data, key, value)
+def decode_number(value):
+    match = _number_re.match(value)
+    if match:
+        return float(value) if match.group(2) else int(value)
+    return decode_literal(value)
 
-        elif item_type == 'color':
-            validate_color_field(item_properties['colors'], required, invalid_data, key, value)
 
-        elif item_type == 'text':
-            validate_text_field(required, invalid_data, key, value)
+# Скомпилированные доп.поля элемента каталога: доп.поле по alias, множества допустимых значений
+# для select/checkboxes/color и функции проверки и разбора значения для каждого поля.
+# Создается один раз при загрузке реестра каталога (crud/catalog) и используется всеми запросами
+class FieldsValidator:
+    def __init__(self, additional_fields):
+        self.fields = {}  # alias => доп.поле
+        self._validators = {}  # alias => функция проверки (invalid_data, key, value, validate_data, db)
+        self._decoders = {}  # alias => функция разбора значения из AdFields
 
-        elif item_type == 'number':
-            validate_number_field(item_properties, required, invalid_data, key, value)
+        for field in additional_fields:
+            alias = field['alias']
+            self.fields[alias] = field
+            self._validators[alias] = self._compile_validator(field)
+            self._decoders[alias] = self._compile_decoder(field)
 
-        elif item_type == 'checkbox':
-            validate_checkbox_field(invalid_data, key, value)
+    @staticmethod
+    def _compile_validator(field):
+        required = field['required']  # обязательное ли к заполнению поле - значение true/false
+        item_type = field['data'].get('type')  # тип поля в каталоге (у поля без field_data данных нет)
+        item_properties = field['data'].get('properties')  # данные properties в каталоге для этого поля
 
+        if item_type == 'select':
+            return partial(_validate_options, validate_select_field, frozenset(item_properties['options']), required)
+        elif item_type == 'checkboxes':
+            return partial(_validate_options, validate_checkboxes_field, frozenset(item_properties['checks']), required)
+        elif item_type == 'color':
+            colors = frozenset(color['name'] for color in item_properties['colors'])
+            return partial(_validate_options, validate_select_field, colors, required)
+        elif item_type == 'text':
+            return lambda invalid_data, key, value, validate_data, db: validate_text_field(
+                required, invalid_data, key, value)
+        elif item_type == 'number':
+            return lambda invalid_data, key, value, validate_data, db: validate_number_field(
+                item_properties, required, invalid_data, key, value)
+        elif item_type == 'checkbox':
+            return lambda invalid_data, key, value, validate_data, db: validate_checkbox_field(
+                invalid_data, key, value)
         elif item_type == 'select_request':
-            validate_request_field(validate_data, db, item_properties, required, invalid_data, key, value)
+            return lambda invalid_data, key, value, validate_data, db: validate_request_field(
+                validate_data, db, item_properties, required, invalid_data, key, value)
+        return None
+
+    @staticmethod
+    def _compile_decoder(field):
+        item_type = field['data'].get('type')
+        if item_type == 'checkbox':
+            return decode_checkbox
+        elif item_type == 'number':
+            return decode_number
+        return decode_literal
 
-    return invalid_data
+    def validate(self, data, db):
+        validate_data = data  # полученные данные из запроса
+        invalid_data = {'error': "", 'aliases': {}}  # массив для записи ошибок
+
+        if not validate_data:  # если запрос пустой, то записываем ошибку и возвращаем ее, без продолжения
+            invalid_data['error'] = "В запросе не найдены данные"
+            return invalid_data
+
+        for key, value in validate_data.items():
+            # если в каталоге нет такого alias-а, то пишем ошибку и пропускаем этот круг цикла
+            if key not in self._validators:
+                invalid_data['aliases'][key] = "Ошибка входных данных. В каталоге нет такого поля"
+                continue
+
+            validator = self._validators[key]
+            if validator:
+                validator(invalid_data, key, value, validate_data, db)
+
+        return invalid_data
+
+    # Значение доп.поля объявления (строка из AdFields) в типе поля
+    def decode(self, key, value):
+        return self._decoders.get(key, decode_literal)(value)
+
+
+# Проверка select/checkboxes/color по множеству допустимых значений.
+# Значения запроса неизвестного (нехешируемого) типа недопустимы
+def _validate_options(validate_func, options, required, invalid_data, key, value, validate_data, db):
+    try:
+        validate_func(options, required, invalid_data, key, value)
+    except TypeError:
+        invalid_data['aliases'][key] = "Недопустимое значение"
+
+
+# Проверка доп.полей из запроса по скомпилированным доп.полям элемента каталога (FieldsValidator)
+def validate_fields(validator, data, db):
+    return validator.validate(data, db)
 
 
 def validate_select_field(validate_list, required, invalid_data, key, value):
@@ -74,17 +150,6 @@ def validate_checkboxes_field(validate_list, required, invalid_data, key, value)
         invalid_data['aliases'][key] = "Недопустимое значение"
 
 
-def validate_color_field(validate_list, required, invalid_data, key, value):
-    validate_list = [color['name'] for color in validate_list]
-
-    if not isinstance(value, str):
-        invalid_data['aliases'][key] = "Неправильный тип данных"
-    elif not value and required:
-        invalid_data['aliases'][key] = "Обязательное поле"
-    elif value and value not in validate_list:
-        invalid_data['aliases'][key] = "Недопустимое значение"
-
-
 def validate_text_field(required, invalid_data, key, value):
     if not isinstance(value, str):
         invalid_data['aliases'][key] = "Неправильный тип данных"
@@ -138,24 +203,15 @@ def validate_request_field(validate_data, db, item_properties, required, invalid
     if item_url == 'car':
         item_dependencies = item_properties['dependencies']  # все зависимости значений для поля
         car_data = {}
-        if not item_dependencies:
-            car = Car(**car_data)
-            suggestion = car_crud.car_suggestion(db=db, car=car)
-            suggestion = suggestion['values']
-            if value not in suggestion:
-                invalid_data['aliases'][key] = "Недопустимое значение"
-        else:
-            for car_key, car_value in validate_data.items():
-                if car_key in item_dependencies:
-                    car_data[car_key] = car_value
+        for car_key, car_value in validate_data.items():
+            if car_key in item_dependencies:
+                car_data[car_key] = car_value
 
+        # Проверка по справочнику автомобилей в памяти (crud/car)
+        try:
             car = Car(**car_data)
-
-            try:
-                suggestion = car_crud.car_suggestion(db=db, car=car)
-                suggestion = set(map(str, suggestion['values']))
-                if value not in suggestion:
-                    invalid_data['aliases'][key] = "Недопустимое значение"
-            except Exception:
+            if not car_crud.is_car_value_allowed(db=db, car=car, value=value):
                 invalid_data['aliases'][key] = "Недопустимое значение"
+        except Exception:
+            invalid_data['aliases'][key] = "Недопустимое значение"
 
@@ -0,0 +1,165 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+
+from cachetools import LRUCache
+from sqlalchemy.orm import Session
+
+from app.db.db_models import Ad, MainCatalogTitle
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+AUTOCOMPLETE_LIMIT = 7  # Кол-во подсказок
+CATEGORIES_LIMIT = 3  # Кол-во категорий
+CATALOG_TITLE_WEIGHT = 5  # Вес фраз из заголовков каталога относительно заголовков объявлений
+MIN_WORD_LENGTH = 2
+TOP_CACHE_SIZE = 10000  # Кол-во префиксов в кэше подсказок
+MAX_CACHED_PREFIX_LENGTH = 20  # Более длинные префиксы не кэшируются: фраз с ними мало, выборка дешевая
+
+_word_re = re.compile(r'\w+')
+
+
+# Фразы для подсказок: отдельные слова и пары соседних слов заголовка
+def get_phrases(title):
+    words = [word for word in _word_re.findall(title.lower()) if len(word) >= MIN_WORD_LENGTH]
+    phrases = set(words)
+    phrases.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return phrases
+
+
+# Префиксный индекс подсказок в памяти процесса. Изменения объявлений в этом процессе применяются сразу,
+# изменения из других процессов и заголовки каталога - при перезагрузке (AUTOCOMPLETE_REFRESH_INTERVAL).
+# Фразы хранятся в отсортированном списке - все фразы с префиксом лежат подряд (поиск бинарный),
+# частоты - в словаре. Топ подсказок по префиксу кэшируется (LRU) до изменения фраз с этим префиксом.
+# Выбор топа по диапазону фраз выполняется вне блокировки - по копии диапазона, в кэш результат попадает,
+# только если фразы за это время не менялись (_generation)
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._counts = {}  # фраза => частота
+        self._phrases = []  # отсортированные фразы
+        self._ad_phrases = {}  # ad_id => фразы заголовка объявления (для удаления/замены)
+        self._catalog_titles = []  # (наименование в нижнем регистре, категория для выдачи)
+        self._top_cache = LRUCache(maxsize=TOP_CACHE_SIZE)  # (префикс, limit) => подсказки
+        self._generation = 0  # номер изменения фраз
+        self._loading_changes = None  # изменения объявлений во время загрузки - применяются к загруженному индексу
+        self.loaded = False
+
+    def _add_phrase(self, phrase, weight=1):
+        count = self._counts.get(phrase, 0)
+        if count == 0:
+            insort(self._phrases, phrase)
+        self._counts[phrase] = count + weight
+        self._invalidate(phrase)
+
+    def _remove_phrase(self, phrase, weight=1):
+        count = self._counts.get(phrase, 0) - weight
+        if count > 0:
+            self._counts[phrase] = count
+        elif phrase in self._counts:
+            del self._counts[phrase]
+            del self._phrases[bisect_left(self._phrases, phrase)]
+        self._invalidate(phrase)
+
+    def _invalidate(self, phrase):
+        self._generation += 1
+        for i in range(1, min(len(phrase), MAX_CACHED_PREFIX_LENGTH) + 1):
+            self._top_cache.pop((phrase[:i], AUTOCOMPLETE_LIMIT), None)
+
+    # Полная загрузка: заголовки опубликованных объявлений и заголовки каталога
+    def load(self, db: Session):
+        with self._lock:
+            self._loading_changes = []
+
+        try:
+            ad_phrases = {}
+            counts = {}
+            for ad_id, title in db.query(Ad.id, Ad.title).filter(Ad.status_id == 3).yield_per(1000):
+                phrases = get_phrases(title or '')
+                ad_phrases[ad_id] = phrases
+                for phrase in phrases:
+                    counts[phrase] = counts.get(phrase, 0) + 1
+
+            catalog_titles = []
+            for catalog_title in db.query(MainCatalogTitle).all():
+                category = {"id": catalog_title.parent_id, "filter": catalog_title.filter}
+                catalog_titles.append((catalog_title.filter.lower(), category))
+                for phrase in get_phrases(catalog_title.filter):
+                    counts[phrase] = counts.get(phrase, 0) + CATALOG_TITLE_WEIGHT
+        except Exception:
+            with self._lock:
+                self._loading_changes = None
+            raise
+
+        with self._lock:
+            self._counts = counts
+            self._phrases = sorted(counts)
+            self._ad_phrases = ad_phrases
+            self._catalog_titles = catalog_titles
+            self._top_cache.clear()
+            self._generation += 1
+            self.loaded = True
+            changes, self._loading_changes = self._loading_changes or [], None
+            for change in changes:
+                change()
+
+        logger.info(f"utils/autocomplete. load. Загружено фраз для подсказок: {len(counts)}")
+
+    # Добавление/замена заголовка объявления (при публикации)
+    def add_ad(self, ad_id, title):
+        phrases = get_phrases(title or '')
+        with self._lock:
+            if self._loading_changes is not None:
+                self._loading_changes.append(lambda: self.add_ad(ad_id, title))
+            old_phrases = self._ad_phrases.get(ad_id, set())
+            for phrase in old_phrases - phrases:
+                self._remove_phrase(phrase)
+            for phrase in phrases - old_phrases:
+                self._add_phrase(phrase)
+            self._ad_phrases[ad_id] = phrases
+
+    # Удаление заголовка объявления (при снятии с публикации)
+    def remove_ad(self, ad_id):
+        with self._lock:
+            if self._loading_changes is not None:
+                self._loading_changes.append(lambda: self.remove_ad(ad_id))
+            for phrase in self._ad_phrases.pop(ad_id, ()):
+                self._remove_phrase(phrase)
+
+    # Подсказки по префиксу - самые частые фразы, начинающиеся с search
+    def suggest(self, search, limit=AUTOCOMPLETE_LIMIT):
+        prefix = ' '.join(_word_re.findall(search.lower()))
+        if not prefix:
+            return []
+
+        cacheable = len(prefix) <= MAX_CACHED_PREFIX_LENGTH and limit == AUTOCOMPLETE_LIMIT
+        with self._lock:
+            if cacheable:
+                suggestions = self._top_cache.get((prefix, limit))
+                if suggestions is not None:
+                    return suggestions
+            start = bisect_left(self._phrases, prefix)
+            end = bisect_left(self._phrases, prefix + '\uffff', lo=start)
+            phrases = self._phrases[start:end]
+            counts = self._counts
+            generation = self._generation
+
+        suggestions = heapq.nlargest(limit, phrases, key=lambda phrase: (counts.get(phrase, 0), -len(phrase)))
+
+        if cacheable:
+            with self._lock:
+                if self._generation == generation:
+                    self._top_cache[(prefix, limit)] = suggestions
+        return suggestions
+
+    # Категории, в наименовании которых встречается search
+    def categories(self, search, limit=CATEGORIES_LIMIT):
+        search = search.lower()
+        with self._lock:
+            catalog_titles = self._catalog_titles
+        return [category for title, category in catalog_titles if search in title][:limit]
+
+
+autocomplete_index = AutocompleteIndex()
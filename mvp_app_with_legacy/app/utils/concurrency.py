@@ -0,0 +1,22 @@
+from functools import partial
+
+import anyio
+from anyio import to_thread
+
+from app.core.config import settings
+
+_db_limiter = None
+
+
+# Ограничитель кол-ва одновременных синхронных запросов к БД (создается в работающем event loop)
+def get_db_limiter():
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(settings.DB_CONCURRENCY)
+    return _db_limiter
+
+
+# Выполнение синхронной функции CRUD (Session SQLAlchemy) в пуле потоков, не блокируя event loop.
+# Сессия запроса используется последовательно (await), поэтому передавать её в поток безопасно
+async def run_db(func, *args, **kwargs):
+    return await to_thread.run_sync(partial(func, *args, **kwargs), limiter=get_db_limiter())
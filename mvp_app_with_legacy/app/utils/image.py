@@ -1,130 +1,319 @@
+import asyncio
+import fcntl
 import io
+import json
 import math
+import os
 import hashlib
+import shutil
+import time
 import uuid
+from functools import lru_cache
 from pathlib import Path
-from PIL import Image
-from pillow_heif import register_heif_opener
+from PIL import Image, ImageOps
 
+from app.core.config import settings
 from app.crud import ad as ad_crud
+from app.db.session import SessionLocal
 from app.logger import setup_logger
+from app.utils.concurrency import run_db
+from app.utils.image_jobs import image_jobs
 
 logger = setup_logger(__name__)
 
+EXIF_ORIENTATION_TAG = 274
 
-async def save_file_in_folder(image, road, resolution):
-    Path(f"./files/{road}").mkdir(parents=True, exist_ok=True)
-    image.save(f"./files/{road}/{resolution}.webp", format="webp")
 
+WATERMARK_PATH = "./static/watermark.png"
+MASTER_NAME = "master"  # Нормализованное фото (поворот по EXIF, RGB), из которого получаются все варианты
+MASTER_SIZE = (2560, 1920)  # Мастер вписывается в 2560x1920 (меньшие фото не увеличиваются)
+MASTER_QUALITY = 90
+RESIZE_REDUCING_GAP = 3.0  # Быстрое уменьшение в целое число раз перед точным ресайзом (Image.reduce)
+# Водяной знак (размер, отступ) для вариантов, вписанных в прямоугольник. Для разрешений не из списка
+# водяной знак масштабируется от варианта 1280x960
+WATERMARKS = {
+    "1280x960": ((120, 54), 20),  # with new cleex watermark
+    "640x480": ((90, 40), 10),  # with new cleex watermark
+}
+IMAGE_JOB_META = "job.json"
+IMAGE_JOB_LOCK = ".lock"
+IMAGE_JOB_STALE = 3600  # Незавершенная запись загруженных фото старше (секунды) - удаляется при запуске
 
-async def add_watermark(image, size, step):
-    watermark = Image.open("./static/watermark.png")
-    watermark = watermark.resize(size)
+_resumed_jobs = set()  # Возобновленные при запуске задачи (ссылка на задачу, пока она выполняется)
+
+
+def get_master_path(road):
+    return f"./files{road}/{MASTER_NAME}.webp"
+
+
+# Водяной знак нужного размера - открывается и масштабируется один раз на процесс
+@lru_cache(maxsize=None)
+def get_watermark(size):
+    with Image.open(WATERMARK_PATH) as watermark:
+        return watermark.resize(size)
+
+
+def add_watermark(image, size, step):
+    watermark = get_watermark(size)
     image.paste(watermark, (image.size[0] - size[0] - step, image.size[1] - size[1] - step), watermark)
-    pass
 
 
-async def save_image_with_watermark(image, road):
-    width, height = image.size
+def get_watermark_params(resolution, width):
+    if resolution in WATERMARKS:
+        return WATERMARKS[resolution]
+    (base_width, base_height), base_step = WATERMARKS["1280x960"]
+    scale = width / 1280
+    return (max(1, round(base_width * scale)), max(1, round(base_height * scale))), round(base_step * scale)
+
+
+# Размер фото, вписанного в прямоугольник box (по большей стороне относительно пропорций box)
+def get_fit_size(width, height, box):
+    box_width, box_height = box
     aspect_ratio = height / width
-    if aspect_ratio > 0.75:
-        new_height = 960
+    box_ratio = box_height / box_width
+    if aspect_ratio > box_ratio:
+        new_height = box_height
         new_width = math.ceil(new_height / aspect_ratio)
-    elif aspect_ratio < 0.75:
-        new_width = 1280
+    elif aspect_ratio < box_ratio:
+        new_width = box_width
         new_height = math.ceil(new_width * aspect_ratio)
     else:
-        new_width = 1280
-        new_height = 960
-    im1 = image.resize((new_width, new_height))
-    # await add_watermark(image=im1, size=(120, 66), step=20)  # with old kvik watermark
-    await add_watermark(image=im1, size=(120, 54), step=20)  # with new cleex watermark
-    await save_file_in_folder(image=im1, road=road, resolution="1280x960")
-    im2 = image.resize((math.ceil(new_width / 2), math.ceil(new_height / 2)))
-    # await add_watermark(image=im2, size=(90, 50), step=10)  # with old kvik watermark
-    await add_watermark(image=im2, size=(90, 40), step=10)  # with new cleex watermark
-    await save_file_in_folder(image=im2, road=road, resolution="640x480")
-
-
-async def save_image_square_thumbnails(image, road):
+        new_width, new_height = box
+    return new_width, new_height
+
+
+def crop_square(image):
     width, height = image.size
     if width > height:
         cropped = (width - height) / 2
-        im = image.crop((cropped, 0, width - cropped, height))
-        im = im.resize((300, 300))
+        return image.crop((cropped, 0, width - cropped, height))
     elif width < height:
         cropped = (height - width) / 2
-        im = image.crop((0, cropped, width, height - cropped))
-        im = im.resize((300, 300))
+        return image.crop((0, cropped, width, height - cropped))
+    return image
+
+
+# Декодирование фото один раз: JPEG декодируется сразу в уменьшенном масштабе (draft, 1/2 - 1/8),
+# но не меньше размера мастера, затем поворот по EXIF (все 8 значений Orientation)
+def open_image(image_content):
+    im = Image.open(io.BytesIO(image_content))
+
+    orientation = im.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    rotated = orientation in (5, 6, 7, 8)  # ширина и высота меняются местами
+    width, height = (im.height, im.width) if rotated else im.size
+    master_size = get_fit_size(width, height, MASTER_SIZE)
+
+    im.draft("RGB", (master_size[1], master_size[0]) if rotated else master_size)
+
+    if orientation != 1:
+        im = ImageOps.exif_transpose(im)
+    # Convert to RGB if needed
+    return im.convert("RGB"), master_size
+
+
+# Обработка одного фото при загрузке: сохраняется только мастер, варианты получаются из него
+# при первом запросе (utils/image_variants). Выполняется в рабочем процессе пула (utils/image_jobs),
+# HEIF/HEIC opener регистрируется при запуске процесса
+def process_image(image_content, road):
+    im, master_size = open_image(image_content)
+    if im.width > master_size[0] or im.height > master_size[1]:
+        im = im.resize(master_size, reducing_gap=RESIZE_REDUCING_GAP)
+
+    # Одинаковое фото может одновременно обрабатываться для разных объявлений - запись атомарная
+    Path(f"./files{road}").mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{get_master_path(road)}.{os.getpid()}.tmp"
+    im.save(tmp_path, format="webp", quality=MASTER_QUALITY)
+    os.replace(tmp_path, get_master_path(road))
+    return road
+
+
+# Вариант фото разрешения "ШxВ" из мастера: квадрат (Ш = В) - из центра фото,
+# иначе фото, вписанное в ШxВ, с водяным знаком. Файл записывается атомарно (через временный файл)
+def render_variant(master_path, variant_path, resolution):
+    width, height = map(int, resolution.split("x"))
+    with Image.open(master_path) as master:
+        master = master.convert("RGB")
+
+    if width == height:
+        im = crop_square(master).resize((width, height), reducing_gap=RESIZE_REDUCING_GAP)
     else:
-        im = image.resize((300, 300))
-    await save_file_in_folder(image=im, road=road, resolution="300x300")
-    im.thumbnail((200, 200))
-    await save_file_in_folder(image=im, road=road, resolution="200x200")
-    im.thumbnail((100, 100))
-    await save_file_in_folder(image=im, road=road, resolution="100x100")
-
-
-def get_image_orientation(image_content):
-    orientation_value = 1  # Default orientation (normal)
-    with io.BytesIO(image_content) as f:
-        im = Image.open(f)
-        if hasattr(im, '_getexif'):
-            exif = im._getexif()
-            if exif is not None:
-                orientation_tag = 274  # EXIF tag for orientation
-                orientation_value = exif.get(orientation_tag, 1)
-    return orientation_value
+        im = master.resize(get_fit_size(master.width, master.height, (width, height)),
+                           reducing_gap=RESIZE_REDUCING_GAP)
+        size, step = get_watermark_params(resolution, width)
+        add_watermark(image=im, size=size, step=step)
+
+    Path(variant_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{variant_path}.{os.getpid()}.tmp"
+    im.save(tmp_path, format="webp")
+    os.replace(tmp_path, variant_path)
+    return variant_path
+
+
+# Каталог фото по его содержимому: одинаковые фото (повторная загрузка при редактировании,
+# то же фото в другом объявлении) хранятся один раз. Ранее загруженные фото - в каталогах с uuid4
+def get_image_road(image_content):
+    image_hash = hashlib.md5(image_content).hexdigest()
+    road = "/" + "/".join([str(image_hash[i] + str(image_hash[i + 1])) for i in range(0, 7, 2)])
+    return road + f"/{image_hash}"
+
+
+# Обработка фото, мастера которых еще нет на диске. Возвращает пути в порядке images_content
+# (None для фото, которые не удалось обработать)
+async def process_images(job, images_content):
+    roads = [get_image_road(image_content) for image_content in images_content]
+    new_images = {road: image_content for road, image_content in zip(roads, images_content)
+                  if not os.path.exists(get_master_path(road))}
+    if not new_images:
+        return roads
+
+    args_list = [(image_content, road) for road, image_content in new_images.items()]  # process_image(image_content, road)
+    results = await image_jobs.process(job, process_image, args_list)
+    failed = {road for road, result in zip(new_images, results) if result is None}
+    return [None if road in failed else road for road in roads]
+
+
+# Загруженные фото задачи хранятся на диске (IMAGE_JOBS_DIR) до завершения обработки: задачи, прерванные
+# перезапуском приложения, возобновляются при запуске (resume_image_jobs). Каталог задачи заблокирован
+# (flock) процессом, который ее выполняет, и записывается под временным именем
+def spool_images(post_id, images_content, status_id, order_list):
+    name = f"{post_id}-{uuid.uuid4().hex}"
+    tmp_dir = os.path.join(settings.IMAGE_JOBS_DIR, f".{name}")
+    os.makedirs(tmp_dir)
+    lock_file = open(os.path.join(tmp_dir, IMAGE_JOB_LOCK), "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    for i, image_content in enumerate(images_content):
+        Path(tmp_dir, str(i)).write_bytes(image_content)
+    meta = {"post_id": str(post_id), "status_id": status_id, "order_list": order_list, "count": len(images_content)}
+    Path(tmp_dir, IMAGE_JOB_META).write_text(json.dumps(meta))
 
+    job_dir = os.path.join(settings.IMAGE_JOBS_DIR, name)
+    os.rename(tmp_dir, job_dir)
+    return job_dir, lock_file
 
+
+def release_spool(job_dir, lock_file):
+    shutil.rmtree(job_dir, ignore_errors=True)
+    lock_file.close()
+
+
+# Задачи, которые не выполняет ни один процесс (блокировка свободна): (meta, фото, каталог, блокировка)
+def claim_spooled_jobs():
+    if not os.path.isdir(settings.IMAGE_JOBS_DIR):
+        return []
+
+    jobs = []
+    for name in os.listdir(settings.IMAGE_JOBS_DIR):
+        job_dir = os.path.join(settings.IMAGE_JOBS_DIR, name)
+        try:
+            lock_file = open(os.path.join(job_dir, IMAGE_JOB_LOCK), "r")
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+
+        if name.startswith("."):
+            # Запись фото прервана - задача не была поставлена
+            if time.time() - os.stat(job_dir).st_mtime > IMAGE_JOB_STALE:
+                release_spool(job_dir, lock_file)
+            else:
+                lock_file.close()
+            continue
+        try:
+            meta = json.loads(Path(job_dir, IMAGE_JOB_META).read_text())
+            images_content = [Path(job_dir, str(i)).read_bytes() for i in range(meta["count"])]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"utils/image- claim_spooled_jobs. Ошибка чтения задачи: {name} => {str(e)}")
+            release_spool(job_dir, lock_file)
+            continue
+        jobs.append((meta, images_content, job_dir, lock_file))
+    return jobs
+
+
+# Фото объявления обрабатываются в пуле процессов (event loop не блокируется), затем одним commit
+# записываются обработанные фото и выставляется статус объявления status_id.
+# Если хоть одно фото не удалось обработать, статус не меняется (как и раньше при ошибке)
 async def save_images(images, post_id, status_id, db, old_photos=None):
 
     order_list = [photo["order"] for photo in old_photos] if old_photos else []
 
-    i = 0
     try:
-        for image in images:
-            image_content = image.file.read()
-            image_hash = hashlib.md5(image_content).hexdigest()
-
-            road = "/" + "/".join([str(image_hash[i] + str(image_hash[i + 1])) for i in range(0, 7, 2)])
-            road += f"/{uuid.uuid4()}"
-
-            # Register opener for HEIF/HEIC format
-            register_heif_opener()
-
-            orientation_value = get_image_orientation(image_content)
-            # print('orientation_value:', orientation_value)
-
-            im = Image.open(io.BytesIO(image_content))
-            # Convert to RGB if needed
-            im = im.convert("RGB")
-
-            if orientation_value == 3:
-                im = im.rotate(180, expand=True)
-                # print('rotated.180')
-            elif orientation_value == 6:
-                # print('try to rotate.-90')
-                im = im.rotate(-90, expand=True)
-                # print('rotated.-90')
-            elif orientation_value == 8:
-                im = im.rotate(90, expand=True)
-                # print('rotated.90')
-
-            await save_image_with_watermark(image=im, road=road)
-            await save_image_square_thumbnails(image=im, road=road)
-
-            while i in order_list:
-                i += 1
-            # В этой точке переменная i содержит уникальный порядковый номер для текущего image
-            order = i
-            await ad_crud.write_image_road(db=db, post_id=post_id, image_road=road, order=order)  # Если порядок фото нарушается, то убрать await
+        images_content = [image.file.read() for image in images]
+    except Exception as e:
+        logger.error(f"utils/image- save_images. Ошибка чтения изображений: {post_id} => {str(e)}")
+        return False
+
+    job = await image_jobs.start(post_id)
+    try:
+        spool = await asyncio.to_thread(spool_images, post_id, images_content, status_id, order_list)
+    except Exception as e:
+        # Фото обрабатываются, но при перезапуске во время обработки задача не возобновится
+        logger.error(f"utils/image- save_images. Ошибка записи задачи обработки фото: {post_id} => {str(e)}")
+        spool = None
+
+    saved = await store_images(job, images_content, post_id, status_id, order_list, db)
+    if spool:
+        await asyncio.to_thread(release_spool, *spool)
+    return saved
+
+
+async def resume_image_job(meta, images_content, job_dir, lock_file):
+    post_id = uuid.UUID(meta["post_id"])
+    logger.info(f"utils/image- resume_image_job. Возобновлена обработка фото объявления: {post_id}")
+    job = await image_jobs.start(post_id)
+    with SessionLocal() as db:
+        await store_images(job, images_content, post_id, meta["status_id"], meta["order_list"], db)
+    await asyncio.to_thread(release_spool, job_dir, lock_file)
+
+
+# Возобновление задач обработки фото, прерванных перезапуском (вызывается при запуске каждого процесса,
+# задачу забирает один процесс)
+async def resume_image_jobs():
+    for spooled_job in await asyncio.to_thread(claim_spooled_jobs):
+        task = asyncio.create_task(resume_image_job(*spooled_job))
+        _resumed_jobs.add(task)
+        task.add_done_callback(_resumed_jobs.discard)
+
+
+# Сохранение фото задачи и ее итоговый статус
+async def store_images(job, images_content, post_id, status_id, order_list, db):
+    saved = await write_images(job, images_content, post_id, status_id, order_list, db)
+    await image_jobs.finish(job, saved)
+    return saved
+
+
+async def write_images(job, images_content, post_id, status_id, order_list, db):
+    roads = await process_images(job, images_content)
+
+    images_roads = []
+    i = 0
+    for road in roads:
+        if road is None:
+            continue
+        while i in order_list:
             i += 1
+        # В этой точке переменная i содержит уникальный порядковый номер для текущего image
+        images_roads.append((road, i))
+        i += 1
+
+    try:
+        await run_db(ad_crud.write_post_images_roads, db=db, post_id=post_id, images_roads=images_roads)
     except Exception as e:
-        print('error', str(e))
         logger.error(f"utils/image- save_images. Ошибка сохранения изображений: {post_id} => {str(e)}")
         return False
 
-    ad_crud.change_post_status(post_id=post_id, status_id=status_id, db=db)
+    # Мастер уже сохраненного фото мог быть удален вместе с последней ссылкой на него
+    # до записи новых ссылок - такие фото обрабатываются заново
+    missing = [image_content for road, image_content in zip(roads, images_content)
+               if road is not None and not os.path.exists(get_master_path(road))]
+    reprocessed = await process_images(job, missing) if missing else []
+
+    if None in roads or None in reprocessed:
+        logger.error(f"utils/image- save_images. Не все изображения обработаны: {post_id}")
+        return False
+
+    await run_db(ad_crud.change_post_status, post_id=post_id, status_id=status_id, db=db)
     logger.info(f"Все фото успешно загружены для объявления:{post_id}")
     return True
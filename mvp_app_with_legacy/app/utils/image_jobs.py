@@ -0,0 +1,166 @@
+import asyncio
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cachetools import TTLCache
+from fastapi_cache import FastAPICache
+from pillow_heif import register_heif_opener
+
+from app.core.config import get_current_time2, settings
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Статусы обработки фотографий объявления
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class ImageJob:
+    def __init__(self, ad_id):
+        self.ad_id = ad_id
+        self.status = JOB_QUEUED
+        self.total = 0  # кол-во фото, переданных на обработку
+        self.processed = 0  # обработано успешно
+        self.failed = 0  # не обработано после всех попыток
+        self.attempts = 0  # всего попыток обработки фото (с повторами)
+        self.created_at = get_current_time2()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "ad_id": str(self.ad_id),
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+# Обработка фотографий объявлений вне event loop: CPU-работа (декодирование, поворот, ресайз,
+# запись мастера и вариантов фото) выполняется в пуле процессов из IMAGE_WORKERS процессов.
+# Одновременно обрабатываются фото не более IMAGE_JOBS_CONCURRENCY объявлений, остальные ждут в очереди.
+# Фото, обработка которого завершилась ошибкой, обрабатывается повторно (IMAGE_JOB_RETRIES раз).
+# Статус задачи объявления (последней) хранится в Redis - доступен из всех процессов приложения -
+# IMAGE_JOB_STATUS_TTL секунд после последнего изменения. Если Redis недоступен - в памяти процесса
+class ImageJobs:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._semaphore = None
+        self._jobs = TTLCache(maxsize=10000, ttl=settings.IMAGE_JOB_STATUS_TTL)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # forkserver - рабочие процессы не наследуют потоки и соединения приложения
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=register_heif_opener
+                )
+            return self._executor
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Семафор создается в работающем event loop
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.IMAGE_JOBS_CONCURRENCY)
+        return self._semaphore
+
+    @staticmethod
+    def _key(ad_id):
+        return f"{FastAPICache.get_prefix()}:image_job:{ad_id}"
+
+    async def _save(self, job):
+        self._jobs[str(job.ad_id)] = job
+        try:
+            await FastAPICache.get_backend().redis.set(
+                self._key(job.ad_id), json.dumps(job.to_dict(), default=str), ex=settings.IMAGE_JOB_STATUS_TTL
+            )
+        except Exception as e:
+            logger.error(f"utils/image_jobs. Ошибка записи статуса обработки фото: {job.ad_id} => {str(e)}")
+
+    async def get(self, ad_id):
+        try:
+            data = await FastAPICache.get_backend().redis.get(self._key(ad_id))
+            if data:
+                return json.loads(data)
+        except Exception as e:
+            logger.error(f"utils/image_jobs. Ошибка чтения статуса обработки фото: {ad_id} => {str(e)}")
+        job = self._jobs.get(str(ad_id))
+        return job.to_dict() if job else None
+
+    async def _run_with_retries(self, job, func, args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(settings.IMAGE_JOB_RETRIES + 1):
+            job.attempts += 1
+            executor = self._get_executor()
+            try:
+                result = await loop.run_in_executor(executor, func, *args)
+                job.processed += 1
+                await self._save(job)
+                return result
+            except BrokenProcessPool as e:
+                # Рабочий процесс завершился аварийно (например, нехватка памяти) - пересоздаем пул
+                logger.error(f"utils/image_jobs. Пул обработки фото пересоздан: {job.ad_id} => {str(e)}")
+                self._reset_executor(executor)
+            except Exception as e:
+                logger.error(f"utils/image_jobs. Ошибка обработки фото, попытка {attempt + 1}: {job.ad_id} => {str(e)}")
+            await asyncio.sleep(attempt + 1)
+
+        job.failed += 1
+        await self._save(job)
+        return None
+
+    # Задача обработки фото объявления - регистрируется для каждого сохранения фото,
+    # в т.ч. если все фото уже были обработаны раньше
+    async def start(self, ad_id):
+        job = ImageJob(ad_id)
+        await self._save(job)
+        return job
+
+    # Обработка фото задачи: func(*args) для каждого набора аргументов из args_list.
+    # Возвращает результаты в порядке args_list (None для фото, которые не удалось обработать)
+    async def process(self, job, func, args_list):
+        if not args_list:
+            return []
+        job.total += len(args_list)
+
+        async with self._get_semaphore():
+            job.status = JOB_PROCESSING
+            await self._save(job)
+            results = await asyncio.gather(*(self._run_with_retries(job, func, args) for args in args_list))
+        return results
+
+    async def finish(self, job, success):
+        job.status = JOB_DONE if success else JOB_FAILED
+        job.finished_at = get_current_time2()
+        await self._save(job)  # TTL статуса - от завершения задачи
+
+    # Однократное выполнение func(*args) в пуле процессов (без задачи объявления и повторов)
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_jobs = ImageJobs()
@@ -0,0 +1,163 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from app.core.config import settings
+from app.logger import setup_logger
+from app.utils.image import get_master_path, render_variant
+from app.utils.image_jobs import image_jobs
+
+logger = setup_logger(__name__)
+
+
+def get_variant_path(road, resolution):
+    return f"{settings.IMAGE_VARIANTS_DIR}{road}/{resolution}.webp"
+
+
+# Дисковый кэш вариантов фото: вариант получается из мастера при первом запросе и хранится
+# в IMAGE_VARIANTS_DIR. Общий размер каталога ограничен IMAGE_VARIANTS_CACHE_SIZE (МБ, на все процессы
+# приложения). Ограничение проверяется очисткой (sweep) по фактическому содержимому каталога: при запуске
+# и после того, как процесс записал SWEEP_FRACTION бюджета новых вариантов. Очистку выполняет один процесс
+# (файловая блокировка), удаляются давно не запрошенные варианты (по atime - обновляется при запросе
+# не чаще TOUCH_INTERVAL, mtime варианта не меняется) до SWEEP_TARGET бюджета.
+# Одновременные запросы одного варианта ждут одну обработку
+SWEEP_FRACTION = 0.05
+SWEEP_TARGET = 0.9
+TOUCH_INTERVAL = 3600  # секунды
+SWEEP_LOCK_FILE = ".sweep.lock"
+
+
+class ImageVariants:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._written = 0  # байт вариантов, записанных процессом после последней очистки
+        self._sweeping = None  # задача очистки
+        self._rendering = {}  # путь варианта => задача обработки
+
+    @staticmethod
+    def _max_size():
+        return settings.IMAGE_VARIANTS_CACHE_SIZE * 1024 * 1024
+
+    @staticmethod
+    def _scan():
+        files = []
+        for directory, _, filenames in os.walk(settings.IMAGE_VARIANTS_DIR):
+            for filename in filenames:
+                if filename.endswith(".tmp") or filename == SWEEP_LOCK_FILE:  # вариант в процессе записи
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat_result.st_atime, path, stat_result.st_size))
+        return files
+
+    # Очистка каталога до SWEEP_TARGET бюджета. Если очистку уже выполняет другой процесс - пропускается
+    def sweep(self):
+        os.makedirs(settings.IMAGE_VARIANTS_DIR, exist_ok=True)
+        with open(os.path.join(settings.IMAGE_VARIANTS_DIR, SWEEP_LOCK_FILE), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            with self._lock:
+                self._written = 0
+
+            files = self._scan()
+            total_size = sum(size for _, _, size in files)
+            removed = 0
+            if total_size > self._max_size():
+                target = self._max_size() * SWEEP_TARGET
+                for _, path, size in sorted(files):
+                    if total_size <= target:
+                        break
+                    try:
+                        os.remove(path)
+                        os.rmdir(os.path.dirname(path))  # каталог фото - если в нем не осталось вариантов
+                    except OSError:
+                        pass
+                    total_size -= size
+                    removed += 1
+        logger.info(f"utils/image_variants. sweep. Вариантов фото в кэше: {len(files) - removed}, "
+                    f"{total_size} байт, удалено: {removed}")
+        return removed
+
+    def _sweep_done(self, task):
+        self._sweeping = None
+        if not task.cancelled() and task.exception():
+            logger.error(f"utils/image_variants. sweep. Ошибка очистки кэша вариантов: {task.exception()}")
+
+    def _written_variant(self, size):
+        with self._lock:
+            self._written += size
+            due = self._written > self._max_size() * SWEEP_FRACTION
+        if due and self._sweeping is None:
+            self._sweeping = asyncio.ensure_future(asyncio.to_thread(self.sweep))
+            self._sweeping.add_done_callback(self._sweep_done)
+
+    # Время последнего запроса варианта (atime) - для очистки давно не запрошенных.
+    # mtime сохраняется: atime не зависит от настроек монтирования (noatime/relatime)
+    @staticmethod
+    def _touch(path, stat_result):
+        now = time.time()
+        if now - stat_result.st_atime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, stat_result.st_mtime))
+            except FileNotFoundError:
+                pass
+
+    async def _render(self, master_path, variant_path, resolution):
+        await image_jobs.run(render_variant, master_path, variant_path, resolution)
+        stat_result = os.stat(variant_path)
+        self._written_variant(stat_result.st_size)
+        return variant_path, stat_result
+
+    # Файл варианта фото (путь, stat, время изменения фото). Время изменения - mtime мастера: вариант
+    # может быть удален очисткой и получен заново, содержимое при этом то же. Фото, загруженные
+    # до появления мастера, хранят все варианты рядом с фото. None - если нет ни варианта, ни мастера
+    async def get_file(self, road, resolution):
+        master_path = get_master_path(road)
+        try:
+            modified_at = os.stat(master_path).st_mtime
+        except FileNotFoundError:
+            modified_at = None
+
+        variant_path = get_variant_path(road, resolution)
+        for path in (variant_path, f"./files{road}/{resolution}.webp"):
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if path == variant_path:
+                self._touch(path, stat_result)
+            return path, stat_result, modified_at or stat_result.st_mtime
+
+        if modified_at is None:
+            return None
+
+        task = self._rendering.get(variant_path)
+        if task is None:
+            task = asyncio.ensure_future(self._render(master_path, variant_path, resolution))
+            self._rendering[variant_path] = task
+            task.add_done_callback(lambda _: self._rendering.pop(variant_path, None))
+        # shield - отмена одного запроса (клиент отключился) не отменяет обработку для остальных
+        path, stat_result = await asyncio.shield(task)
+        return path, stat_result, modified_at
+
+    # Идентификатор содержимого варианта (ETag): фото, разрешение и размер файла - не меняется
+    # при повторном получении варианта из мастера
+    @staticmethod
+    def get_etag(road, resolution, stat_result):
+        return f'"{hashlib.sha1(road.encode()).hexdigest()[:16]}-{resolution}-{stat_result.st_size}"'
+
+    # Удаление всех вариантов фото (при удалении фото)
+    def remove(self, road):
+        shutil.rmtree(f"{settings.IMAGE_VARIANTS_DIR}{road}/", ignore_errors=True)
+
+
+image_variants = ImageVariants()
@@ -0,0 +1,139 @@
+import asyncio
+
+import httpx
+
+from app.core.config import settings
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# Ошибка доставки, после которой запрос повторяется (нет соединения, ошибка сервиса уведомлений)
+class DeliveryError(Exception):
+    pass
+
+
+# Клиент сервиса push-уведомлений: авторизация устройств (unique_id, is_auth).
+# Один httpx.AsyncClient на процесс (создается при запуске приложения) - соединения переиспользуются.
+# Несколько устройств отправляются одним запросом на NOTIFICATION_TOKEN_BATCH_PATH по NOTIFICATION_BATCH_SIZE
+# (если путь не задан - параллельно, не более NOTIFICATION_CONCURRENCY запросов одновременно).
+# Недоставленное повторяется в фоне (NOTIFICATION_RETRIES раз), ответ пользователю не ждет повторов.
+# Очередь повторов - в памяти процесса: для устройства хранится последнее состояние, поэтому повтор
+# не перезапишет более позднюю авторизацию устройства
+class NotificationClient:
+    def __init__(self):
+        self._client = None
+        self._semaphore = None
+        self._queue = None
+        self._worker = None
+        self._retries = {}  # unique_id => (is_auth, номер попытки)
+
+    def start(self):
+        self._get_client()
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._retry_worker())
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=settings.NOTIFICATION_TIMEOUT,
+                limits=httpx.Limits(max_connections=settings.NOTIFICATION_MAX_CONNECTIONS,
+                                    max_keepalive_connections=settings.NOTIFICATION_MAX_CONNECTIONS)
+            )
+        return self._client
+
+    # Семафор создается в работающем event loop
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.NOTIFICATION_CONCURRENCY)
+        return self._semaphore
+
+    async def _post(self, path, data):
+        try:
+            async with self._get_semaphore():
+                response = await self._get_client().post(settings.NOTIFICATION_TOKEN_URL + path, json=data)
+        except httpx.HTTPError as e:
+            raise DeliveryError(str(e) or type(e).__name__) from e
+        if response.status_code >= 500:
+            raise DeliveryError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            # Запрос отклонен сервисом - повтор не поможет
+            logger.error(f"utils/notifications. Запрос отклонен: {data} => HTTP {response.status_code}")
+        return response
+
+    async def _send(self, unique_id, is_auth):
+        return await self._post(settings.NOTIFICATION_TOKEN_PATH, {"unique_id": unique_id, "is_auth": is_auth})
+
+    # Контракт пакетного запроса: {"items": [{"unique_id": ..., "is_auth": ...}, ...]}, 2xx - доставлены все
+    async def _send_batch(self, unique_ids, is_auth):
+        data = {"items": [{"unique_id": unique_id, "is_auth": is_auth} for unique_id in unique_ids]}
+        return await self._post(settings.NOTIFICATION_TOKEN_BATCH_PATH, data)
+
+    def _schedule_retry(self, unique_id, is_auth, attempt, error):
+        if attempt > settings.NOTIFICATION_RETRIES or self._queue is None:
+            self._retries.pop(unique_id, None)
+            logger.error(f"utils/notifications. Не доставлено: {unique_id} => {is_auth}, попыток {attempt}: {error}")
+            return
+        self._retries[unique_id] = (is_auth, attempt)
+        delay = min(2 ** attempt, 300)
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, unique_id)
+
+    async def _retry_worker(self):
+        while True:
+            unique_id = await self._queue.get()
+            state = self._retries.get(unique_id)
+            if state is None:
+                continue  # устройство уже отправлено заново
+            is_auth, attempt = state
+            try:
+                await self._send(unique_id, is_auth)
+                if self._retries.get(unique_id) == state:
+                    del self._retries[unique_id]
+            except DeliveryError as e:
+                if self._retries.get(unique_id) == state:
+                    self._schedule_retry(unique_id, is_auth, attempt + 1, e)
+
+    async def set_auth(self, unique_id, is_auth: bool):
+        self._retries.pop(unique_id, None)
+        try:
+            await self._send(unique_id, is_auth)
+            return True
+        except DeliveryError as e:
+            self._schedule_retry(unique_id, is_auth, 1, e)
+            return False
+
+    # Авторизация нескольких устройств. Возвращает кол-во доставленных сразу (остальные - в очереди повторов)
+    async def set_auth_many(self, unique_ids, is_auth: bool):
+        unique_ids = list(dict.fromkeys(unique_ids))
+        for unique_id in unique_ids:
+            self._retries.pop(unique_id, None)
+
+        if settings.NOTIFICATION_TOKEN_BATCH_PATH:
+            batches = [unique_ids[i:i + settings.NOTIFICATION_BATCH_SIZE]
+                       for i in range(0, len(unique_ids), settings.NOTIFICATION_BATCH_SIZE)]
+            results = await asyncio.gather(*(self._send_batch(batch, is_auth) for batch in batches),
+                                           return_exceptions=True)
+            failed = {unique_id: result for batch, result in zip(batches, results)
+                      if isinstance(result, Exception) for unique_id in batch}
+        else:
+            results = await asyncio.gather(*(self._send(unique_id, is_auth) for unique_id in unique_ids),
+                                           return_exceptions=True)
+            failed = {unique_id: result for unique_id, result in zip(unique_ids, results)
+                      if isinstance(result, Exception)}
+
+        for unique_id, error in failed.items():
+            self._schedule_retry(unique_id, is_auth, 1, error)
+        return len(unique_ids) - len(failed)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._retries:
+            logger.error(f"utils/notifications. При остановке не доставлено устройств: {len(self._retries)}")
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+notification_client = NotificationClient()
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import json
+import threading
+from datetime import datetime
+from uuid import UUID
+
+from cachetools import TTLCache
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+from app.core.config import settings
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Режимы подсчета общего кол-ва объявлений (total) в выдаче
+COUNT_EXACT = 'exact'  # точный COUNT(*) на каждый запрос
+COUNT_CACHED = 'cached'  # точный COUNT(*), закэшированный по набору фильтров на короткое время
+COUNT_ESTIMATE = 'estimate'  # оценка планировщика (EXPLAIN), для широких запросов без фильтров
+COUNT_HAS_MORE = 'has_more'  # без подсчета, total - нижняя граница, есть ли следующая страница - в has_more
+
+# Если оценка планировщика меньше порога, то точный подсчет дешевый - считаем точно
+ESTIMATE_EXACT_THRESHOLD = 1000
+
+_count_cache = TTLCache(maxsize=10000, ttl=settings.FEED_COUNT_CACHE_TTL)
+_count_cache_lock = threading.Lock()
+
+
+# Курсор (keyset-пагинация) - непрозрачная строка base64 с JSON внутри:
+# {"s": сортировка, "v": значение ключа сортировки последнего объявления, "id": идентификатор последнего объявления}
+def encode_cursor(sort, value, ad_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({"s": sort, "v": value, "id": str(ad_id)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, sort_key_name):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding).decode())
+        if payload["s"] != sort:
+            raise ValueError("sort mismatch")
+
+        value = payload["v"]
+        if sort_key_name == 'created_at':
+            value = datetime.fromisoformat(value)
+        elif sort_key_name == 'price':
+            value = int(value)
+        else:
+            value = float(value)
+
+        return value, UUID(payload["id"])
+    except Exception as e:
+        logger.error(f"utils/pagination. decode_cursor. Некорректный курсор: {cursor} => {str(e)}")
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+# Условие "строго после курсора" для порядка (ключ сортировки, id).
+# Сравнение кортежей (row comparison) обслуживается составным индексом (created_at, id) или (price, id) - см. crud/ad
+def keyset_clause(sort_key, id_column, sort_desc, value, ad_id):
+    if sort_desc:
+        return tuple_(sort_key, id_column) < tuple_(value, ad_id)
+    return tuple_(sort_key, id_column) > tuple_(value, ad_id)
+
+
+# Ключ кэша кол-ва: нормализованный набор фильтров (сортировка и страница на кол-во не влияют)
+def make_count_key(**params):
+    normalized = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.md5(normalized.encode()).hexdigest()
+
+
+def get_exact_count(query, count_key):
+    with _count_cache_lock:
+        total = _count_cache.get(count_key)
+    if total is None:
+        total = query.count()
+        with _count_cache_lock:
+            _count_cache[count_key] = total
+    return total
+
+
+# Оценка кол-ва строк по плану запроса, без выполнения самого запроса
+def get_estimated_count(query, db):
+    try:
+        compiled = query.statement.compile(dialect=db.bind.dialect)
+        plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        logger.error(f"utils/pagination. get_estimated_count. Ошибка получения оценки кол-ва: {str(e)}")
+        return None
+
+
+# Режим подсчета для общей ленты: по курсору (следующие страницы) - без подсчета,
+# с сужающими фильтрами - точный кэшированный, иначе (вся лента) - оценка планировщика
+def get_feed_count_mode(cursor, *narrowing_filters):
+    if cursor:
+        return COUNT_HAS_MORE
+    if any(narrowing_filters):
+        return COUNT_CACHED
+    return COUNT_ESTIMATE
+
+
+# Общее кол-во объявлений для выбранного режима.
+# fetched - сколько строк получено запросом страницы (limit + 1, если есть следующая страница)
+def get_total_count(query, count_mode, count_key, db, offset, fetched):
+    if count_mode == COUNT_HAS_MORE:
+        return offset + fetched, COUNT_HAS_MORE
+
+    if count_mode == COUNT_ESTIMATE:
+        estimated = get_estimated_count(query, db)
+        if estimated is not None and estimated >= ESTIMATE_EXACT_THRESHOLD:
+            # Оценка не может быть меньше уже полученных строк
+            return max(estimated, offset + fetched), COUNT_ESTIMATE
+        return get_exact_count(query, count_key), COUNT_CACHED
+
+    if count_mode == COUNT_CACHED:
+        return get_exact_count(query, count_key), COUNT_CACHED
+
+    return query.count(), COUNT_EXACT
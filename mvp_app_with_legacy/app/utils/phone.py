@@ -1,45 +1,230 @@
+import asyncio
 import json
+import time
+from abc import ABC, abstractmethod
 
+import httpx
 from fastapi import HTTPException
-from requests import request
 
 from app.core.config import settings
+from app.logger import setup_logger
 from app.utils.exception import unexpected_error
 
+logger = setup_logger(__name__)
 
-def call(phone: str):
-    url, api_key = settings.VOICEPASSWORD_API_URL, settings.VOICEPASSWORD_API_KEY
-    payload = json.dumps({
-        "number": phone,
-    })
-    headers = {
-        'Authorization': api_key,
-        'Accept-Charset': 'utf-8',
-        'Content-Type': 'application/json'
-    }
-    response = request("POST", url, headers=headers, data=payload)
-    return response.json()
+SERVICE_UNAVAILABLE = "service_unavailable"
+RETRY_STATUS_CODES = {502, 503}  # Запрос не обработан сервисом звонков - повтор не приведет к второму звонку
 
 
-def call_telefon_ip(phone: str):
-    url = settings.TELEFON_IP_API_URL
+class TelephonyUnavailable(Exception):
+    pass
+
+
+# Отключение сервиса звонков после TELEPHONY_BREAKER_FAILURES ошибок подряд: запросы сразу завершаются
+# ошибкой, раз в TELEPHONY_BREAKER_RESET секунд пропускается один пробный запрос. Состояние - в памяти процесса
+class CircuitBreaker:
+    def __init__(self, max_failures, reset_timeout):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.opened_at = time.monotonic()  # следующий пробный запрос - не раньше, чем через reset_timeout
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+# Сервис звонков. Ответ приводится к формату VoicePassword:
+# {"result": "ok", "code": код} или {"result": "error", "error_code": код ошибки}
+class TelephonyProvider(ABC):
+    name = None
+
+    # Параметры HTTP-запроса звонка на номер
+    @abstractmethod
+    def request(self, phone: str):
+        pass
+
+    # Ответ сервиса в формате VoicePassword
+    @abstractmethod
+    def parse(self, data):
+        pass
+
+    async def call(self, client, phone: str):
+        response = await client.send(**self.request(phone))
+        return self.parse(response.json())
+
+
+class VoicePasswordProvider(TelephonyProvider):
+    name = "voicepassword"
+
+    def request(self, phone: str):
+        return {
+            "method": "POST",
+            "url": settings.VOICEPASSWORD_API_URL,
+            "headers": {
+                'Authorization': settings.VOICEPASSWORD_API_KEY,
+                'Accept-Charset': 'utf-8',
+                'Content-Type': 'application/json'
+            },
+            "content": json.dumps({"number": phone})
+        }
+
+    def parse(self, data):
+        return data
+
+
+class TelefonIpProvider(TelephonyProvider):
+    name = "telefon_ip"
+
+    def request(self, phone: str):
+        return {"method": "GET", "url": settings.TELEFON_IP_API_URL + format_telefon_ip_phone(phone)}
+
+    def parse(self, data):
+        if data.get("success"):
+            return {"result": "ok", "code": data["data"]["code"]}
+        return {"result": "error", "error_code": data.get("error")}
+
+
+# Сервис звонков для тестов и нагрузочных прогонов: без звонка, код - последние 4 цифры номера,
+# задержка ответа - TELEPHONY_FAKE_DELAY мс. Доступен только при MODE=TEST (см. get_provider)
+class FakeTelephonyProvider(TelephonyProvider):
+    name = "fake"
+
+    # HTTP-запрос не выполняется - "ответ" строится по номеру
+    def request(self, phone: str):
+        return {"phone": phone}
+
+    def parse(self, data):
+        return {"result": "ok", "code": data["phone"][-4:]}
+
+    async def call(self, client, phone: str):
+        if settings.TELEPHONY_FAKE_DELAY:
+            await asyncio.sleep(settings.TELEPHONY_FAKE_DELAY / 1000)
+        return self.parse(self.request(phone))
+
+
+TELEPHONY_PROVIDERS = {provider.name: provider for provider in
+                       (VoicePasswordProvider, TelefonIpProvider, FakeTelephonyProvider)}
+
+
+# Сервис звонков по имени. Неизвестное имя и fake вне тестового режима (код подтверждения по номеру
+# телефона позволил бы подтвердить любой номер) - ошибка конфигурации, приложение не запускается
+def get_provider(name, mode):
+    provider = TELEPHONY_PROVIDERS.get(name)
+    if provider is None:
+        raise ValueError(f"Неизвестный TELEPHONY_PROVIDER: {name}. Допустимые: {', '.join(TELEPHONY_PROVIDERS)}")
+    if provider is FakeTelephonyProvider and mode != "TEST":
+        raise ValueError("TELEPHONY_PROVIDER=fake допустим только при MODE=TEST")
+    return provider()
+
+
+# +79XXXXXXXXX => 89XXXXXXXXX
+def format_telefon_ip_phone(phone: str):
     phone_str = str(phone)
-    phone_str = phone_str.lstrip('+') # Удаление первого символа "+", если есть
-    phone_str = phone_str.replace(' ', '') # Удаление пробелов
-    # # Если длина строки равна 11 и начинается с "7", заменяем "7" на "8"
+    phone_str = phone_str.lstrip('+')  # Удаление первого символа "+", если есть
+    phone_str = phone_str.replace(' ', '')  # Удаление пробелов
+    # Если длина строки равна 11 и начинается с "7", заменяем "7" на "8"
     if len(phone_str) == 11 and phone_str.startswith('7'):
         phone_str = '8' + phone_str[1:]
-    # phone = +79XXXXXXXXX => 89XXXXXXXXX
+    return phone_str
+
+
+# Клиент сервиса звонков (TELEPHONY_PROVIDER): запросы не блокируют event loop, соединения
+# переиспользуются, запрос, не дошедший до сервиса, повторяется (TELEPHONY_RETRIES раз).
+# Недоступный сервис звонков отключается на время (CircuitBreaker)
+class TelephonyClient:
+    def __init__(self):
+        self._client = None
+        self._provider = None
+        self._breaker = CircuitBreaker(settings.TELEPHONY_BREAKER_FAILURES, settings.TELEPHONY_BREAKER_RESET)
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            self._provider = get_provider(settings.TELEPHONY_PROVIDER, settings.MODE)
+        return self._provider
+
+    # Проверка настройки сервиса звонков при запуске приложения
+    def start(self):
+        logger.info(f"utils/phone- start. Сервис звонков: {self.provider.name}")
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.TELEPHONY_TIMEOUT, connect=settings.TELEPHONY_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=settings.TELEPHONY_MAX_CONNECTIONS,
+                                    max_keepalive_connections=settings.TELEPHONY_MAX_CONNECTIONS)
+            )
+        return self._client
+
+    async def send(self, method, url, **kwargs):
+        if not self._breaker.allow():
+            raise TelephonyUnavailable("сервис отключен после ошибок")
+
+        error = None
+        for attempt in range(settings.TELEPHONY_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(0.2 * 2 ** (attempt - 1))
+            try:
+                response = await self._get_client().request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = e
+                continue
+            except httpx.HTTPError as e:
+                # Запрос мог дойти до сервиса (звонок мог состояться) - без повтора
+                self._breaker.record_failure()
+                raise TelephonyUnavailable(str(e)) from e
+
+            if response.status_code in RETRY_STATUS_CODES:
+                error = f"HTTP {response.status_code}"
+                continue
+            if response.status_code >= 500:
+                self._breaker.record_failure()
+            else:
+                self._breaker.record_success()
+            return response
+
+        self._breaker.record_failure()
+        raise TelephonyUnavailable(str(error))
+
+    async def call(self, phone: str):
+        provider = self.provider
+        try:
+            return await provider.call(self, phone)
+        except (TelephonyUnavailable, ValueError, KeyError) as e:
+            logger.error(f"utils/phone- call. Ошибка сервиса звонков {provider.name}: {phone} => {str(e)}")
+            return {"result": "error", "error_code": SERVICE_UNAVAILABLE}
+
+    async def close(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+telephony = TelephonyClient()
+
 
-    url += phone_str
-    # print('url', url)
-    response = request("GET", url)
-    # print('response', response.json())
-    return response.json()
+async def call(phone: str):
+    return await telephony.call(phone)
 
 
 def error_handler(error: str):
     match error:
+        case "service_unavailable":
+            raise HTTPException(status_code=503, detail={"msg": "Сервис звонков временно недоступен. Попробуйте позже"})
         case "unknown_request":
             raise HTTPException(status_code=404, detail={"msg": "Ошибочный запрос"})
         case "authorisation_failed":
@@ -1,33 +1,401 @@
-from typing import Optional
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from functools import wraps
+from uuid import UUID
+
+import redis
 from fastapi import Request, Response
 from fastapi_cache import FastAPICache
+from pydantic import BaseModel
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.background import BackgroundTasks
+
+from app.core.config import settings
+from app.db.db_models import Ad, User
+from app.db.session import SessionLocal
+from app.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Аргументы эндпоинта, не влияющие на ответ
+SKIP_PARAM_TYPES = (Session, Response, BackgroundTasks)
+REFRESH_LOCK_TTL = 30  # Блокировка фонового обновления записи (секунды)
+INVALIDATION_RETRY_MAX = 30  # Наибольшая пауза перед повтором сброса тегов при недоступном Redis (секунды)
+
+# Запущенные фоновые обновления записей кэша (ссылка на задачу, пока она выполняется)
+_refresh_tasks = set()
+
+
+# Значение аргумента в каноническом виде: словари и строки с JSON-объектом - с отсортированными ключами,
+# множества - отсортированы, модели - словари, объекты БД - идентификатор
+def canonical_value(value):
+    if isinstance(value, BaseModel):
+        return canonical_value(value.dict())
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (UUID, datetime, date, Decimal)):
+        return str(value)
+    if isinstance(value, dict):
+        return {str(key): canonical_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical_value(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((canonical_value(item) for item in value), key=canonical_json)
+    if isinstance(value, Request):
+        return sorted(value.query_params.multi_items())
+    if isinstance(value, str) and value.startswith("{"):
+        try:
+            return canonical_value(json.loads(value))
+        except ValueError:
+            return value
+    if hasattr(value, "__table__"):
+        return str(getattr(value, "id", None))
+    return value
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+# Аргументы эндпоинта, от которых зависит ответ (без сессии БД, ответа и фоновых задач)
+def canonical_params(kwargs):
+    return {
+        name: canonical_value(value) for name, value in kwargs.items()
+        if name != "response" and not isinstance(value, SKIP_PARAM_TYPES)
+    }
+
+
+def make_cache_key(prefix, namespace, func, params, tag_versions=()):
+    payload = canonical_json({"params": params, "tags": list(tag_versions)})
+    digest = hashlib.sha1(payload.encode()).hexdigest()
+    return f"{prefix}:{namespace}:{func.__module__}.{func.__name__}:{digest}"
+
+
+def _tag_key(tag):
+    return f"{FastAPICache.get_prefix()}:tag:{tag}"
+
+
+# Текущая версия тега в Redis (None - кэш не настроен или Redis недоступен)
+async def get_tag_version(tag):
+    try:
+        backend = FastAPICache.get_backend()
+    except AssertionError:
+        return None
+    try:
+        version = await backend.redis.get(_tag_key(tag))
+    except Exception as e:
+        logger.error(f"utils/redis- get_tag_version. Ошибка чтения версии тега: {tag} => {str(e)}")
+        return None
+    return int(version or 0)
+
+
+# Ключ записи включает текущие версии тегов - после сброса тега (INCR версии) старые записи
+# больше не читаются и удаляются по TTL
+async def _get_tag_versions(backend, tags):
+    if not tags:
+        return []
+    versions = await backend.redis.mget([_tag_key(tag) for tag in tags])
+    return [f"{tag}={version or 0}" for tag, version in zip(tags, versions)]
+
+
+# Кэширование ответа эндпоинта в Redis (FastAPICache). tags - теги записи, в т.ч. с аргументами
+# эндпоинта ("catalog", "ad:{key}"), сброс тега - invalidate_cache_tags.
+# stale - сколько секунд после expire отдается устаревшая запись, пока она обновляется в фоне
+def cached(namespace: str, expire: int, tags=(), stale: int = 0):
+    def wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            if not FastAPICache.get_enable():
+                return await func(*args, **kwargs)
+
+            backend = FastAPICache.get_backend()
+            coder = FastAPICache.get_coder()
+            params = canonical_params(kwargs)
+            try:
+                entry_tags = [tag.format(**params) for tag in tags]
+                key = make_cache_key(FastAPICache.get_prefix(), namespace, func, params,
+                                     await _get_tag_versions(backend, entry_tags))
+                entry = await backend.get(key)
+            except Exception as e:
+                logger.error(f"utils/redis- cached. Ошибка чтения кэша: {namespace} => {str(e)}")
+                return await func(*args, **kwargs)
+
+            if entry is not None:
+                fresh_until, encoded = entry.split(":", 1)
+                if time.time() > float(fresh_until):
+                    task = asyncio.create_task(_refresh(backend, key, func, args, kwargs, expire, stale))
+                    _refresh_tasks.add(task)
+                    task.add_done_callback(_refresh_tasks.discard)
+                return coder.decode(encoded)
+
+            ret = await func(*args, **kwargs)
+            await _store(backend, key, ret, expire, stale)
+            return ret
+
+        return inner
+
+    return wrapper
+
+
+async def _store(backend, key, ret, expire, stale):
+    entry = f"{time.time() + expire}:{FastAPICache.get_coder().encode(ret)}"
+    try:
+        await backend.set(key, entry, expire + stale)
+    except Exception as e:
+        logger.error(f"utils/redis- cached. Ошибка записи в кэш: {key} => {str(e)}")
+
+
+# Фоновое обновление устаревшей записи - одно на все процессы (блокировка в Redis).
+# Сессия БД запроса к этому времени закрыта, поэтому используется своя
+async def _refresh(backend, key, func, args, kwargs, expire, stale):
+    try:
+        if not await backend.redis.set(f"{key}:refresh", 1, nx=True, ex=REFRESH_LOCK_TTL):
+            return
+    except Exception as e:
+        logger.error(f"utils/redis- cached. Ошибка блокировки обновления: {key} => {str(e)}")
+        return
+
+    sessions = []
+    refresh_kwargs = {}
+    for name, value in kwargs.items():
+        if isinstance(value, Session):
+            value = SessionLocal()
+            sessions.append(value)
+        refresh_kwargs[name] = value
+    try:
+        await _store(backend, key, await func(*args, **refresh_kwargs), expire, stale)
+    except Exception as e:
+        logger.error(f"utils/redis- cached. Ошибка обновления записи кэша: {key} => {str(e)}")
+    finally:
+        for db in sessions:
+            db.close()
+
+
+# Первый уровень кэша ответов (ResponseCache) - LRU в памяти процесса. Записи хранятся недолго
+# (RESPONSE_CACHE_LOCAL_TTL): сброс тегов в другом процессе виден здесь не позже, чем через это время,
+# сброс в этом процессе удаляет записи с тегом сразу
+class LocalCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ => (срок, теги, закодированное значение)
+        self._keys_by_tag = {}  # тег => ключи записей
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, encoded, tags, ttl):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, tuple(tags), encoded)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def drop_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+
+
+local_cache = LocalCache(settings.RESPONSE_CACHE_LOCAL_SIZE)
+
+
+# Двухуровневый кэш ответов: память процесса (local_cache), затем Redis. Запись в Redis хранит версии
+# своих тегов на момент построения и при чтении сверяется с текущими - сброшенный тег делает запись
+# недействительной. Теги, зависящие от данных (напр. владелец объявления), задаются async-функцией -
+# она вызывается только при промахе, до построения значения
+class ResponseCache:
+    def __init__(self, namespace, expire):
+        self.namespace = namespace
+        self.expire = expire
+
+    def _key(self, params):
+        digest = hashlib.sha1(canonical_json(canonical_params(params)).encode()).hexdigest()
+        return f"{FastAPICache.get_prefix()}:{self.namespace}:{digest}"
+
+    @staticmethod
+    async def _get_versions(backend, tags):
+        tags = list(tags)
+        if not tags:
+            return {}
+        versions = await backend.redis.mget([_tag_key(tag) for tag in tags])
+        return {tag: version or "0" for tag, version in zip(tags, versions)}
+
+    async def _get_remote(self, backend, key):
+        entry = await backend.get(key)
+        if entry is None:
+            return None, None
+        header, encoded = entry.split("\n", 1)
+        versions = json.loads(header)
+        if versions != await self._get_versions(backend, versions):
+            return None, None
+        return encoded, versions
+
+    # Значение из кэша или построенное compute() (None не кэшируется). Возвращается в виде JSON (dict/list)
+    async def get_or_set(self, params, compute, tags=()):
+        coder = FastAPICache.get_coder()
+        if not FastAPICache.get_enable():
+            value = await compute()
+            return coder.decode(coder.encode(value)) if value is not None else None
+
+        backend = FastAPICache.get_backend()
+        key = self._key(params)
+        encoded = local_cache.get(key)
+        if encoded is not None:
+            return coder.decode(encoded)
+
+        try:
+            encoded, versions = await self._get_remote(backend, key)
+            if encoded is not None:
+                local_cache.set(key, encoded, versions, settings.RESPONSE_CACHE_LOCAL_TTL)
+                return coder.decode(encoded)
+            # Версии тегов - до построения значения: сброс во время построения сделает запись недействительной
+            if callable(tags):
+                tags = await tags()
+            versions = await self._get_versions(backend, tags)
+        except Exception as e:
+            logger.error(f"utils/redis- ResponseCache. Ошибка чтения кэша: {key} => {str(e)}")
+            versions = None
+
+        value = await compute()
+        if value is None:
+            return None
+        encoded = coder.encode(value)
+
+        if versions is not None:
+            try:
+                await backend.set(key, f"{json.dumps(versions)}\n{encoded}", self.expire)
+                local_cache.set(key, encoded, versions, settings.RESPONSE_CACHE_LOCAL_TTL)
+            except Exception as e:
+                logger.error(f"utils/redis- ResponseCache. Ошибка записи в кэш: {key} => {str(e)}")
+        return coder.decode(encoded)
+
+
+# Сброс тегов в Redis вне commit: теги копятся в памяти, фоновый поток отправляет их одним pipeline.
+# Commit (в т.ч. в async-эндпоинтах) не ждет Redis. Пока Redis недоступен, теги остаются в очереди
+# и повторяются с растущей паузой (до INVALIDATION_RETRY_MAX) - без попыток соединения на каждый commit
+class TagInvalidator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = set()
+        self._thread = None
+        self._client = None
+
+    def add(self, tags):
+        with self._lock:
+            self._pending.update(tags)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cache-tags", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
+                                       socket_timeout=1, socket_connect_timeout=1)
+        return self._client
+
+    def _send(self, tags):
+        with self._get_client().pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(_tag_key(tag))
+            pipe.execute()
+
+    def _run(self):
+        delay = 0
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                tags, self._pending = self._pending, set()
+                self._wakeup.clear()
+            if not tags:
+                continue
+            try:
+                self._send(tags)
+                delay = 0
+            except Exception as e:
+                logger.error(f"utils/redis- TagInvalidator. Ошибка сброса тегов кэша: {tags} => {str(e)}")
+                with self._lock:
+                    self._pending.update(tags)
+                delay = min(max(delay * 2, 1), INVALIDATION_RETRY_MAX)
+                time.sleep(delay)
+                self._wakeup.set()
+
+
+tag_invalidator = TagInvalidator()
+
+
+# Сброс тегов из синхронного кода (обработчики событий сессии БД): в памяти процесса - сразу,
+# в Redis - фоновым потоком (tag_invalidator)
+def invalidate_cache_tags(*tags):
+    local_cache.drop_tags(tags)
+    if not tags:
+        return
+    try:
+        FastAPICache.get_prefix()
+    except AssertionError:
+        # Кэш не настроен (FastAPICache.init не вызывался) - сбрасывать в Redis нечего
+        return
+    tag_invalidator.add(tags)
+
+
+# Теги записей кэша, которые устаревают при изменении объекта БД: объявление и его связанные записи
+# (фото, местоположение, доп.поля - по ad_id) вместе с лентой, объявления владельца (user:{id} - в карточке
+# объявления), пользователь. Изменение статуса и редактирование объявления - изменения Ad
+def get_object_tags(obj):
+    if isinstance(obj, Ad):
+        return {f"ad:{obj.id}", f"user:{obj.user_id}", "feed"}
+    if isinstance(obj, User):
+        return {f"user:{obj.id}"}
+    ad_id = getattr(obj, "ad_id", None)
+    return {f"ad:{ad_id}", "feed"} if ad_id is not None else set()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault("cache_tags", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        tags.update(get_object_tags(obj))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_cache_tags(session):
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        invalidate_cache_tags(*tags)
 
 
-async def custom_key_builder(
-    func,
-    namespace: Optional[str] = "",
-    request: Request = None,
-    response: Response = None,
-    *args,
-    **kwargs,
-):
-    prefix = FastAPICache.get_prefix()
-    inner_kwargs = kwargs.get('kwargs', {})
-    inner_kwargs.pop('db', None)
-
-    if 'req' in inner_kwargs:
-        json_data = await inner_kwargs['req'].json()
-        inner_kwargs.pop('req', None)
-        inner_kwargs['req'] = str(json_data)
-
-    if 'current_user' in inner_kwargs:
-        if inner_kwargs['current_user']:
-            current_user_id = inner_kwargs['current_user'].id
-            inner_kwargs.pop('current_user', None)
-            inner_kwargs['current_user'] = str(current_user_id)
-        else:
-            inner_kwargs.pop('current_user', None)
-
-    kwargs['kwargs'] = inner_kwargs
-    cache_key = f"{prefix}:{namespace}:{func.__module__}:{func.__name__}:{args}:{kwargs}"
-    return cache_key
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_tags(session):
+    session.info.pop("cache_tags", None)
@@ -0,0 +1,80 @@
+"""
+Бенчмарк карточки объявления (GET /api/v1/items/{key}): кол-во SQL-запросов и задержка p50/p95.
+
+Запуск из каталога mvp_app_with_legacy (нужна база с опубликованными объявлениями, MODE из .env):
+    python -m benchmarks.bench_ad_detail --ads 50 --rounds 5
+По умолчанию кэш ответов отключен - измеряется построение карточки; --cached - с кэшем карточек.
+
+SQL-запросов на карточку без кэша (по опциям загрузки в crud/ad): объявление с местоположением, статусом
+и владельцем с фото - 1, доп.поля и фото - 2, объявления владельца с кол-вом - 1 и их фото, местоположение
+и статус - 3, избранное - 1 (только для авторизованного). Итого 7 (8 с пользователем) независимо от кол-ва
+фото, доп.полей и объявлений владельца. Без этих опций запросы на связи выполнялись по одному при обращении.
+
+Для сравнения "до/после" запустить на нужных коммитах, например:
+    git stash && git checkout <коммит> && python -m benchmarks.bench_ad_detail && git checkout - && git stash pop
+"""
+import argparse
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+from fastapi_cache import FastAPICache
+from sqlalchemy import event
+
+from app.db.db_models import Ad
+from app.db.session import engine, SessionLocal
+from app.main import app
+
+queries = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_queries(conn, cursor, statement, parameters, context, executemany):
+    global queries
+    queries += 1
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    global queries
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ads", type=int, default=50, help="Кол-во объявлений")
+    parser.add_argument("--rounds", type=int, default=5, help="Кол-во проходов по объявлениям")
+    parser.add_argument("--cached", action="store_true", help="С кэшем карточек (utils/redis.ResponseCache)")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        ad_ids = [ad_id for (ad_id,) in db.query(Ad.id).filter(Ad.status_id == 3).limit(args.ads)]
+    if not ad_ids:
+        print("Нет опубликованных объявлений")
+        return
+
+    with TestClient(app) as client:
+        # Кэш ответов включается при запуске приложения: повторные проходы без отключения мерили бы кэш
+        FastAPICache._enable = args.cached
+        # Прогрев (соединения пула, кэши)
+        client.get(f"/api/v1/items/{ad_ids[0]}")
+
+        timings, query_counts = [], []
+        for _ in range(args.rounds):
+            for ad_id in ad_ids:
+                queries = 0
+                start = time.perf_counter()
+                response = client.get(f"/api/v1/items/{ad_id}")
+                timings.append((time.perf_counter() - start) * 1000)
+                query_counts.append(queries)
+                assert response.status_code == 200, response.text
+
+    print(f"Запросов: {len(timings)}")
+    print(f"SQL-запросов на карточку: мин {min(query_counts)}, макс {max(query_counts)}, "
+          f"среднее {statistics.mean(query_counts):.1f}")
+    print(f"Задержка, мс: p50 {percentile(timings, 50):.1f}, p95 {percentile(timings, 95):.1f}")
+
+
+if __name__ == "__main__":
+    main()
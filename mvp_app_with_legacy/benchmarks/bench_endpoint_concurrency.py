@@ -0,0 +1,107 @@
+"""
+Нагрузочный бенчмарк эндпоинтов с синхронной сессией БД: пропускная способность и задержка p50/p95 при
+одновременных запросах. Сравниваются три варианта одного эндпоинта (запрос SELECT pg_sleep - имитация запроса
+к БД заданной длительности):
+    async_blocking - async def с вызовом сессии прямо в event loop (как было в большинстве эндпоинтов),
+    async_run_db   - async def с вызовом через utils/concurrency.run_db,
+    sync_def       - обычный def (FastAPI выполняет его в пуле потоков).
+Параллельно замеряется задержка event loop: насколько позже срабатывает asyncio.sleep(10 мс).
+
+Приложение поднимается в процессе (httpx ASGI), база из настроек, данные не меняются.
+Запуск из каталога mvp_app_with_legacy (MODE из .env):
+    python -m benchmarks.bench_endpoint_concurrency --requests 200 --concurrency 50 --query-ms 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.utils.concurrency import run_db
+from app.utils.dependencies import get_db
+
+MODES = ("async_blocking", "async_run_db", "sync_def")
+
+
+def slow_query(db: Session, seconds):
+    return db.execute(text("SELECT pg_sleep(:seconds)"), {"seconds": seconds}).scalar()
+
+
+def create_app(query_seconds):
+    app = FastAPI()
+
+    @app.get("/async_blocking")
+    async def async_blocking(db: Session = Depends(get_db)):
+        slow_query(db, query_seconds)
+        return {"ok": True}
+
+    @app.get("/async_run_db")
+    async def async_run_db(db: Session = Depends(get_db)):
+        await run_db(slow_query, db, query_seconds)
+        return {"ok": True}
+
+    @app.get("/sync_def")
+    def sync_def(db: Session = Depends(get_db)):
+        slow_query(db, query_seconds)
+        return {"ok": True}
+
+    return app
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def measure(client: httpx.AsyncClient, mode, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    timings, lags = [], []
+    done = asyncio.Event()
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(f"/{mode}")
+            response.raise_for_status()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - start - 0.01) * 1000)
+
+    prober = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await prober
+    return requests / elapsed, statistics.median(timings), percentile(timings, 0.95), max(lags)
+
+
+async def run(args):
+    app = create_app(args.query_ms / 1000)
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        await client.get("/sync_def")  # прогрев пула соединений
+        print(f"Запросов {args.requests}, одновременно {args.concurrency}, запрос к БД {args.query_ms:g} мс")
+        for mode in MODES:
+            rps, p50, p95, lag_max = await measure(client, mode, args.requests, args.concurrency)
+            print(f"{mode:15} {rps:8.1f} запр/с, p50 {p50:8.1f} мс, p95 {p95:8.1f} мс, "
+                  f"макс. задержка event loop {lag_max:8.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200, help="Кол-во запросов на вариант")
+    parser.add_argument("--concurrency", type=int, default=50, help="Одновременных запросов")
+    parser.add_argument("--query-ms", type=float, default=20, help="Длительность запроса к БД, мс")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Микробенчмарк доп.полей категории из 40 полей: проверка полей из запроса и разбор значений
+для карточки объявления. Сравнивается прежний способ (поиск поля перебором списка доп.полей
+и literal_eval для каждого значения) со скомпилированными доп.полями (FieldsValidator).
+
+База данных не нужна. Запуск из каталога mvp_app_with_legacy:
+    python -m benchmarks.bench_fields_validation --fields 40 --rounds 2000
+"""
+import argparse
+import ast
+import statistics
+import time
+
+from app.utils.additional_fields import (
+    FieldsValidator, validate_select_field, validate_checkboxes_field,
+    validate_text_field, validate_number_field, validate_checkbox_field
+)
+
+FIELD_TYPES = ('select', 'checkboxes', 'color', 'text', 'number', 'checkbox')
+
+
+def make_field(index):
+    item_type = FIELD_TYPES[index % len(FIELD_TYPES)]
+    options = [f"option_{i}" for i in range(30)]
+    properties = {
+        'select': {"options": options},
+        'checkboxes': {"checks": options},
+        'color': {"colors": [{"name": name, "hex": "#000000"} for name in options]},
+        'text': {"measure": ""},
+        'number': {"measure": "", "type": "int", "min": 0, "max": 1000000},
+        'checkbox': {},
+    }[item_type]
+    return {
+        "alias": f"field_{index}",
+        "title": f"Поле {index}",
+        "required": index % 2 == 0,
+        "data": {"type": item_type, "edit": True, "show_filter": True, "range": False,
+                 "dependencies": [], "properties": properties}
+    }
+
+
+def make_value(field):
+    return {
+        'select': "option_29",
+        'checkboxes': ["option_1", "option_15", "option_29"],
+        'color': "option_29",
+        'text': "Текстовое значение",
+        'number': "125000",
+        'checkbox': True,
+    }[field['data']['type']]
+
+
+# Прежняя проверка поля-цвета (перечень цветов собирается заново при каждой проверке)
+def validate_color_field(validate_list, required, invalid_data, key, value):
+    validate_list = [color['name'] for color in validate_list]
+
+    if not isinstance(value, str):
+        invalid_data['aliases'][key] = "Неправильный тип данных"
+    elif not value and required:
+        invalid_data['aliases'][key] = "Обязательное поле"
+    elif value and value not in validate_list:
+        invalid_data['aliases'][key] = "Недопустимое значение"
+
+
+# Прежняя проверка: поиск доп.поля перебором списка для каждого ключа запроса
+def legacy_validate(catalog_data, validate_data):
+    invalid_data = {'error': "", 'aliases': {}}
+    for key, value in validate_data.items():
+        catalog_item = [item for item in catalog_data['additional_fields'] if item.get('alias') == key]
+        if not catalog_item:
+            invalid_data['aliases'][key] = "Ошибка входных данных. В каталоге нет такого поля"
+            continue
+        required = catalog_item[0]['required']
+        item_type = catalog_item[0]['data']['type']
+        item_properties = catalog_item[0]['data']['properties']
+        if item_type == 'select':
+            validate_select_field(item_properties['options'], required, invalid_data, key, value)
+        elif item_type == 'checkboxes':
+            validate_checkboxes_field(item_properties['checks'], required, invalid_data, key, value)
+        elif item_type == 'color':
+            validate_color_field(item_properties['colors'], required, invalid_data, key, value)
+        elif item_type == 'text':
+            validate_text_field(required, invalid_data, key, value)
+        elif item_type == 'number':
+            validate_number_field(item_properties, required, invalid_data, key, value)
+        elif item_type == 'checkbox':
+            validate_checkbox_field(invalid_data, key, value)
+    return invalid_data
+
+
+# Прежний вывод карточки: поиск доп.поля перебором и literal_eval для каждого значения
+def legacy_render(additional_fields, adv_fields):
+    fields = {}
+    for key, value in adv_fields:
+        matching_field = next((item for item in additional_fields if item['alias'] == key), None)
+        if matching_field:
+            try:
+                fields[matching_field['title']] = ast.literal_eval(value)
+            except (SyntaxError, ValueError):
+                lowered = value.lower()
+                fields[matching_field['title']] = True if lowered == "true" else False if lowered == "false" else value
+    return fields
+
+
+def compiled_render(validator, adv_fields):
+    return {validator.fields[key]['title']: validator.decode(key, value) for key, value in adv_fields}
+
+
+def measure(func, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fields", type=int, default=40, help="Кол-во доп.полей категории")
+    parser.add_argument("--rounds", type=int, default=2000, help="Кол-во повторов")
+    args = parser.parse_args()
+
+    catalog_data = {"additional_fields": [make_field(i) for i in range(args.fields)]}
+    data = {field['alias']: make_value(field) for field in catalog_data['additional_fields']}
+    adv_fields = [(key, str(value)) for key, value in data.items()]  # как в AdFields
+
+    start = time.perf_counter()
+    validator = FieldsValidator(catalog_data['additional_fields'])
+    compile_time = (time.perf_counter() - start) * 1_000_000
+
+    assert legacy_validate(catalog_data, data) == validator.validate(data, None)
+    assert legacy_render(catalog_data['additional_fields'], adv_fields) == compiled_render(validator, adv_fields)
+
+    results = {
+        "Проверка (прежняя)": measure(lambda: legacy_validate(catalog_data, data), args.rounds),
+        "Проверка (FieldsValidator)": measure(lambda: validator.validate(data, None), args.rounds),
+        "Вывод карточки (прежний)": measure(
+            lambda: legacy_render(catalog_data['additional_fields'], adv_fields), args.rounds),
+        "Вывод карточки (FieldsValidator)": measure(lambda: compiled_render(validator, adv_fields), args.rounds),
+    }
+
+    print(f"Доп.полей: {args.fields}, компиляция: {compile_time:.0f} мкс (один раз на загрузку каталога)")
+    for name, median in results.items():
+        print(f"{name}: медиана {median:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Бенчмарк обработки фото объявления: время на фото и общее время на корпусе фотографий с телефона (12 Мп).
+Сравнивается прежний способ обработки (два разбора файла, каждый вариант из исходного размера, водяной
+знак с диска для каждого варианта) с сохранением мастера при загрузке (utils/image.process_image)
+и получением из него всех вариантов (utils/image.render_variant, при первом запросе варианта).
+
+Запуск из каталога mvp_app_with_legacy:
+    python -m benchmarks.bench_image_pipeline --corpus /path/to/photos
+Без --corpus генерируется синтетический корпус JPEG 4032x3024 (половина с EXIF Orientation=6):
+    python -m benchmarks.bench_image_pipeline --generate 20
+"""
+import argparse
+import io
+import math
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+from pillow_heif import register_heif_opener
+
+from app.schemas.ad import PostImageResolutions
+from app.utils.image import process_image, render_variant, get_master_path, get_watermark
+
+PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".heic", ".heif", ".png", ".webp"}
+
+
+# Прежняя обработка фото (до пула процессов и однократного декодирования) - для сравнения
+def legacy_process_image(image_content, road):
+    def save(image, resolution):
+        Path(f"./files/{road}").mkdir(parents=True, exist_ok=True)
+        image.save(f"./files/{road}/{resolution}.webp", format="webp")
+
+    def add_watermark(image, size, step):
+        watermark = Image.open("./static/watermark.png")
+        watermark = watermark.resize(size)
+        image.paste(watermark, (image.size[0] - size[0] - step, image.size[1] - size[1] - step), watermark)
+
+    register_heif_opener()
+    orientation_value = 1
+    with io.BytesIO(image_content) as f:
+        im = Image.open(f)
+        if hasattr(im, '_getexif'):
+            exif = im._getexif()
+            if exif is not None:
+                orientation_value = exif.get(274, 1)
+
+    im = Image.open(io.BytesIO(image_content)).convert("RGB")
+    if orientation_value == 3:
+        im = im.rotate(180, expand=True)
+    elif orientation_value == 6:
+        im = im.rotate(-90, expand=True)
+    elif orientation_value == 8:
+        im = im.rotate(90, expand=True)
+
+    width, height = im.size
+    aspect_ratio = height / width
+    if aspect_ratio > 0.75:
+        new_height = 960
+        new_width = math.ceil(new_height / aspect_ratio)
+    elif aspect_ratio < 0.75:
+        new_width = 1280
+        new_height = math.ceil(new_width * aspect_ratio)
+    else:
+        new_width, new_height = 1280, 960
+    im1 = im.resize((new_width, new_height))
+    add_watermark(im1, (120, 54), 20)
+    save(im1, "1280x960")
+    im2 = im.resize((math.ceil(new_width / 2), math.ceil(new_height / 2)))
+    add_watermark(im2, (90, 40), 10)
+    save(im2, "640x480")
+
+    if width > height:
+        cropped = (width - height) / 2
+        square = im.crop((cropped, 0, width - cropped, height)).resize((300, 300))
+    elif width < height:
+        cropped = (height - width) / 2
+        square = im.crop((0, cropped, width, height - cropped)).resize((300, 300))
+    else:
+        square = im.resize((300, 300))
+    save(square, "300x300")
+    square.thumbnail((200, 200))
+    save(square, "200x200")
+    square.thumbnail((100, 100))
+    save(square, "100x100")
+    return road
+
+
+# Все варианты фото из мастера (как при первом запросе каждого варианта)
+def render_all_variants(image_content, road):
+    for resolution in PostImageResolutions:
+        render_variant(get_master_path(road), f"./files/variants{road}/{resolution.value}.webp", resolution.value)
+
+
+# Синтетическое фото 4032x3024 (12 Мп) с деталями, близкими к фото по сжимаемости
+def generate_photo(index):
+    image = Image.effect_noise((4032, 3024), 40).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, 4032, 96):
+        draw.rectangle((i, (i * 7 + index * 131) % 3024, i + 80, 3024), fill=((i + index * 50) % 256, 90, 160))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+
+    exif = Image.Exif()
+    if index % 2:
+        exif[274] = 6
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def load_corpus(corpus):
+    paths = sorted(path for path in Path(corpus).iterdir() if path.suffix.lower() in PHOTO_EXTENSIONS)
+    return [path.read_bytes() for path in paths]
+
+
+def measure(func, photos, name=None):
+    timings = []
+    for index, photo in enumerate(photos):
+        start = time.perf_counter()
+        func(photo, f"/{name or func.__name__}/{index}")
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Каталог с фотографиями (jpg, heic, png, webp)")
+    parser.add_argument("--generate", type=int, default=10, help="Кол-во синтетических фото без --corpus")
+    args = parser.parse_args()
+
+    register_heif_opener()
+    photos = load_corpus(args.corpus) if args.corpus else [generate_photo(i) for i in range(args.generate)]
+    if not photos:
+        print("Нет фотографий")
+        return
+
+    static_dir = Path("./static").resolve()
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        # Варианты пишутся в ./files временного каталога, водяной знак - из ./static проекта
+        os.chdir(workdir)
+        os.symlink(static_dir, "static")
+        get_watermark.cache_clear()
+
+        results = {
+            "Прежняя обработка": measure(legacy_process_image, photos),
+            "Загрузка (process_image, мастер)": measure(process_image, photos),
+            "Все варианты из мастера (render_variant)": measure(render_all_variants, photos, "process_image"),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    print(f"Фото: {len(photos)}, средний размер {statistics.mean(map(len, photos)) / 1024 / 1024:.1f} МБ")
+    for name, timings in results.items():
+        print(f"{name}: медиана {statistics.median(timings):.0f} мс/фото, всего {sum(timings) / 1000:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Бенчмарк поиска по радиусу: время запроса объявлений в радиусе в зависимости от кол-ва точек в ad_geo_points.
+Сравнивается запрос с предфильтром по индексу (lat, long) (crud/geo.get_radius_subquery) с вычислением
+расстояния для всех точек (без ограничивающего прямоугольника).
+
+Точки генерируются в транзакции, которая в конце откатывается - данные базы не меняются.
+Запуск из каталога mvp_app_with_legacy (база из настроек, MODE из .env):
+    python -m benchmarks.bench_radius_search --sizes 10000 100000 1000000 --radius 25
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from app.crud.geo import distance_expression, get_radius_subquery
+from app.db.db_models import AdGeoPoint
+from app.db.session import engine
+
+# Точки - равномерно по прямоугольнику европейской части России, центры поиска - крупные города
+AREA = (43.0, 65.0, 28.0, 60.0)  # lat_min, lat_max, long_min, long_max
+CENTERS = [(55.7558, 37.6173), (59.9343, 30.3351), (56.8389, 60.6057), (55.7963, 49.1088), (47.2357, 39.7015)]
+
+
+def fill_points(db: Session, count):
+    lat_min, lat_max, long_min, long_max = AREA
+    db.execute(text(
+        "INSERT INTO ad_geo_points (ad_id, lat, long) "
+        "SELECT gen_random_uuid(), :lat_min + random() * :lat_span, :long_min + random() * :long_span "
+        "FROM generate_series(1, :count)"
+    ), {"lat_min": lat_min, "lat_span": lat_max - lat_min, "long_min": long_min, "long_span": long_max - long_min,
+        "count": count})
+    db.execute(text("ANALYZE ad_geo_points"))
+
+
+def indexed_query(db: Session, lat, long, radius):
+    subquery = get_radius_subquery(lat, long, radius, db)
+    return db.query(func.count()).select_from(subquery).filter(subquery.c.distance <= radius * 1000)
+
+
+def full_scan_query(db: Session, lat, long, radius):
+    distance = distance_expression(lat, long)
+    return db.query(func.count()).select_from(AdGeoPoint).filter(distance <= radius * 1000)
+
+
+def measure(db: Session, build_query, radius, rounds):
+    timings, found = [], []
+    for _ in range(rounds):
+        lat, long = random.choice(CENTERS)
+        start = time.perf_counter()
+        found.append(build_query(db, lat, long, radius).scalar())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), statistics.mean(found)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Кол-во точек (по возрастанию)")
+    parser.add_argument("--radius", type=float, default=25, help="Радиус, км")
+    parser.add_argument("--rounds", type=int, default=50, help="Кол-во запросов на замер")
+    args = parser.parse_args()
+
+    AdGeoPoint.__table__.create(bind=engine, checkfirst=True)
+    random.seed(0)
+
+    with Session(bind=engine) as db:
+        try:
+            total = db.query(func.count()).select_from(AdGeoPoint).scalar()
+            print(f"Радиус {args.radius:g} км, медиана по {args.rounds} запросам")
+            for size in sorted(args.sizes):
+                if size > total:
+                    fill_points(db, size - total)
+                    total = size
+                indexed_ms, found = measure(db, indexed_query, args.radius, args.rounds)
+                full_scan_ms, _ = measure(db, full_scan_query, args.radius, args.rounds)
+                print(f"Точек {total}: с предфильтром {indexed_ms:.2f} мс, без предфильтра {full_scan_ms:.2f} мс, "
+                      f"найдено в среднем {found:.0f}")
+        finally:
+            db.rollback()
+
+
+if __name__ == "__main__":
+    main()
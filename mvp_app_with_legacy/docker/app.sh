@@ -4,4 +4,4 @@ alembic upgrade head
 
 cd app
 
-gunicorn main:app --workers 1 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
+gunicorn main:app --workers ${APP_WORKERS:-1} --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
@@ -78,6 +78,43 @@ def test_get_all_ads(test_client):
         assert isinstance(item["created_at"], str)
 
 
+def test_get_all_ads_by_cursor(test_client):
+    request_data = {
+        "sort": "date_desc",
+        "limit": 2
+    }
+
+    response = test_client.post("/api/v1/items", json=request_data)
+
+    assert response.status_code == 200
+    assert "next_cursor" in response.json()
+
+    first_page_ids = [item["id"] for item in response.json()["items"]]
+    next_cursor = response.json()["next_cursor"]
+
+    # Если есть следующая страница, то по курсору получаем объявления без повторов
+    if next_cursor:
+        request_data["cursor"] = next_cursor
+        response = test_client.post("/api/v1/items", json=request_data)
+
+        assert response.status_code == 200
+        second_page_ids = [item["id"] for item in response.json()["items"]]
+        assert second_page_ids
+        assert not set(first_page_ids) & set(second_page_ids)
+
+
+def test_get_all_ads_by_invalid_cursor(test_client):
+    request_data = {
+        "sort": "date_desc",
+        "limit": 2,
+        "cursor": "invalid_cursor"
+    }
+
+    response = test_client.post("/api/v1/items", json=request_data)
+
+    assert response.status_code == 400
+
+
 def test_get_catalog_from_ad(test_client, test_ad, test_db, cleanup_ad, cleanup_catalog, cleanup_user):
     # Сохраняем объявление в базе данных
     test_db.add(test_ad)
@@ -10,3 +10,332 @@ def test_simple_function():
     # Проверяем, что пользователь успешно сохранен в базе данных
     assert a+b == 3
     assert b-a == 1
+
+
+def test_parse_coordinates():
+    """
+    Тест разбора координат для поиска по радиусу.
+    """
+    from app.crud.geo import parse_coordinates
+
+    assert parse_coordinates("55.75", "37.61") == (55.75, 37.61)
+    assert parse_coordinates(None, "37.61") is None
+    assert parse_coordinates("abc", "37.61") is None
+    assert parse_coordinates(91, 0) is None
+    assert parse_coordinates(0, -181) is None
+
+
+def test_parse_typed_value():
+    """
+    Тест разбора типизированных значений доп.полей для фильтров.
+    """
+    from app.crud.field_values import parse_typed_value
+
+    assert parse_typed_value("2015") == (2015.0, None)
+    assert parse_typed_value("1.6") == (1.6, None)
+    assert parse_typed_value(120) == (120.0, None)
+    assert parse_typed_value(True) == (None, True)
+    assert parse_typed_value("False") == (None, False)
+    assert parse_typed_value("седан") is None
+    assert parse_typed_value("12a") is None
+
+
+def test_build_catalog_tree():
+    """
+    Тест построения дерева каталога за один проход.
+    """
+    from types import SimpleNamespace
+    from app.crud.catalog import build_catalog_tree
+
+    def item(item_id, parent_id=None):
+        path = {"view": f"/{item_id}", "publish": f"/publish/{item_id}", "id": item_id}
+        title = {"view": item_id, "publish": item_id, "view_translit": item_id,
+                 "publish_translit": item_id, "filter": item_id, "price": ""}
+        return SimpleNamespace(
+            id=item_id, parent_id=parent_id, is_publish=True,
+            path=[SimpleNamespace(to_dict=lambda: dict(path))],
+            title=[SimpleNamespace(to_dict=lambda: dict(title))]
+        )
+
+    # Дочерний элемент идет раньше родителя
+    roots, nodes = build_catalog_tree([item("c", "b"), item("a"), item("b", "a"), item("d", "a")])
+
+    assert [root["id"] for root in roots] == ["a"]
+    assert "id" not in roots[0]["path"]
+    assert [node["id"] for node in roots[0]["sub_categories"]] == ["b", "d"]
+    assert nodes["b"]["sub_categories"][0]["id"] == "c"
+    assert nodes["c"]["path"]["id"] == "c"
+
+
+def test_decode_field_values():
+    """
+    Тест разбора значений доп.полей объявления для карточки.
+    """
+    from app.utils.additional_fields import decode_literal, decode_checkbox, decode_number
+
+    assert decode_literal("['a', 'b']") == ['a', 'b']
+    assert decode_literal("BMW") == "BMW"
+    assert decode_literal("2020") == 2020
+    assert decode_literal("05") == "05"
+    assert decode_literal("true") is True
+    assert decode_checkbox("False") is False
+    assert decode_number("125000") == 125000
+    assert decode_number("1.5") == 1.5
+    assert decode_number("abc") == "abc"
+
+
+def test_get_image_road():
+    """
+    Тест пути фото по содержимому: одинаковые фото хранятся в одном каталоге.
+    """
+    from app.utils.image import get_image_road
+
+    road = get_image_road(b"photo")
+    assert road == get_image_road(b"photo")
+    assert road != get_image_road(b"other photo")
+    assert road.startswith("/") and road.count("/") == 5
+
+
+def test_similarity():
+    """
+    Тест оценки похожести объявлений: цена, местоположение и ключевые доп.поля.
+    """
+    from app.crud.similar import SimilarProfile, similarity, fields_similarity
+
+    ad = SimilarProfile(1, 1000000, 55.75, 37.61, {"brand": "BMW", "year": 2015.0})
+    close = SimilarProfile(2, 950000, 55.76, 37.62, {"brand": "BMW", "year": 2016.0})
+    far = SimilarProfile(3, 300000, 59.93, 30.31, {"brand": "Lada", "year": 2005.0})
+
+    assert similarity(ad, close) == similarity(close, ad)
+    assert similarity(ad, close) > similarity(ad, far)
+    assert fields_similarity({"brand": "BMW"}, {}) == 0.0
+    assert fields_similarity({"year": 0.0}, {"year": 0.0}) == 1.0
+    assert similarity(SimilarProfile(4, None), SimilarProfile(5, 0)) == 0.0
+
+
+def test_circuit_breaker():
+    """
+    Тест отключения сервиса звонков после ошибок подряд.
+    """
+    from app.utils.phone import CircuitBreaker, format_telefon_ip_phone
+
+    breaker = CircuitBreaker(max_failures=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+    assert format_telefon_ip_phone("+79001234567") == "89001234567"
+
+
+def test_telephony_provider_setting():
+    """
+    Тест выбора сервиса звонков: fake - только в тестовом режиме, неизвестное имя - ошибка.
+    """
+    import asyncio
+
+    import pytest
+    from app.utils.phone import get_provider, FakeTelephonyProvider, TelephonyProvider, VoicePasswordProvider
+
+    assert isinstance(get_provider("fake", "TEST"), FakeTelephonyProvider)
+    assert isinstance(get_provider("voicepassword", "PROD"), VoicePasswordProvider)
+    with pytest.raises(ValueError):
+        get_provider("fake", "PROD")
+    with pytest.raises(ValueError):
+        get_provider("unknown", "TEST")
+    with pytest.raises(TypeError):
+        TelephonyProvider()
+    assert asyncio.run(get_provider("fake", "TEST").call(None, "+79001234567")) == {"result": "ok", "code": "4567"}
+
+
+def test_canonical_cache_params():
+    """
+    Тест канонических аргументов ключа кэша: порядок фильтров не влияет на ключ.
+    """
+    from uuid import UUID
+    from app.utils.redis import canonical_params
+
+    key = UUID("fb9ef210-10dc-4c4f-8261-448fb368faca")
+    params = canonical_params({"key": key, "filters": '{"year": 2015, "brand": "BMW"}', "db": None})
+    assert params == canonical_params({"db": None, "filters": '{"brand": "BMW", "year": 2015}', "key": key})
+    assert params["key"] == str(key)
+    assert canonical_params({"ids": {3, 1, 2}}) == {"ids": [1, 2, 3]}
+
+
+def test_local_response_cache():
+    """
+    Тест кэша ответов в памяти процесса: вытеснение давно не читанных записей и сброс по тегу.
+    """
+    from app.utils.redis import LocalCache
+
+    cache = LocalCache(maxsize=2)
+    cache.set("a", "1", ["feed"], 60)
+    cache.set("b", "2", ["ad:1"], 60)
+    assert cache.get("a") == "1"
+    cache.set("c", "3", ["feed"], 60)
+    assert cache.get("b") is None
+    cache.drop_tags(["feed"])
+    assert cache.get("a") is None and cache.get("c") is None
+    cache.set("d", "4", [], -1)
+    assert cache.get("d") is None
+
+
+def test_rank_cursor_pages_through_ties():
+    """
+    Тест курсора по релевантности: rank (float4 из ts_rank_cd) приводится к float8, объявления с одинаковым rank
+    не выпадают между страницами.
+    """
+    from sqlalchemy import Column, Float, MetaData, REAL, String, Table, select
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.orm import Session
+    from app.crud.search import get_search_subquery
+    from app.db.session import engine
+    from app.utils.pagination import encode_cursor, decode_cursor, keyset_clause
+
+    compiled = str(get_search_subquery("bmw", Session()).compile(dialect=postgresql.dialect()))
+    assert "CAST(ts_rank_cd(" in compiled and "AS FLOAT(53))" in compiled
+
+    # rank хранится как REAL - тот же тип, что возвращает ts_rank_cd
+    items = Table("rank_cursor_items", MetaData(), Column("rank", REAL), Column("id", String),
+                  prefixes=["TEMPORARY"])
+    ranks = [0.1, 0.1, 0.1, 0.1, 0.05]
+    ids = [f"fb9ef210-10dc-4c4f-8261-448fb368fac{i}" for i in range(len(ranks))]
+    # Таблица создается в транзакции, которая в конце откатывается
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            items.create(connection)
+            connection.execute(items.insert(), [{"rank": rank, "id": ad_id} for rank, ad_id in zip(ranks, ids)])
+            ranked = select(items.c.id, items.c.rank.cast(Float(53)).label("rank")).subquery()
+
+            seen, cursor = [], None
+            while True:
+                query = select(ranked).order_by(ranked.c.rank.desc(), ranked.c.id.desc()).limit(2)
+                if cursor:
+                    value, cursor_id = decode_cursor(cursor, "relevance", "rank")
+                    query = query.where(keyset_clause(ranked.c.rank, ranked.c.id, True, value, str(cursor_id)))
+                rows = connection.execute(query).all()
+                if not rows:
+                    break
+                seen.extend(row.id for row in rows)
+                cursor = encode_cursor("relevance", rows[-1].rank, rows[-1].id)
+        finally:
+            transaction.rollback()
+
+    assert sorted(seen) == sorted(ids)
+
+
+def test_views_buffer_requeue():
+    """
+    Тест буфера просмотров: пакет, не записанный из-за ошибки БД, возвращается в буфер, после max_retries - снимается.
+    """
+    from app.crud.views import ViewsBuffer
+
+    class BrokenSession:
+        def query(self, *args):
+            raise RuntimeError("db is down")
+
+        def rollback(self):
+            pass
+
+    class Views:
+        __tablename__ = "views"
+        device_id = None
+        adv_viewed_id = None
+
+    class Counter:
+        class_ = None
+
+    buffer = ViewsBuffer(Views, 'adv_viewed_id', Counter, max_retries=2)
+    assert buffer.add("ad", "device")
+    assert buffer.flush(BrokenSession()) == 0
+    assert buffer.drain() == [("ad", "device", None)]
+
+    buffer.requeue([("ad", "device", None)])
+    assert not buffer.add("ad", "device")
+    assert buffer.flush(BrokenSession()) == 0
+    assert buffer.drain() == []
+    assert buffer.add("ad", "device")
+
+
+def test_user_presence_requeue():
+    """
+    Тест присутствия: активность, не записанная из-за ошибки БД, возвращается в буфер без потери более новой.
+    """
+    from datetime import datetime
+
+    from app.crud.presence import UserPresence
+
+    class BrokenSession:
+        def bulk_update_mappings(self, *args):
+            raise RuntimeError("db is down")
+
+        def rollback(self):
+            pass
+
+    presence = UserPresence()
+    presence._last_seen = {"a": datetime(2024, 1, 1, 12), "b": datetime(2024, 1, 1, 12)}
+    assert presence.flush(BrokenSession()) == 0
+    assert presence.last_seen("a") == datetime(2024, 1, 1, 12)
+
+    presence._last_seen["b"] = datetime(2024, 1, 1, 13)
+    presence.requeue({"b": datetime(2024, 1, 1, 12)})
+    assert presence.last_seen("b") == datetime(2024, 1, 1, 13)
+
+
+def test_catalog_registry_shared_version():
+    """
+    Тест реестра каталога: изменение общей версии каталога (тег "catalog" в Redis) сбрасывает реестр процесса.
+    """
+    from app.crud.catalog import CatalogRegistry
+
+    registry = CatalogRegistry()
+    registry._metadata = metadata = object()
+    registry.sync_version(None)
+    assert registry._metadata is metadata
+    registry.sync_version(3)
+    assert registry._metadata is None
+    registry._metadata = metadata
+    registry.sync_version(3)
+    assert registry._metadata is metadata
+
+
+def test_get_car_path():
+    """
+    Тест заполненных шагов выбора автомобиля: шаги заполняются строго по порядку.
+    """
+    from app.crud.car import get_car_path
+    from app.schemas.car import Car
+
+    assert get_car_path(Car()) == []
+    assert get_car_path(Car(brand="BMW", model="X5", year_of_issue=2015)) == ["BMW", "X5", 2015]
+    assert get_car_path(Car(brand="BMW", year_of_issue=2015)) is None
+
+
+def test_car_tree_suggestion():
+    """
+    Тест справочника автомобилей: NULL - в конце списка значений, для модификации - комплектации и completedFields.
+    """
+    from types import SimpleNamespace
+    from app.crud.car import CarTree
+
+    def row(body_type, complectation, power):
+        return SimpleNamespace(mark="BMW", model="X5", yearFrom=2014, yearTo=2016, bodyType=body_type, doors=5,
+                               generation="F15", fuelType="Дизель", driveType="Полный", transmission="Автомат",
+                               modification="30d", complectation=complectation, power=power, engineSize=3.0)
+
+    tree = CarTree([row(None, "Base", 249), row("Внедорожник", "M Sport", 249), row("Внедорожник", None, 249)],
+                   ["Audi", "BMW"], version=None)
+
+    assert tree.suggestion([]) == {"name": "brand", "values": ["Audi", "BMW"]}
+    assert tree.suggestion(["BMW", "X5"])["values"] == [2014, 2015, 2016]
+    assert tree.suggestion(["BMW", "X5", 2015]) == {"name": "bodytype", "values": ["Внедорожник", None]}
+
+    path = ["BMW", "X5", 2015, "Внедорожник", 5, "F15", "Дизель", "Полный", "Автомат", "30d"]
+    assert tree.suggestion(path) == {
+        "name": "complectation", "values": ["M Sport", None],
+        "completedFields": [{"name": "power", "value": 249}, {"name": "enginesize", "value": 3.0}]
+    }
+    assert tree.allowed_values(path[:3]) == frozenset({"Внедорожник", "None"})
+    assert tree.find(["Audi"]) is None